@@ -0,0 +1,662 @@
+"""
+Load tests the API against a database full of made up users, so that changes can be checked for slowdowns.
+
+First create a database to test against, using the data from generator.py:
+    python benchmark.py seed --dir bench --teachers 100 --students 5000
+
+Then run the benchmark, saving the results as a baseline:
+    python benchmark.py run --dir bench --concurrency 16 --save baseline.json
+
+After making a change, run it again and compare against the baseline.
+This exits with an error if any route got noticeably slower or started making more queries:
+    python benchmark.py run --dir bench --concurrency 16 --compare baseline.json
+
+`run` starts the server itself, using the database in `--dir`. Pass `--url` to test a server which is already running.
+Queries per request are read from the Server-Timing header the server sends back.
+
+`connections` times building class overviews (the work behind GET /api/v1/classes) from several threads at once,
+with connections shared through a ConnectionPool, and with a new connection for every query as there used to be:
+    python benchmark.py connections --dir bench --threads 1,16
+
+`encode` times turning rows from the database into a JSON response, per row: through pydantic models and
+FastAPI's jsonable_encoder as routes used to, and through the records and RecordResponse that list routes use now:
+    python benchmark.py encode --dir bench --rows 1000
+
+`bulk` times giving every student in a class their own homework on a copy of the database,
+committing each row on its own, in one transaction, and with `_insert_many`:
+    python benchmark.py bulk --dir bench --students 500
+
+`--background` keeps another scenario running the whole time, to see how cheap requests fare next to expensive ones.
+For example, the latency of GET /api/v1/users/@me while 4 clients keep asking for class overviews:
+    python benchmark.py run --dir bench --concurrency 100 --scenarios me --background classes --background-concurrency 4
+
+Logging in hashes the password on PasswordHasher's bounded pool, and answers 503 once too many are waiting,
+which shows up as errors. With `online` timed alongside, it also shows whether the event loop stays free:
+    python benchmark.py run --dir bench --concurrency 200 --scenarios login
+    python benchmark.py run --dir bench --concurrency 4 --scenarios online --background login --background-concurrency 50
+
+`first_page` and `deep_page` get 50 events from the start and from near the end of the list.
+With keyset pagination they should take about as long as each other, however many events there are:
+    python benchmark.py run --dir bench --scenarios first_page,deep_page
+
+The `mixed` scenario sends reads and writes at the same time. With several workers, it shows how well they share the file:
+    python benchmark.py run --dir bench --workers 4 --scenarios mixed
+
+`storage` skips the server, and times the same mix of reads and writes straight against a copy of the database
+from several processes, once for each journal mode, so the settings in StorageProfile can be compared:
+    python benchmark.py storage --dir bench --processes 4 --journal-modes WAL,DELETE
+
+This needs httpx, which the server itself doesn't: `pip install httpx`.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+import httpx
+
+SERVER_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SERVER_DIR)
+
+from database import (ClassDB, ConnectionPool, EventDB, HomeworkDB, MarkDB, StorageProfile,  # noqa: E402
+                      SubjectsDB, UserSubjectDB)
+from generator import DAY, MS, PASSWORD, Scale, generate, session_for  # noqa: E402
+
+# How many of the requests in the mixed scenarios are writes.
+WRITE_FRACTION = 0.2
+# How many items the paging scenarios ask for at once.
+PAGE_SIZE = 50
+
+
+# ------------------
+# SEEDING
+# ------------------
+
+
+def seed(directory: str, scale: Scale, seed: int = 0) -> None:
+    """
+    Creates `directory/databases/main.db`, filled with teachers, students, and everything they own.
+    """
+    # The server expects to be run from a directory with a database folder and the web client in it.
+    os.makedirs(os.path.join(directory, "databases"), exist_ok=True)
+    web = os.path.join(directory, "web")
+    if not os.path.exists(web):
+        os.symlink(os.path.join(SERVER_DIR, "web"), web)
+    path = os.path.join(directory, "databases", "main.db")
+    if os.path.exists(path):
+        raise SystemExit(f"{path} already exists.")
+    counts = generate(path, scale, seed)
+    print(f"Seeded {sum(counts.values())} rows.")
+
+
+# ------------------
+# RUNNING
+# ------------------
+
+
+class Context:
+    """
+    IDs picked out of the seeded database for the scenarios to use.
+    """
+
+    def __init__(self, path: str, seed: int = 0):
+        rng = random.Random(seed)
+        db = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        students = [row[0] for row in db.execute(
+            "SELECT uid FROM users WHERE permissions = 0 ORDER BY uid")]
+        # Logging in replaces a user's session, so the users who log in are kept apart from everyone else.
+        rng.shuffle(students)
+        self.login_users = [row[0] for row in db.execute(
+            f"SELECT username FROM users WHERE uid IN ({', '.join(map(str, students[:200]))})")]
+        self.students = students[200:] or students
+        self.class_homework = db.execute("""SELECT c.teacher_id, c.class_id, h.homework_id
+FROM classes AS c JOIN homework AS h ON h.class_id = c.class_id AND h.user_id IS NULL""").fetchall()
+        self.teachers = sorted({row[0] for row in self.class_homework})
+        self.public_events = [row[0] for row in db.execute(
+            "SELECT event_id FROM events WHERE private = 0 ORDER BY event_id")]
+        db.close()
+        self.rng = rng
+
+    def student(self) -> dict:
+        return {"Authorization": f"Bearer {session_for(self.rng.choice(self.students))}"}
+
+    def teacher(self, teacher_id: Optional[int] = None) -> dict:
+        teacher_id = teacher_id or self.rng.choice(self.teachers)
+        return {"Authorization": f"Bearer {session_for(teacher_id)}"}
+
+
+def login(ctx: Context) -> tuple:
+    return "POST", "/api/v1/auth/login", {"data": {"username": ctx.rng.choice(ctx.login_users), "password": PASSWORD}}
+
+
+def online(ctx: Context) -> tuple:
+    return "GET", "/onlineCheck", {}
+
+
+def me(ctx: Context) -> tuple:
+    return "GET", "/api/v1/users/@me", {"headers": ctx.student()}
+
+
+def timetable(ctx: Context) -> tuple:
+    return "GET", "/api/v1/timetable", {"headers": ctx.student()}
+
+
+def homework(ctx: Context) -> tuple:
+    return "GET", "/api/v1/homework", {"headers": ctx.student()}
+
+
+def classes(ctx: Context) -> tuple:
+    return "GET", "/api/v1/classes", {"headers": ctx.teacher()}
+
+
+def class_homework(ctx: Context) -> tuple:
+    teacher_id, class_id, homework_id = ctx.rng.choice(ctx.class_homework)
+    return "GET", f"/api/v1/classes/{class_id}/homework/{homework_id}", {"headers": ctx.teacher(teacher_id)}
+
+
+def search(ctx: Context) -> tuple:
+    name = ctx.rng.choice(("stud", "teach", "ent1", "er2"))
+    return "GET", f"/api/v1/users/search/{name}", {"headers": ctx.teacher()}
+
+
+def first_page(ctx: Context) -> tuple:
+    return "GET", "/api/v1/events", {"headers": ctx.student(), "params": {"limit": PAGE_SIZE}}
+
+
+def deep_page(ctx: Context) -> tuple:
+    # A cursor from the last tenth of the list, which an OFFSET would have to count all the way up to.
+    deep = ctx.public_events[len(ctx.public_events) * 9 // 10:-PAGE_SIZE] or ctx.public_events
+    cursor = str(ctx.rng.choice(deep))
+    return "GET", "/api/v1/events", {"headers": ctx.student(), "params": {"limit": PAGE_SIZE, "cursor": cursor}}
+
+
+def create_homework(ctx: Context) -> tuple:
+    due_date = (int(time.time()) + ctx.rng.randint(1, 28) * DAY) * MS
+    return "POST", "/api/v1/homework", {"headers": ctx.student(), "data": {"name": "Benchmark", "due_date": due_date}}
+
+
+def mixed(ctx: Context) -> tuple:
+    # Students mostly read their timetable and homework, but some of them are adding homework at the same time.
+    if ctx.rng.random() < WRITE_FRACTION:
+        return create_homework(ctx)
+    return ctx.rng.choice((timetable, homework))(ctx)
+
+
+# Each scenario picks a request to make, as (method, url, arguments for httpx).
+SCENARIOS: Dict[str, Callable[[Context], tuple]] = {
+    "online": online,
+    "login": login,
+    "me": me,
+    "timetable": timetable,
+    "homework": homework,
+    "classes": classes,
+    "class_homework": class_homework,
+    "search": search,
+    "first_page": first_page,
+    "deep_page": deep_page,
+    "create_homework": create_homework,
+    "mixed": mixed,
+}
+
+QUERIES = re.compile(r'desc="(\d+) queries"')
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+async def run_scenario(client: httpx.AsyncClient, ctx: Context, make_request, requests: int, concurrency: int) -> dict:
+    latencies, queries, errors = [], [], 0
+    remaining = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for _ in remaining:
+            method, url, kwargs = make_request(ctx)
+            start = time.perf_counter()
+            response = await client.request(method, url, **kwargs)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code >= 400 or response.json().get("status") == "error":
+                errors += 1
+            match = QUERIES.search(response.headers.get("server-timing", ""))
+            if match:
+                queries.append(int(match.group(1)))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "queries": round(sum(queries) / len(queries), 2) if queries else None,
+    }
+
+
+def start_server(directory: str, port: int, workers: int) -> subprocess.Popen:
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--app-dir", SERVER_DIR,
+                               "--port", str(port), "--workers", str(workers), "--log-level", "warning"],
+                              cwd=directory)
+    for _ in range(100):
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/onlineCheck").status_code == 200:
+                return server
+        except httpx.TransportError:
+            pass
+        time.sleep(0.2)
+    server.terminate()
+    raise SystemExit("The server didn't start.")
+
+
+async def keep_busy(client: httpx.AsyncClient, ctx: Context, make_request, concurrency: int) -> None:
+    """
+    Sends requests from a scenario over and over, until cancelled, so another scenario can be timed alongside it.
+    """
+    async def worker():
+        while True:
+            method, url, kwargs = make_request(ctx)
+            await client.request(method, url, **kwargs)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+async def run(url: str, ctx: Context, scenarios: List[str], requests: int, concurrency: int,
+              background: Optional[str] = None, background_concurrency: int = 4) -> dict:
+    results = {}
+    # Uvicorn closes connections that have been idle for 5 seconds, which slow scenarios like login can leave them for.
+    # httpx's default is also 5 seconds, so it could reuse a connection just as it was closed, and fail the request.
+    limits = httpx.Limits(max_connections=concurrency + (background_concurrency if background else 0),
+                          keepalive_expiry=2)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=60) as client:
+        for name in scenarios:
+            busy = None
+            if background:
+                busy = asyncio.create_task(keep_busy(client, ctx, SCENARIOS[background], background_concurrency))
+            # A few requests first, so the caches and connections are warm before anything is timed.
+            await run_scenario(client, ctx, SCENARIOS[name], min(requests, concurrency * 2), concurrency)
+            try:
+                results[name] = await run_scenario(client, ctx, SCENARIOS[name], requests, concurrency)
+            finally:
+                if busy is not None:
+                    busy.cancel()
+                    await asyncio.gather(busy, return_exceptions=True)
+            print(f"{name:>15}: " + ", ".join(f"{key}={value}" for key, value in results[name].items()))
+    return results
+
+
+# ------------------
+# STORAGE
+# ------------------
+
+
+def copy_database(path: str, directory: str) -> str:
+    """
+    Copies the database into `directory`, so that a benchmark can write to it without changing the seeded data.
+    """
+    copy = os.path.join(directory, "main.db")
+    source, target = sqlite3.connect(f"file:{path}?mode=ro", uri=True), sqlite3.connect(copy)
+    source.backup(target)
+    source.close()
+    target.close()
+    return copy
+
+
+def storage_worker(path: str, journal_mode: str, seconds: float, seed: int) -> tuple:
+    """
+    Reads and writes straight against the database for `seconds`, the way the mixed scenario does through the API.
+
+    Returns how long each operation took, and how many failed.
+    """
+    rng = random.Random(seed)
+    pool = ConnectionPool(path, size=1, profile=StorageProfile(journal_mode=journal_mode))
+    timetables = UserSubjectDB(path, pool)
+    homework = HomeworkDB(path, pool)
+    with pool.connection() as db:
+        students = [row[0] for row in db.execute("SELECT uid FROM users WHERE permissions = 0")]
+    latencies, errors = [], 0
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        student = rng.choice(students)
+        start = time.perf_counter()
+        try:
+            if rng.random() < WRITE_FRACTION:
+                homework.create_homework(student, "Benchmark", (int(time.time()) + DAY) * MS, "")
+            elif rng.random() < 0.5:
+                timetables.get_timetable_subjects(student)
+            else:
+                homework.get_homework_for_user(student)
+        except sqlite3.OperationalError:
+            errors += 1
+        latencies.append(time.perf_counter() - start)
+    pool.close()
+    return latencies, errors
+
+
+def run_storage(path: str, journal_mode: str, processes: int, seconds: float, seed: int = 0) -> dict:
+    """
+    Times the storage workers on a copy of the database, so that every run starts from the same data.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        copy = copy_database(path, directory)
+        # Switching the journal mode needs the database to itself, so it is done before the workers start.
+        target = sqlite3.connect(copy)
+        target.execute(f"PRAGMA journal_mode = {journal_mode}").fetchall()
+        target.close()
+        with ProcessPoolExecutor(processes) as executor:
+            results = list(executor.map(storage_worker, [copy] * processes, [journal_mode] * processes,
+                                        [seconds] * processes, range(seed, seed + processes)))
+    latencies = sorted(latency for worker, _ in results for latency in worker)
+    return {
+        "operations": len(latencies),
+        "errors": sum(errors for _, errors in results),
+        "throughput": round(len(latencies) / seconds, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+    }
+
+
+# ------------------
+# CONNECTIONS
+# ------------------
+
+
+class UnpooledConnections(ConnectionPool):
+    """
+    Opens a new connection whenever one is asked for, and closes it afterwards,
+    which is how the DB classes worked before they shared a pool. This is only used to compare against.
+    """
+
+    def release(self, db: sqlite3.Connection) -> None:
+        if db.in_transaction:
+            db.rollback()
+        self._discard(db)
+
+
+def time_class_overviews(path: str, pool: ConnectionPool, threads: int, seconds: float, seed: int = 0) -> dict:
+    """
+    Builds the class overviews for random teachers from `threads` threads at once for `seconds`.
+    """
+    classes = ClassDB(path, pool)
+    with pool.connection() as db:
+        teachers = [row[0] for row in db.execute("SELECT DISTINCT teacher_id FROM classes")]
+    end = time.perf_counter() + seconds
+
+    def worker(worker_seed: int) -> int:
+        rng = random.Random(worker_seed)
+        count = 0
+        while time.perf_counter() < end:
+            classes.get_class_overviews(classes.get_classes(rng.choice(teachers)))
+            count += 1
+        return count
+
+    with ThreadPoolExecutor(threads) as executor:
+        count = sum(executor.map(worker, range(seed, seed + threads)))
+    return {"requests": count, "throughput": round(count / seconds, 1)}
+
+
+# ------------------
+# BULK WRITES
+# ------------------
+
+
+def time_bulk_writes(path: str, students: int) -> dict:
+    """
+    Gives `students` students their own homework three ways, on a copy of the database:
+    one commit for each row, one transaction around the same inserts, and a single `_insert_many`.
+
+    Returns how many milliseconds each took.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        copy = copy_database(path, directory)
+        pool = ConnectionPool(copy, size=1)
+        homework = HomeworkDB(copy, pool)
+        with pool.connection() as db:
+            ids = [row[0] for row in db.execute("SELECT uid FROM users WHERE permissions = 0 LIMIT ?", (students, ))]
+        due_date = (int(time.time()) + DAY) * MS
+        results = {"rows": len(ids)}
+
+        start = time.perf_counter()
+        for student in ids:
+            homework.create_homework(student, "Benchmark", due_date, "")
+        results["one_commit_each_ms"] = round((time.perf_counter() - start) * 1000, 1)
+
+        start = time.perf_counter()
+        with homework.transaction():
+            for student in ids:
+                homework.create_homework(student, "Benchmark", due_date, "")
+        results["transaction_ms"] = round((time.perf_counter() - start) * 1000, 1)
+
+        start = time.perf_counter()
+        homework._insert_many("homework", "name, user_id, due_date, completed, description",
+                              (("Benchmark", student, due_date, None, "") for student in ids))
+        results["insert_many_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        pool.close()
+    return results
+
+
+# ------------------
+# ENCODING
+# ------------------
+
+
+def time_encoding(directory: str, rows: int, repeats: int = 20) -> dict:
+    """
+    Converts `rows` rows of each kind and encodes them as a response body, both the old way and the new way.
+
+    Returns the fastest of `repeats` tries, in microseconds per row.
+    """
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+
+    # main opens the database in its working directory, which is where the server runs too.
+    os.chdir(directory)
+    from main import RecordResponse
+
+    path = os.path.join(directory, "databases", "main.db")
+    pool = ConnectionPool(path, size=1)
+    homework, events, subjects, marks = (HomeworkDB(path, pool), EventDB(path, pool),
+                                         SubjectsDB(path, pool), MarkDB(path, pool))
+    kinds = {
+        "homework": ("SELECT homework_id, name, class_id, user_id, due_date, completed, description FROM homework",
+                     homework.convert_result_to_homework, homework.convert_result_to_record),
+        "event": ("SELECT * FROM events", events.convert_result_to_event, events.convert_result_to_record),
+        "subject": (f"SELECT {SubjectsDB.COLUMNS} FROM subjects",
+                    subjects.convert_result_to_subject, subjects.convert_result_to_record),
+        "mark": ("SELECT * FROM marks", marks.convert_result_to_mark, marks.convert_result_to_record),
+    }
+
+    def fastest(encode: Callable[[], bytes], count: int) -> float:
+        best = None
+        for _ in range(repeats):
+            start = time.perf_counter()
+            encode()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return round(best / count * 1_000_000, 2)
+
+    timings = {}
+    for kind, (query, to_model, to_record) in kinds.items():
+        with pool.connection() as db:
+            results = db.execute(f"{query} LIMIT ?", (rows, )).fetchall()
+        timings[kind] = {
+            "models_us": fastest(lambda: JSONResponse(jsonable_encoder(
+                {"status": "success", "data": [to_model(result) for result in results]})).body, len(results)),
+            "records_us": fastest(lambda: RecordResponse(
+                {"status": "success", "data": [to_record(result) for result in results]}).body, len(results)),
+        }
+    pool.close()
+    return timings
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> List[str]:
+    """
+    Returns a description of every way the results are worse than the baseline.
+    """
+    problems = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if result["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            problems.append(
+                f"{name}: p95 went from {base['p95_ms']}ms to {result['p95_ms']}ms")
+        if result["throughput"] < base["throughput"] * (1 - tolerance):
+            problems.append(
+                f"{name}: throughput went from {base['throughput']} to {result['throughput']} req/s")
+        if result["queries"] is not None and base["queries"] is not None and result["queries"] > base["queries"] + 0.5:
+            problems.append(
+                f"{name}: queries per request went from {base['queries']} to {result['queries']}")
+        if result["errors"] > base["errors"]:
+            problems.append(
+                f"{name}: errors went from {base['errors']} to {result['errors']}")
+    return problems
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Load tests the PlanAway API.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    seed_parser = commands.add_parser(
+        "seed", help="Create a database full of made up data.")
+    seed_parser.add_argument("--dir", required=True)
+    seed_parser.add_argument("--teachers", type=int, default=100)
+    seed_parser.add_argument("--students", type=int, default=5000)
+    seed_parser.add_argument("--seed", type=int, default=0)
+
+    run_parser = commands.add_parser(
+        "run", help="Send requests to the server and time them.")
+    run_parser.add_argument("--dir", required=True,
+                            help="The directory the database was seeded in.")
+    run_parser.add_argument(
+        "--url", help="Test a server which is already running, instead of starting one.")
+    run_parser.add_argument("--port", type=int, default=8765)
+    run_parser.add_argument("--workers", type=int, default=1)
+    run_parser.add_argument("--concurrency", type=int, default=16)
+    run_parser.add_argument("--requests", type=int, default=500,
+                            help="How many requests to send for each scenario.")
+    run_parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                            help="Which scenarios to run, separated by commas.")
+    run_parser.add_argument("--background",
+                            help="A scenario to keep running while the others are timed.")
+    run_parser.add_argument("--background-concurrency", type=int, default=4,
+                            help="How many requests the background scenario keeps going at once.")
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--save", help="Save the results to this file.")
+    run_parser.add_argument(
+        "--compare", help="Compare the results against ones saved earlier.")
+    run_parser.add_argument("--tolerance", type=float, default=0.2,
+                            help="How much worse than the baseline counts as a regression.")
+
+    storage_parser = commands.add_parser(
+        "storage", help="Time reads and writes straight against the database from several processes.")
+    storage_parser.add_argument("--dir", required=True,
+                                help="The directory the database was seeded in.")
+    storage_parser.add_argument("--processes", type=int, default=4)
+    storage_parser.add_argument("--seconds", type=float, default=5.0)
+    storage_parser.add_argument("--journal-modes", default="WAL,DELETE",
+                                help="Which journal modes to compare, separated by commas.")
+    storage_parser.add_argument("--seed", type=int, default=0)
+
+    connections_parser = commands.add_parser(
+        "connections", help="Compare pooled connections against a new connection for every query.")
+    connections_parser.add_argument("--dir", required=True,
+                                    help="The directory the database was seeded in.")
+    connections_parser.add_argument("--threads", default="1,16",
+                                    help="How many threads to use at once, separated by commas to try several.")
+    connections_parser.add_argument("--seconds", type=float, default=5.0)
+    connections_parser.add_argument("--seed", type=int, default=0)
+
+    encode_parser = commands.add_parser(
+        "encode", help="Compare encoding pydantic models against encoding records.")
+    encode_parser.add_argument("--dir", required=True,
+                               help="The directory the database was seeded in.")
+    encode_parser.add_argument("--rows", type=int, default=1000,
+                               help="How many rows of each kind to encode.")
+
+    bulk_parser = commands.add_parser(
+        "bulk", help="Compare committing rows one at a time against writing them in one transaction.")
+    bulk_parser.add_argument("--dir", required=True,
+                             help="The directory the database was seeded in.")
+    bulk_parser.add_argument("--students", type=int, default=500,
+                             help="How many students to give homework to.")
+
+    args = parser.parse_args(argv)
+    if args.command == "seed":
+        seed(args.dir, Scale(teachers=args.teachers, students=args.students), args.seed)
+        return 0
+    if args.command == "storage":
+        path = os.path.join(os.path.abspath(args.dir), "databases", "main.db")
+        for journal_mode in args.journal_modes.split(","):
+            result = run_storage(path, journal_mode, args.processes, args.seconds, args.seed)
+            print(f"{journal_mode:>15}: " + ", ".join(f"{key}={value}" for key, value in result.items()))
+        return 0
+    if args.command == "connections":
+        path = os.path.join(os.path.abspath(args.dir), "databases", "main.db")
+        for threads in map(int, args.threads.split(",")):
+            # The server's pool has 8 connections. Without a pool, every thread can have its own.
+            for name, pool in (("pooled", ConnectionPool(path, size=8)),
+                               ("unpooled", UnpooledConnections(path, size=max(threads, 8)))):
+                result = time_class_overviews(path, pool, threads, args.seconds, args.seed)
+                pool.close()
+                print(f"{f'{name} x{threads}':>15}: " + ", ".join(f"{key}={value}" for key, value in result.items()))
+        return 0
+    if args.command == "encode":
+        for kind, result in time_encoding(os.path.abspath(args.dir), args.rows).items():
+            print(f"{kind:>15}: " + ", ".join(f"{key}={value}" for key, value in result.items()))
+        return 0
+    if args.command == "bulk":
+        path = os.path.join(os.path.abspath(args.dir), "databases", "main.db")
+        result = time_bulk_writes(path, args.students)
+        print(", ".join(f"{key}={value}" for key, value in result.items()))
+        return 0
+
+    scenarios = args.scenarios.split(",")
+    for name in scenarios + ([args.background] if args.background else []):
+        if name not in SCENARIOS:
+            parser.error(
+                f"Unknown scenario {name}, choose from {', '.join(SCENARIOS)}.")
+    directory = os.path.abspath(args.dir)
+    ctx = Context(os.path.join(directory, "databases", "main.db"), args.seed)
+    server = None
+    url = args.url
+    if url is None:
+        server = start_server(directory, args.port, args.workers)
+        url = f"http://127.0.0.1:{args.port}"
+    try:
+        results = asyncio.run(
+            run(url, ctx, scenarios, args.requests, args.concurrency, args.background, args.background_concurrency))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump(results, file, indent=2)
+    if args.compare:
+        with open(args.compare) as file:
+            problems = compare(results, json.load(file), args.tolerance)
+        for problem in problems:
+            print(f"REGRESSION {problem}")
+        if problems:
+            return 1
+        print("No regressions against the baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,300 @@
+import json
+import logging
+import threading
+import uuid
+from collections import OrderedDict
+from time import monotonic, sleep
+
+try:
+    import redis
+except ImportError:
+    # Redis is only needed when the cache is shared between workers.
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+
+class CacheBackend:
+    """
+    This is the base class for a cache.
+
+    Values must be made of things JSON can store, such as database rows, so that any backend can hold them.
+    Rows come back as tuples, whichever backend is used.
+
+    Children of this class must implement `get`, `set`, `delete`, `clear`, `generation` and `stats`.
+    """
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, generation=None) -> None:
+        """
+        Stores a value for a key.
+
+        If `generation` is given, the value is only stored if nothing has been deleted since it was read.
+        """
+        raise NotImplementedError
+
+    def generation(self):
+        """
+        Returns something which changes whenever anything is deleted from the cache.
+
+        Read it before looking a value up, and pass it to `set`,
+        so that a value which was deleted while it was being looked up isn't put back.
+        """
+        raise NotImplementedError
+
+    def delete(self, key) -> None:
+        raise NotImplementedError
+
+    def clear(self) -> None:
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class LRUCache(CacheBackend):
+    """
+    This is a cache which holds a limited number of items for a limited amount of time.
+
+    When the cache is full, the item which was used least recently is removed to make space.
+    It also counts how often it is used, so that we can see how much work it is saving.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 60.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """
+        Returns the value stored for a key, or None if it isn't cached or has expired.
+        """
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            value, expires_at = item
+            if expires_at < monotonic():
+                del self._items[key]
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, generation=None) -> None:
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            self._items[key] = (value, monotonic() + self.ttl)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key) -> None:
+        with self._lock:
+            self._generation += 1
+            self._items.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._items.clear()
+
+    def generation(self) -> int:
+        with self._lock:
+            return self._generation
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._items),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+class RedisCache(CacheBackend):
+    """
+    A cache shared by every worker, using Redis (or anything which speaks its protocol).
+
+    Recently used values are also kept in a small LRUCache in this process, so most hits never leave the worker.
+    To stop those local copies going stale, every delete is published to the other workers,
+    which remove their own copy. This means a logout on one worker is seen by all of them straight away.
+
+    Deletes also count up a shared generation, which `set` checks both before and after storing a value,
+    so a value looked up on one worker can't be put back just after another worker deleted it.
+
+    If the connection to Redis is lost, the listener keeps trying to reconnect.
+    Any deletes published while it was gone are missed, so the local copies are all dropped once it is back.
+
+    `client` can be given instead of `url`, which is how tests use a stand-in for Redis.
+    """
+
+    # How long the listener waits before reconnecting, doubling each time it fails up to the maximum.
+    RECONNECT_DELAY = 0.5
+    MAX_RECONNECT_DELAY = 30.0
+
+    def __init__(self, namespace: str, url: str = None, client=None, ttl: float = 60.0, local_size: int = 1024):
+        if client is None:
+            if redis is None:
+                raise RuntimeError(
+                    "The redis package must be installed to use RedisCache, see requirements-optional.txt.")
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.namespace = namespace
+        self.ttl = ttl
+        self.local = LRUCache(max_size=local_size, ttl=ttl)
+        self.channel = f"{namespace}:invalidate"
+        # This is outside the namespace, so that clearing the cache doesn't reset it.
+        self._generation_key = f"{namespace}.generation"
+        # Lets the listener skip the messages this process sent, which it has already acted on.
+        self._origin = uuid.uuid4().hex
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._closed = False
+        self._pubsub = self._subscribe()
+        self._listener = threading.Thread(
+            target=self._listen, name=f"cache-{namespace}", daemon=True)
+        self._listener.start()
+
+    def _key(self, key) -> str:
+        return f"{self.namespace}:{key}"
+
+    def _subscribe(self):
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self.channel)
+        return pubsub
+
+    def _listen(self) -> None:
+        delay = self.RECONNECT_DELAY
+        while True:
+            failure = None
+            try:
+                for message in self._pubsub.listen():
+                    delay = self.RECONNECT_DELAY
+                    if message.get("type") != "message":
+                        continue
+                    data = json.loads(message["data"])
+                    if data["origin"] == self._origin:
+                        continue
+                    if data.get("clear"):
+                        self.local.clear()
+                    else:
+                        self.local.delete(data["key"])
+            except Exception as error:
+                failure = error
+            # The connection is closed on purpose when the server shuts down.
+            if self._closed:
+                return
+            logger.warning("Lost the connection to Redis for the %s cache, reconnecting.", self.namespace,
+                           exc_info=failure)
+            try:
+                self._pubsub.close()
+            except Exception:
+                pass
+            while not self._closed:
+                sleep(delay)
+                delay = min(delay * 2, self.MAX_RECONNECT_DELAY)
+                try:
+                    self._pubsub = self._subscribe()
+                    break
+                except Exception:
+                    logger.warning("Couldn't reconnect to Redis for the %s cache.", self.namespace, exc_info=True)
+            if self._closed:
+                # It may have reconnected just as it was closed.
+                self._pubsub.close()
+                return
+            # Deletes sent while the listener was away were missed, so nothing held locally can be trusted.
+            self.local.clear()
+            logger.info("Reconnected to Redis for the %s cache.", self.namespace)
+
+    def _publish(self, **data) -> None:
+        self.client.publish(self.channel, json.dumps(
+            {"origin": self._origin, **data}))
+
+    def _shared_generation(self) -> int:
+        return int(self.client.get(self._generation_key) or 0)
+
+    def get(self, key):
+        value = self.local.get(key)
+        if value is None:
+            local_generation = self.local.generation()
+            stored = self.client.get(self._key(key))
+            if stored is not None:
+                value = _from_json(json.loads(stored))
+                self.local.set(key, value, local_generation)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value, generation=None) -> None:
+        shared, local = generation if generation is not None else (None, None)
+        if shared is not None and self._shared_generation() != shared:
+            return
+        self.client.set(self._key(key), json.dumps(value),
+                        px=int(self.ttl * 1000))
+        if shared is not None and self._shared_generation() != shared:
+            # Something was deleted while it was being stored, and it may have been this.
+            self.client.delete(self._key(key))
+            return
+        self.local.set(key, value, local)
+
+    def generation(self) -> tuple:
+        return self._shared_generation(), self.local.generation()
+
+    def delete(self, key) -> None:
+        # The generation goes up first, so that a set which started before this can tell it happened.
+        self.client.incr(self._generation_key)
+        self.client.delete(self._key(key))
+        self.local.delete(key)
+        self._publish(key=key)
+
+    def clear(self) -> None:
+        self.client.incr(self._generation_key)
+        keys = list(self.client.scan_iter(match=self._key("*")))
+        if keys:
+            self.client.delete(*keys)
+        self.local.clear()
+        self._publish(clear=True)
+
+    def stats(self) -> dict:
+        local = self.local.stats()
+        with self._lock:
+            return {
+                "size": local["size"],
+                "max_size": local["max_size"],
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": local["evictions"],
+                "local_hits": local["hits"],
+            }
+
+    def close(self) -> None:
+        self._closed = True
+        self._pubsub.close()
+
+
+def _from_json(value):
+    # JSON has no tuples, so rows come back as lists. They are turned back into tuples to match the other backends.
+    if isinstance(value, list):
+        return tuple(_from_json(item) for item in value)
+    return value
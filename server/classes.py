@@ -1,3 +1,4 @@
+from dataclasses import dataclass
 from enum import IntEnum
 from pydantic import BaseModel
 from typing import List, Optional
@@ -10,7 +11,7 @@ class Permissions(IntEnum):
 
 class OAuthToken(BaseModel):
     access_token: str
-    uid: int
+    uid: int = None
 
 
 class User(BaseModel):
@@ -29,6 +30,14 @@ class User(BaseModel):
         return self
 
 
+class PublicUser(BaseModel):
+    # The parts of a user which are safe to show to other users.
+    uid: int
+    username: str
+    created_at: int
+    permissions: int
+
+
 class Subject(BaseModel):
     subject_id: int = None
     user_id: int
@@ -71,7 +80,7 @@ class Class(BaseModel):
     teacher_id: int
     class_name: str
     homework: List[Homework] = []
-    students: List[User] = []
+    students: List[PublicUser] = []
 
 
 class ClassStudentJoin(BaseModel):
@@ -100,6 +109,16 @@ class Timetable:
         self.thursday = [None] * 9
         self.friday = [None] * 9
 
+    def set_period(self, day: int, period: int, value) -> None:
+        """
+        Sets what is in a period, where day 0 is monday.
+
+        Days outside of monday to friday are ignored.
+        """
+        days = self.get_client_format()
+        if 0 <= day < len(days):
+            days[day][period] = value
+
     def get_client_format(self):
         """
         This returns the timetable in the format which the client expects.
@@ -107,6 +126,52 @@ class Timetable:
         return [self.monday, self.tuesday, self.wednesday, self.thursday, self.friday]
 
 
+# These are read-only versions of the models above, used when sending lists of rows to the client.
+# Building them skips pydantic's validation, which the data already went through on its way into the database.
+# Their fields are in the same order as the models, so the client gets the same JSON either way.
+
+
+@dataclass(slots=True)
+class SubjectRecord:
+    subject_id: int
+    user_id: int
+    name: str
+    teacher: str
+    room: str
+    colour: str
+
+
+@dataclass(slots=True)
+class MarkRecord:
+    mark_id: int
+    user_id: int
+    test_name: str
+    mark: int
+    grade: str
+
+
+@dataclass(slots=True)
+class HomeworkRecord:
+    homework_id: int
+    name: str
+    class_id: Optional[int]
+    completed_by: Optional[int]
+    user_id: Optional[int]
+    due_date: int
+    description: Optional[str]
+    completed: bool
+
+
+@dataclass(slots=True)
+class EventRecord:
+    event_id: int
+    user_id: int
+    name: str
+    time: int
+    description: Optional[str]
+    private: bool
+
+
 class RegistrationCode(BaseModel):
     code: str
     permissions: Permissions
@@ -1,8 +1,329 @@
+import asyncio
+import contextvars
+import dataclasses
+import functools
+import json
+import queue
 import sqlite3
-from typing import List, Optional
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from time import monotonic, perf_counter
+from typing import Iterable, Iterator, List, Optional
+from cache import CacheBackend
+from metrics import record_connection, record_query
 from classes import *
 
 
+class StorageProfile:
+    """
+    The PRAGMA settings applied to every connection when it is opened.
+
+    The defaults suit the server, where several worker processes share one database file:
+    - WAL lets readers carry on while something is being written, instead of every write blocking every read.
+    - With WAL, synchronous NORMAL only syncs at checkpoints. A power cut can lose the last few commits,
+      but can't corrupt the database.
+    - busy_timeout is how long to wait for another writer before giving up with "database is locked".
+    - cache_size is negative to mean KiB rather than pages, and is per connection.
+    - mmap_size lets SQLite read the file through memory mapping rather than a copy for each read.
+    """
+
+    def __init__(self, journal_mode: str = "WAL", synchronous: str = "NORMAL", busy_timeout: int = 30000,
+                 cache_size: int = -16000, mmap_size: int = 128 * 1024 * 1024, temp_store: str = "MEMORY"):
+        self.journal_mode = journal_mode
+        self.synchronous = synchronous
+        self.busy_timeout = busy_timeout
+        self.cache_size = cache_size
+        self.mmap_size = mmap_size
+        self.temp_store = temp_store
+
+    def apply(self, db: sqlite3.Connection) -> None:
+        # busy_timeout is set first so that switching the journal mode waits for other workers too.
+        db.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout)}")
+        db.execute(f"PRAGMA journal_mode = {self.journal_mode}").fetchall()
+        db.execute(f"PRAGMA synchronous = {self.synchronous}")
+        db.execute(f"PRAGMA cache_size = {int(self.cache_size)}")
+        db.execute(f"PRAGMA mmap_size = {int(self.mmap_size)}").fetchall()
+        db.execute(f"PRAGMA temp_store = {self.temp_store}")
+
+
+class StatementStats:
+    """
+    Counts how often each named statement is run, and how long it takes.
+
+    The first time a connection runs a statement, SQLite has to parse it before running it. These are counted as cold.
+    After that the connection reuses the parsed statement from its cache, and these runs are counted as warm.
+    The difference between the average cold and warm times is roughly what parsing costs.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # name -> [cold calls, cold seconds, warm calls, warm seconds, slowest seconds]
+        self._stats = {}
+
+    def record(self, name: str, seconds: float, cold: bool) -> None:
+        with self._lock:
+            stats = self._stats.setdefault(name, [0, 0.0, 0, 0.0, 0.0])
+            if cold:
+                stats[0] += 1
+                stats[1] += seconds
+            else:
+                stats[2] += 1
+                stats[3] += seconds
+            stats[4] = max(stats[4], seconds)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                name: {
+                    "calls": cold_calls + warm_calls,
+                    "cold_calls": cold_calls,
+                    "cold_ms": round(cold_time * 1000, 3),
+                    "warm_calls": warm_calls,
+                    "warm_ms": round(warm_time * 1000, 3),
+                    "slowest_ms": round(slowest * 1000, 3),
+                }
+                for name, (cold_calls, cold_time, warm_calls, warm_time, slowest) in sorted(self._stats.items())
+            }
+
+
+class ConnectionPool:
+    """
+    This keeps a set of SQLite connections open so that they can be reused between queries.
+
+    Opening a connection for every query is slow, and the connections were never closed,
+    so file handles would leak while the server was under load.
+
+    A thread keeps hold of the same connection while it is inside `connection()`,
+    meaning nested calls made by the same thread do not need to take another one from the pool.
+    """
+
+    def __init__(self, path: str, size: int = 8, timeout: float = 30.0, check_after: float = 60.0,
+                 profile: Optional[StorageProfile] = None, cached_statements: int = 256):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self.profile = profile if profile is not None else StorageProfile()
+        # How many parsed statements each connection keeps. This should be more than the number of different
+        # statements the server runs, or they will push each other out and have to be parsed again.
+        self.cached_statements = cached_statements
+        self.statements = StatementStats()
+        # The names of the statements each connection has already run, by the connection's id.
+        self._prepared = {}
+        # How long a connection can sit unused before we check that it still works.
+        self.check_after = check_after
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._opened = 0
+        self._closed = False
+        self._executor = None
+
+    def _connect(self) -> sqlite3.Connection:
+        # The pool makes sure only one thread uses a connection at a time,
+        # so it is safe for them to move between threads.
+        record_connection()
+        db = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False,
+                             cached_statements=self.cached_statements)
+        self.profile.apply(db)
+        return db
+
+    def _is_healthy(self, db: sqlite3.Connection) -> bool:
+        try:
+            db.execute("SELECT 1").fetchall()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _discard(self, db: sqlite3.Connection) -> None:
+        with self._lock:
+            self._opened -= 1
+            self._prepared.pop(id(db), None)
+        try:
+            db.close()
+        except sqlite3.Error:
+            pass
+
+    def acquire(self) -> sqlite3.Connection:
+        """
+        Takes a connection from the pool, opening a new one if there is space.
+
+        Waits for another thread to release a connection if the pool is full.
+        """
+        if self._closed:
+            raise RuntimeError("Connection pool has been closed.")
+        while True:
+            try:
+                db, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    can_open = self._opened < self.size
+                    if can_open:
+                        self._opened += 1
+                if can_open:
+                    try:
+                        return self._connect()
+                    except BaseException:
+                        with self._lock:
+                            self._opened -= 1
+                        raise
+                try:
+                    db, last_used = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    raise TimeoutError(
+                        "Timed out waiting for a database connection.")
+            if monotonic() - last_used < self.check_after or self._is_healthy(db):
+                return db
+            # The connection has broken while it was idle, so replace it.
+            self._discard(db)
+
+    def release(self, db: sqlite3.Connection) -> None:
+        """
+        Returns a connection to the pool so that it can be reused.
+        """
+        if db.in_transaction:
+            # Never hand out a connection with someone else's changes still pending.
+            db.rollback()
+        if self._closed:
+            self._discard(db)
+            return
+        self._idle.put((db, monotonic()))
+
+    @contextmanager
+    def connection(self):
+        """
+        Lends out a connection for the duration of a `with` block.
+        """
+        db = getattr(self._local, "db", None)
+        if db is not None:
+            # This thread already holds a connection, so just reuse it.
+            self._local.depth += 1
+            try:
+                yield db
+            finally:
+                self._local.depth -= 1
+            return
+        db = self.acquire()
+        self._local.db = db
+        self._local.depth = 0
+        self._local.in_transaction = False
+        try:
+            yield db
+        finally:
+            self._local.db = None
+            self.release(db)
+
+    @contextmanager
+    def transaction(self):
+        """
+        Groups everything done inside a `with` block into one transaction.
+
+        The changes are committed together at the end of the block, or all undone if an error is raised.
+        A transaction started inside another one simply becomes part of it.
+        """
+        with self.connection() as db:
+            if self._local.in_transaction:
+                yield db
+                return
+            self._local.in_transaction = True
+            try:
+                yield db
+                db.commit()
+            except BaseException:
+                db.rollback()
+                raise
+            finally:
+                self._local.in_transaction = False
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        """
+        The threads used to run queries for AsyncDB.
+
+        There is one thread for each connection, so a query never has to wait for a connection once it starts.
+        """
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.size, thread_name_prefix="db")
+            return self._executor
+
+    def run(self, db: sqlite3.Connection, name: Optional[str], statement: str, args=(), fetch: bool = True, many: bool = False):
+        """
+        Runs a statement on a connection, and counts it towards the current request's stats.
+
+        If it has a name, how long it took is also recorded in `statements`.
+        If `fetch` is true the rows are returned, otherwise the cursor is.
+        If `many` is true, `args` is a list of rows and the statement is run once for each.
+        """
+        start = perf_counter()
+        cursor = db.executemany(statement, args) if many else db.execute(statement, args)
+        result = cursor.fetchall() if fetch else cursor
+        elapsed = perf_counter() - start
+        record_query(statement, elapsed)
+        if name is not None:
+            prepared = self._prepared.setdefault(id(db), set())
+            self.statements.record(name, elapsed, name not in prepared)
+            prepared.add(name)
+        return result
+
+    def checkpoint(self, mode: str = "PASSIVE") -> tuple:
+        """
+        Copies changes from the write-ahead log back into the database file.
+
+        SQLite does this by itself after a commit makes the log big enough,
+        but it can't finish while readers are using the log, so under constant load the log keeps growing.
+        PASSIVE never waits for readers or writers, so it is safe to run at any time.
+
+        Returns (busy, log pages, pages checkpointed), as given by SQLite.
+        """
+        with self.connection() as db:
+            return tuple(db.execute(f"PRAGMA wal_checkpoint({mode})").fetchone())
+
+    def close(self) -> None:
+        """
+        Closes every idle connection. Connections in use are closed when they are released.
+        """
+        self._closed = True
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        while True:
+            try:
+                db, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(db)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(path: str, **kwargs) -> ConnectionPool:
+    """
+    Returns the connection pool for a database file, creating it if it doesn't exist yet.
+
+    This means that every DB which uses the same file will share the same connections.
+    """
+    with _pools_lock:
+        pool = _pools.get(path)
+        if pool is None or pool._closed:
+            pool = ConnectionPool(path, **kwargs)
+            _pools[path] = pool
+        return pool
+
+
+def close_pools() -> None:
+    """
+    Closes every connection pool. This should be called when the server shuts down.
+    """
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
+
+
 class DB:
     """
     This is the base class for a database.
@@ -13,58 +334,156 @@ class DB:
     A child of this class should be implemented to wrap around these functions.
     """
 
-    def __init__(self, path):
+    # The statements a database runs most often, by name.
+    # Writing each one once here means the exact same SQL is sent every time,
+    # so each connection only has to parse it the first time it is used.
+    STATEMENTS = {}
+
+    def __init__(self, path, pool: Optional[ConnectionPool] = None):
         self.path = path
+        self.pool = pool if pool is not None else get_pool(path)
 
-    def _get(self, col: str, table: str, where: Optional[str] = None, order: Optional[str] = None, args: Optional[tuple] = ()) -> List:
-        db = sqlite3.connect(self.path)
-        cursor = db.cursor()
+    def _select(self, col: str, table: str, where: Optional[str] = None, order: Optional[str] = None, args: Optional[tuple] = (), group: Optional[str] = None, limit: Optional[int] = None, offset: Optional[int] = None) -> tuple:
         statement = f"SELECT {col} FROM {table}"
         if where:
             statement += f" WHERE {where}"
+        if group:
+            statement += f" GROUP BY {group}"
         if order:
             statement += f" ORDER BY {order}"
-        cursor.execute(statement, args)
-        return cursor.fetchall()
-
-    def _get_raw(self, query: str) -> List:
-        db = sqlite3.connect(self.path)
-        cursor = db.cursor()
-        cursor.execute(query)
-        return cursor.fetchall()
+        if limit is not None:
+            statement += " LIMIT ?"
+            args = tuple(args) + (limit, )
+            if offset:
+                statement += " OFFSET ?"
+                args += (offset, )
+        return statement, args
+
+    def _get(self, col: str, table: str, where: Optional[str] = None, order: Optional[str] = None, args: Optional[tuple] = (), group: Optional[str] = None, limit: Optional[int] = None, offset: Optional[int] = None) -> List:
+        statement, args = self._select(
+            col, table, where, order, args, group, limit, offset)
+        with self.pool.connection() as db:
+            return self.pool.run(db, None, statement, args)
+
+    def _iter(self, col: str, table: str, key: str, where: Optional[str] = None, args: Optional[tuple] = (), batch_size: int = 256) -> Iterator:
+        """
+        Works like _get, but gives back the rows a few at a time instead of loading all of them into memory at once.
+
+        The rows are read a page at a time, in order of `key`, which has to be unique and the first column in `col`.
+        Each page is read after the last one left off, so no connection is held between pages,
+        however slowly the rows are used up.
+        """
+        last = None
+        while True:
+            if last is None:
+                rows = self._get(col, table, where, f"{key} ASC", args, limit=batch_size)
+            else:
+                page_where = f"({where}) AND {key} > ?" if where else f"{key} > ?"
+                rows = self._get(col, table, page_where, f"{key} ASC", tuple(args) + (last, ), limit=batch_size)
+            yield from rows
+            if len(rows) < batch_size:
+                break
+            last = rows[-1][0]
+
+    def _query(self, name: str, args: tuple = ()) -> List:
+        """
+        Runs one of the class's named STATEMENTS, and returns the rows it gives back.
+        """
+        with self.pool.connection() as db:
+            return self.pool.run(db, f"{type(self).__name__}.{name}", self.STATEMENTS[name], args)
+
+    def _execute(self, name: str, args: tuple = ()) -> sqlite3.Cursor:
+        """
+        Runs one of the class's named STATEMENTS which changes data, and commits it.
+        """
+        with self.pool.transaction() as db:
+            return self.pool.run(db, f"{type(self).__name__}.{name}", self.STATEMENTS[name], args, fetch=False)
+
+    def _get_raw(self, query: str, args: Optional[tuple] = ()) -> List:
+        with self.pool.connection() as db:
+            return self.pool.run(db, None, query, args)
+
+    def transaction(self):
+        """
+        Groups several writes together so that they are committed at once.
+
+        Example:
+            with self.transaction():
+                self._delete("marks", "user_id = ?", (user_id, ))
+                self._delete("homework", "user_id = ?", (user_id, ))
+        """
+        return self.pool.transaction()
 
     def _update(self, table: str, set_cols: str, where: str, args: tuple) -> None:
-        db = sqlite3.connect(self.path)
-        cursor = db.cursor()
-        cursor.execute(f"UPDATE {table} SET {set_cols} WHERE {where}", args)
-        db.commit()
-
-    def _insert(self, table: str, cols: str, args: tuple) -> None:
-        db = sqlite3.connect(self.path)
-        cursor = db.cursor()
-        cursor.execute(
-            f"INSERT INTO {table}({cols}) VALUES (?" + ",?" * (len(args) - 1) + ")", args)
-        db.commit()
+        with self.pool.transaction() as db:
+            self.pool.run(db, None, f"UPDATE {table} SET {set_cols} WHERE {where}", args, fetch=False)
+
+    def _insert(self, table: str, cols: str, args: tuple) -> int:
+        """
+        Inserts a row, and returns its rowid.
+
+        For tables with an INTEGER PRIMARY KEY, this is the ID SQLite gave the row,
+        which is safe to use even when other workers are inserting at the same time.
+        """
+        with self.pool.transaction() as db:
+            return self.pool.run(db, None, f"INSERT INTO {table}({cols}) VALUES (?" + ",?" * (len(args) - 1) + ")",
+                                 args, fetch=False).lastrowid
+
+    def _insert_many(self, table: str, cols: str, rows: Iterable[tuple]) -> int:
+        """
+        Inserts many rows at once, which is much faster than inserting them one at a time.
+
+        `rows` can be a generator, so that they never all have to be held in memory at once.
+        Returns how many rows were inserted.
+        """
+        placeholders = ",".join("?" * len(cols.split(",")))
+        with self.pool.transaction() as db:
+            return self.pool.run(db, None, f"INSERT INTO {table}({cols}) VALUES ({placeholders})",
+                                 rows, fetch=False, many=True).rowcount
 
     def _delete(self, table: str, where: str, args: tuple) -> None:
-        db = sqlite3.connect(self.path)
-        cursor = db.cursor()
-        cursor.execute(f"DELETE FROM {table} WHERE {where}", args)
-        db.commit()
+        with self.pool.transaction() as db:
+            self.pool.run(db, None, f"DELETE FROM {table} WHERE {where}", args, fetch=False)
 
     def _create(self, table: str, ddl: str) -> None:
-        db = sqlite3.connect(self.path)
-        cursor = db.cursor()
-        cursor.execute(f"CREATE TABLE IF NOT EXISTS {table} ({ddl})")
-        db.commit()
+        with self.pool.transaction() as db:
+            db.execute(f"CREATE TABLE IF NOT EXISTS {table} ({ddl})")
 
     def _create_raw(self, ddl: str) -> None:
-        db = sqlite3.connect(self.path)
-        cursor = db.cursor()
         if ddl[-1] != ";":
             ddl += ";"
-        cursor.execute(ddl)
-        db.commit()
+        with self.pool.transaction() as db:
+            db.execute(ddl)
+
+
+class AsyncDB:
+    """
+    This wraps a DB so that all of its functions can be awaited.
+
+    The queries are run on the connection pool's threads instead of the event loop,
+    which means that one slow query doesn't stop the server from handling other requests.
+
+    Example:
+        Users_DB = AsyncDB(UsersDB(path))
+        user = await Users_DB.get_user_from_uid(1)
+    """
+
+    def __init__(self, db: DB):
+        self.db = db
+
+    def __getattr__(self, name):
+        attr = getattr(self.db, name)
+        if not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        async def run_in_executor(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            # Copy the context across so anything tracking the current request still works inside the thread.
+            context = contextvars.copy_context()
+            call = functools.partial(context.run, attr, *args, **kwargs)
+            return await loop.run_in_executor(self.db.pool.executor, call)
+        return run_in_executor
 
 
 class UsersDB(DB):
@@ -72,10 +491,23 @@ class UsersDB(DB):
     This class handles user data inside of a database file.
 
     Wrapper functions are provided to make manipulation of the data easier.
+
+    Users looked up by their session token are kept in `session_cache` (if given),
+    since this happens on every authenticated request.
     """
 
-    def __init__(self, path):
-        super().__init__(path)
+    STATEMENTS = {
+        "by_username": "SELECT * FROM users WHERE username = ?",
+        "by_uid": "SELECT * FROM users WHERE uid = ?",
+        # Only what is needed to check who a request is from, as the row is cached (see get_user_from_session).
+        "by_session": "SELECT uid, username, '', '', created_at, permissions, session FROM users WHERE session = ?",
+    }
+
+    def __init__(self, path, pool: Optional[ConnectionPool] = None, session_cache: Optional[CacheBackend] = None):
+        super().__init__(path, pool)
+        self.session_cache = session_cache
+        # Whether the username search index exists. This isn't known until the database has been migrated.
+        self._has_search_index = None
         DDL = """CREATE TABLE IF NOT EXISTS "users" (
 	"uid"	INTEGER NOT NULL,
 	"username"	TEXT NOT NULL UNIQUE,
@@ -103,28 +535,78 @@ class UsersDB(DB):
         )
 
     def get_user_from_username(self, username: str) -> User:
-        user_data = self._get(
-            "*", "users", where="username = ?", args=(username,))
+        user_data = self._query("by_username", (username, ))
         if len(user_data) == 0:
             return None
         user_data = user_data[0]
         return self.convert_result_to_user(user_data)
 
     def get_user_from_uid(self, uid: int) -> User:
-        user_data = self._get("*", "users", where="uid = ?", args=(uid,))
+        user_data = self._query("by_uid", (uid, ))
         if len(user_data) == 0:
             return None
         user_data = user_data[0]
         return self.convert_result_to_user(user_data)
 
     def get_user_from_session(self, session: str) -> User:
-        user_data = self._get(
-            "*", "users", where="session = ?", args=(session,))
+        """
+        Returns the user a session token belongs to, or None if it isn't valid.
+
+        The row may be kept in a cache shared with other workers, so their password and salt are left out,
+        and are empty on the User returned. Use get_user_from_uid if they are needed.
+        """
+        if self.session_cache is not None:
+            # The row is cached instead of the User, so that callers can modify what they are given.
+            user_data = self.session_cache.get(session)
+            if user_data is not None:
+                return self.convert_result_to_user(user_data)
+            # If the token is forgotten while it is being looked up, what was read may already be out of date.
+            generation = self.session_cache.generation()
+        user_data = self._query("by_session", (session, ))
         if len(user_data) == 0:
             return None
         user_data = user_data[0]
+        if self.session_cache is not None:
+            self.session_cache.set(session, user_data, generation)
         return self.convert_result_to_user(user_data)
 
+    def forget_session(self, session: Optional[str]) -> None:
+        """
+        Removes a session token from the cache. This must be done whenever a token stops being valid,
+        after the change has been saved, or a request using it could cache the old row again.
+        """
+        if self.session_cache is not None and session is not None:
+            self.session_cache.delete(session)
+
+    def search_users(self, name: str, exclude_uid: Optional[int] = None, limit: int = 20, offset: int = 0) -> List[PublicUser]:
+        """
+        Finds users whose username contains `name`, ignoring case.
+
+        Usernames starting with `name` are listed first. Only the parts of each user which are safe to share are returned.
+        """
+        if self._has_search_index is None:
+            self._has_search_index = bool(self._get(
+                "name", "sqlite_master", where="type = 'table' AND name = 'users_search'"))
+        columns = "u.uid, u.username, u.created_at, u.permissions"
+        # The trigram index can only be used for searches of at least 3 characters.
+        if self._has_search_index and len(name) >= 3:
+            table = "users_search AS s JOIN users AS u ON u.uid = s.rowid"
+            where = "users_search MATCH ?"
+            search = '"' + name.replace('"', '""') + '"'
+        else:
+            table = "users AS u"
+            where = "u.username LIKE ? ESCAPE '\\'"
+            search = "%" + name.replace("\\", "\\\\").replace(
+                "%", "\\%").replace("_", "\\_") + "%"
+        if exclude_uid is not None:
+            where += " AND u.uid != ?"
+        args = (search, ) if exclude_uid is None else (search, exclude_uid)
+        results = self._get(columns, table, where=where,
+                            order="lower(substr(u.username, 1, ?)) = lower(?) DESC, u.username ASC",
+                            args=args + (len(name), name), limit=limit, offset=offset)
+        return [PublicUser(uid=uid, username=username, created_at=created_at, permissions=permissions)
+                for uid, username, created_at, permissions in results]
+
     def get_users(self) -> List[User]:
         users = self._get("*", "users")
         return [self.convert_result_to_user(user) for user in users]
@@ -138,22 +620,59 @@ class UsersDB(DB):
             (user.username, user.password, user.salt,
              user.created_at, user.permissions, token, user.uid)
         )
+        # The cached copy of this user is now out of date.
+        self.forget_session(token)
         return True
 
-    def add_user(self, user: User) -> bool:
-        if user.uid is None:
-            user.uid = self.get_next_uid()
-        self._insert(
+    def set_session(self, uid: int, session: Optional[str]) -> None:
+        """
+        Changes a user's session token, or removes it if `session` is None, without touching the rest of their row.
+        """
+        self._update("users", "session = ?", "uid = ?", (session, uid))
+
+    def add_user(self, user: User) -> int:
+        """
+        Adds a user, and returns their uid.
+
+        If the user doesn't have a uid yet, the database picks one, and it is set on the user and their session.
+        """
+        user.uid = self._insert(
             "users",
             "uid, username, password, salt, created_at, permissions, session",
             (user.uid, user.username, user.password, user.salt, user.created_at,
              user.permissions, user.session.access_token if user.session else None)
         )
-        return True
-
-    def get_next_uid(self) -> int:
-        latest_uid = self._get("uid", "users", order="uid DESC")
-        return 1 if len(latest_uid) == 0 else latest_uid[0][0] + 1
+        if user.session:
+            user.session.uid = user.uid
+        return user.uid
+
+    def purge_user(self, user: User, delete_account: bool = False) -> None:
+        """
+        Deletes everything belonging to a user in a single transaction,
+        so either all of it is deleted or, if something goes wrong, none of it is.
+
+        This includes their timetable, marks, homework, events and the classes they own,
+        along with anything linking other users to those events and classes.
+        If `delete_account` is set, the user themselves is deleted too.
+        """
+        uid = (user.uid, )
+        owned_classes = "class_id IN (SELECT class_id FROM classes WHERE teacher_id = ?)"
+        with self.transaction():
+            self._delete("`users-subjects`", "user_id = ?", uid)
+            self._delete("marks", "user_id = ?", uid)
+            self._delete("`homework-completions`", "student_id = ?", uid)
+            self._delete("homework", "user_id = ?", uid)
+            self._delete("`user-events`",
+                         "user_id = ? OR event_id IN (SELECT event_id FROM events WHERE user_id = ?)", uid * 2)
+            self._delete("events", "user_id = ?", uid)
+            self._delete("`homework-completions`",
+                         f"homework_id IN (SELECT homework_id FROM homework WHERE user_id IS NULL AND {owned_classes})", uid)
+            self._delete("homework", f"user_id IS NULL AND {owned_classes}", uid)
+            self._delete("`class-student`", owned_classes, uid)
+            self._delete("classes", "teacher_id = ?", uid)
+            if delete_account:
+                self._delete("`class-student`", "student_id = ?", uid)
+                self.delete_user(user)
 
     def delete_user(self, user: User) -> None:
         self._delete("users", "uid = ? AND username = ?",
@@ -163,20 +682,37 @@ class UsersDB(DB):
 class SubjectsDB(DB):
     """
     This implements functions to deal with subjects inside the database.
+
+    Subjects looked up by ID are kept in `cache` (if given), since they are checked on most timetable requests.
     """
 
-    def __init__(self, path):
-        super().__init__(path)
+    # Older databases have these columns in a different order, so they are always listed explicitly.
+    COLUMNS = "subject_id, user_id, name, teacher, room, colour"
+
+    STATEMENTS = {
+        "by_id": f"SELECT {COLUMNS} FROM subjects WHERE subject_id = ?",
+        "by_user": f"SELECT {COLUMNS} FROM subjects WHERE user_id = ?",
+        "by_name": f"SELECT {COLUMNS} FROM subjects WHERE name = ? AND user_id = ?",
+        "update": "UPDATE subjects SET name = ?, teacher = ?, room = ?, colour = ? WHERE subject_id = ?",
+    }
+
+    def __init__(self, path, pool: Optional[ConnectionPool] = None, cache: Optional[CacheBackend] = None):
+        super().__init__(path, pool)
+        self.cache = cache
         DDL = """CREATE TABLE IF NOT EXISTS "subjects" (
-	"subject_id"	INTEGER NOT NULL,
+	"subject_id"	INTEGER,
+	"user_id"	INTEGER NOT NULL,
 	"name"	TEXT NOT NULL,
 	"teacher"	TEXT NOT NULL,
 	"room"	TEXT NOT NULL,
-	PRIMARY KEY("subject_id" AUTOINCREMENT)
+	"colour"	TEXT NOT NULL DEFAULT '#000000',
+	PRIMARY KEY("subject_id" AUTOINCREMENT),
+	FOREIGN KEY("user_id") REFERENCES "users"("uid")
 )"""
         self._create_raw(DDL)
 
-    def convert_result_to_subject(self, subject: list):
+    @staticmethod
+    def convert_result_to_subject(subject: list):
         return Subject(
             subject_id=subject[0],
             user_id=subject[1],
@@ -187,67 +723,101 @@ class SubjectsDB(DB):
         )
 
     def get_subject_by_id(self, id: int) -> Subject:
-        subject_data = self._get(
-            "*", "subjects", where="subject_id = ?", args=(id,))
+        if self.cache is not None:
+            # The row is cached instead of the Subject, so that callers can modify what they are given.
+            subject_data = self.cache.get(id)
+            if subject_data is not None:
+                return self.convert_result_to_subject(subject_data)
+        subject_data = self._query("by_id", (id, ))
         if len(subject_data) == 0:
             return None
         subject_data = subject_data[0]
+        if self.cache is not None:
+            self.cache.set(id, subject_data)
         return self.convert_result_to_subject(subject_data)
 
+    def forget_subject(self, subject_id: int) -> None:
+        """
+        Removes a subject from the cache. This must be done whenever a subject is changed or deleted.
+        """
+        if self.cache is not None and subject_id is not None:
+            self.cache.delete(subject_id)
+
     def get_subjects_by_name(self, name: str, user_id: int) -> List[Subject]:
-        subject_data = self._get(
-            "*", "subjects", where="name = ? AND user_id = ?", args=(name, user_id))
+        subject_data = self._query("by_name", (name, user_id))
         return [self.convert_result_to_subject(subject) for subject in subject_data]
 
     def get_subjects_by_teacher(self, name: str, user_id: int) -> List[Subject]:
         subject_data = self._get(
-            "*", "subjects", where="teacher = ? AND user_id = ?", args=(name, user_id))
+            self.COLUMNS, "subjects", where="teacher = ? AND user_id = ?", args=(name, user_id))
         return [self.convert_result_to_subject(subject) for subject in subject_data]
 
     def get_subjects_by_room(self, room: str, user_id: int) -> List[Subject]:
         subject_data = self._get(
-            "*", "subjects", where="room = ? AND user_id = ?", args=(room, user_id))
+            self.COLUMNS, "subjects", where="room = ? AND user_id = ?", args=(room, user_id))
         return [self.convert_result_to_subject(subject) for subject in subject_data]
 
-    def get_subjects(self) -> list:
-        subjects = self._get("*", "subjects")
-        return [self.convert_result_to_subject(subject) for subject in subjects]
+    @staticmethod
+    def convert_result_to_record(subject: tuple) -> SubjectRecord:
+        return SubjectRecord(*subject)
+
+    def get_subjects(self, after: Optional[int] = None, limit: Optional[int] = None) -> List[SubjectRecord]:
+        """
+        Gets every subject, in order of ID.
+
+        To get them a page at a time, pass `limit`, and the ID of the last subject you got as `after`.
+        """
+        if after is None:
+            subjects = self._get(
+                self.COLUMNS, "subjects", order="subject_id ASC", limit=limit)
+        else:
+            subjects = self._get(self.COLUMNS, "subjects", where="subject_id > ?",
+                                 order="subject_id ASC", args=(after, ), limit=limit)
+        return [self.convert_result_to_record(subject) for subject in subjects]
+
+    def iter_subjects(self) -> Iterator[SubjectRecord]:
+        """
+        Goes through every subject without loading them all into memory at once.
+        """
+        for subject in self._iter(self.COLUMNS, "subjects", "subject_id"):
+            yield self.convert_result_to_record(subject)
 
     def update_subject(self, subject: Subject) -> bool:
-        self._update(
-            "subjects",
-            "name = ?, teacher = ?, room = ?, colour = ?",
-            "subject_id = ?",
-            (subject.name.title(), subject.teacher.title(),
-             subject.room.upper(), subject.colour.upper(), subject.subject_id)
-        )
+        self._execute("update", (subject.name.title(), subject.teacher.title(),
+                                 subject.room.upper(), subject.colour.upper(), subject.subject_id))
+        self.forget_subject(subject.subject_id)
         return True
 
-    def add_subject(self, subject: Subject) -> bool:
-        if subject.subject_id is None:
-            subject.subject_id = self.get_next_id()
-        self._insert(
+    def add_subject(self, subject: Subject) -> int:
+        """
+        Adds a subject, and returns its ID.
+        """
+        subject.subject_id = self._insert(
             "subjects",
             "subject_id, user_id, name, teacher, room, colour",
             (subject.subject_id, subject.user_id, subject.name.title(
             ), subject.teacher.title(), subject.room.upper(), subject.colour.upper())
         )
-        return True
+        # The ID may have been given by the caller, and looked up before the subject existed.
+        self.forget_subject(subject.subject_id)
+        return subject.subject_id
 
-    def get_subjects_by_user(self, user_id: int) -> List[Subject]:
-        subject_data = self._get(
-            "*", "subjects", where="user_id = ?", args=(user_id,))
-        return [self.convert_result_to_subject(subject) for subject in subject_data]
-
-    def get_next_id(self) -> int:
-        latest_id = self._get("subject_id", "subjects",
-                              order="subject_id DESC")
-        return 1 if len(latest_id) == 0 else latest_id[0][0] + 1
+    def get_subjects_by_user(self, user_id: int) -> List[SubjectRecord]:
+        subject_data = self._query("by_user", (user_id, ))
+        return [self.convert_result_to_record(subject) for subject in subject_data]
 
 
 class UserSubjectDB(DB):
-    def __init__(self, path):
-        super().__init__(path)
+    STATEMENTS = {
+        "by_period": "SELECT subject_id FROM `users-subjects` WHERE user_id = ? AND day = ? AND period = ?",
+        "timetable": "SELECT day, period, subject_id FROM `users-subjects` WHERE user_id = ? ORDER BY day ASC",
+        "timetable_subjects": "SELECT us.day, us.period, "
+        + ", ".join(f"s.{col}" for col in SubjectsDB.COLUMNS.split(", "))
+        + " FROM `users-subjects` AS us JOIN subjects AS s ON s.subject_id = us.subject_id WHERE us.user_id = ?",
+    }
+
+    def __init__(self, path, pool: Optional[ConnectionPool] = None):
+        super().__init__(path, pool)
         DDL = """CREATE TABLE IF NOT EXISTS "users-subjects" (
 	"user_id"	INTEGER NOT NULL,
 	"subject_id"	INTEGER NOT NULL,
@@ -260,31 +830,28 @@ class UserSubjectDB(DB):
         self._create_raw(DDL)
 
     def get_subject_by_period(self, user_id: int, day: int, period: int) -> UserSubjectJoin:
-        result = self._get("subject_id", "`users-subjects`",
-                           where="user_id = ? AND day = ? AND period = ?", args=(user_id, day, period))
+        result = self._query("by_period", (user_id, day, period))
 
         return UserSubjectJoin(user_id=user_id, subject_id=result[0][0], day=day, period=period) if result else None
 
     def get_timetable(self, user_id: int) -> Timetable:
-        results = self._get("day, period, subject_id", "`users-subjects`",
-                            where="user_id = ?", order="day ASC", args=(user_id, ))
-        if not results:
-            return Timetable()
+        results = self._query("timetable", (user_id, ))
+        timetable = Timetable()
+        for day, period, subject_id in results:
+            timetable.set_period(day, period, subject_id)
+        return timetable
+
+    def get_timetable_subjects(self, user_id: int) -> Timetable:
+        """
+        Gets a user's timetable with each period filled in with its Subject, instead of just the ID.
+
+        This is done with a single query, rather than looking up each subject separately.
+        """
+        results = self._query("timetable_subjects", (user_id, ))
         timetable = Timetable()
         for result in results:
-            day = result[0]
-            period = result[1]
-            subject_id = result[2]
-            if day == 0:
-                timetable.monday[period] = subject_id
-            elif day == 1:
-                timetable.tuesday[period] = subject_id
-            elif day == 2:
-                timetable.wednesday[period] = subject_id
-            elif day == 3:
-                timetable.thursday[period] = subject_id
-            elif day == 4:
-                timetable.friday[period] = subject_id
+            timetable.set_period(
+                result[0], result[1], SubjectsDB.convert_result_to_subject(result[2:]))
         return timetable
 
     def create_connection(self, user_id: int, subject_id: int, day: int, period: int) -> bool:
@@ -310,8 +877,20 @@ class UserSubjectDB(DB):
 
 
 class ClassDB(DB):
-    def __init__(self, path):
-        super().__init__(path)
+    """
+    This deals with classes, and the overviews of them which teachers see.
+
+    Classes looked up by ID are kept in `cache` (if given), since every class route checks who owns the class first.
+    """
+
+    STATEMENTS = {
+        "get": "SELECT * FROM classes WHERE class_id = ?",
+        "by_teacher": "SELECT * FROM classes WHERE teacher_id = ?",
+    }
+
+    def __init__(self, path, pool: Optional[ConnectionPool] = None, cache: Optional[CacheBackend] = None):
+        super().__init__(path, pool)
+        self.cache = cache
         DDL = """CREATE TABLE IF NOT EXISTS "classes" (
 	"class_id"	INTEGER NOT NULL,
 	"teacher_id"	INTEGER NOT NULL,
@@ -325,25 +904,87 @@ class ClassDB(DB):
         return Class(class_id=result[0], teacher_id=result[1], class_name=result[2])
 
     def get_class(self, class_id: int) -> Class:
-        result = self._get(
-            "*", "classes", where="class_id = ?", args=(class_id, ))
-        return self.convert_result_to_class(result[0]) if result else None
+        if self.cache is not None:
+            result = self.cache.get(class_id)
+            if result is not None:
+                return self.convert_result_to_class(result)
+        result = self._query("get", (class_id, ))
+        if not result:
+            return None
+        if self.cache is not None:
+            self.cache.set(class_id, result[0])
+        return self.convert_result_to_class(result[0])
+
+    def forget_class(self, class_id: int) -> None:
+        """
+        Removes a class from the cache. This must be done whenever a class is changed or deleted.
+        """
+        if self.cache is not None and class_id is not None:
+            self.cache.delete(class_id)
 
     def get_classes(self, teacher_id: int) -> List[Class]:
-        results = self._get(
-            "*", "classes", where="teacher_id = ?", args=(teacher_id,))
+        results = self._query("by_teacher", (teacher_id, ))
         return [self.convert_result_to_class(result) for result in results]
 
-    def create_class(self, teacher_id: int, name: str) -> None:
-        self._insert("classes", "teacher_id, class_name", (teacher_id, name))
+    def get_class_overviews(self, classes: List[Class]) -> List[Class]:
+        """
+        Fills in the students and homework for each of the given classes.
+
+        Each piece of homework has `completed_by` set to the number of students in the class who have completed it.
+
+        This takes the same number of queries no matter how many classes, students or pieces of homework there are.
+        """
+        if not classes:
+            return classes
+        by_id = {cl.class_id: cl for cl in classes}
+        placeholders = ", ".join("?" * len(by_id))
+        for cl in classes:
+            cl.students = []
+            cl.homework = []
+        students = self._get("cs.class_id, u.uid, u.username, u.created_at, u.permissions",
+                             "`class-student` AS cs JOIN users AS u ON u.uid = cs.student_id",
+                             where=f"cs.class_id IN ({placeholders})", args=tuple(by_id))
+        for class_id, uid, username, created_at, permissions in students:
+            by_id[class_id].students.append(PublicUser(
+                uid=uid, username=username, created_at=created_at, permissions=permissions))
+        # Only students who are still in the class count towards completed_by.
+        homework = self._get("h.homework_id, h.name, h.class_id, 0, h.due_date, NULL, h.description, COUNT(cs.student_id)",
+                             "homework AS h LEFT JOIN `homework-completions` AS hc ON hc.homework_id = h.homework_id"
+                             " LEFT JOIN `class-student` AS cs ON cs.class_id = h.class_id AND cs.student_id = hc.student_id",
+                             where=f"h.class_id IN ({placeholders}) AND h.user_id IS NULL", group="h.homework_id",
+                             order="h.due_date ASC", args=tuple(by_id))
+        for result in homework:
+            hw = HomeworkDB.convert_result_to_homework(result)
+            hw.completed_by = result[7]
+            by_id[hw.class_id].homework.append(hw)
+        return classes
+
+    def get_homework_completion(self, class_id: int, homework: Homework) -> dict:
+        """
+        Gets the usernames of the students in a class who have and haven't completed a piece of homework.
+        """
+        results = self._get("u.username, hc.student_id IS NOT NULL",
+                            "`class-student` AS cs JOIN users AS u ON u.uid = cs.student_id"
+                            " LEFT JOIN `homework-completions` AS hc ON hc.homework_id = ? AND hc.student_id = cs.student_id",
+                            where="cs.class_id = ?", args=(homework.homework_id, class_id))
+        students = {"completed": [], "incomplete": []}
+        for username, completed in results:
+            students["completed" if completed else "incomplete"].append(username)
+        return students
+
+    def create_class(self, teacher_id: int, name: str) -> int:
+        class_id = self._insert("classes", "teacher_id, class_name", (teacher_id, name))
+        self.forget_class(class_id)
+        return class_id
 
     def delete_class(self, class_id: int) -> None:
         self._delete("classes", "class_id = ?", (class_id, ))
+        self.forget_class(class_id)
 
 
 class ClassStudentDB(DB):
-    def __init__(self, path):
-        super().__init__(path)
+    def __init__(self, path, pool: Optional[ConnectionPool] = None):
+        super().__init__(path, pool)
         DDL = """CREATE TABLE IF NOT EXISTS "class-student" (
 	"student_id"	INTEGER NOT NULL,
 	"class_id"	INTEGER NOT NULL,
@@ -373,8 +1014,19 @@ class ClassStudentDB(DB):
 
 
 class HomeworkDB(DB):
-    def __init__(self, path):
-        super().__init__(path)
+    """
+    This deals with homework, both for individual users and set for a class.
+
+    Homework set for a class is stored once, with a class_id and no user_id.
+    Which students have completed it is kept in the `homework-completions` table.
+    """
+
+    STATEMENTS = {
+        "get": "SELECT * FROM homework WHERE homework_id = ?",
+    }
+
+    def __init__(self, path, pool: Optional[ConnectionPool] = None):
+        super().__init__(path, pool)
         DDL = """CREATE TABLE IF NOT EXISTS "homework" (
 	"homework_id"	INTEGER NOT NULL,
 	"name"	TEXT NOT NULL,
@@ -382,66 +1034,126 @@ class HomeworkDB(DB):
 	"user_id"	INTEGER DEFAULT NULL,
 	"due_date"	INTEGER NOT NULL,
 	"completed"	INTEGER,
-	"decription" TEXT,
+	"description"	TEXT,
 	PRIMARY KEY("homework_id" AUTOINCREMENT),
 	FOREIGN KEY("user_id") REFERENCES "users"("uid"),
 	FOREIGN KEY("class_id") REFERENCES "classes"("class_id")
+)"""
+        self._create_raw(DDL)
+        DDL = """CREATE TABLE IF NOT EXISTS "homework-completions" (
+	"homework_id"	INTEGER NOT NULL,
+	"student_id"	INTEGER NOT NULL,
+	PRIMARY KEY("homework_id","student_id"),
+	FOREIGN KEY("homework_id") REFERENCES "homework"("homework_id"),
+	FOREIGN KEY("student_id") REFERENCES "users"("uid")
 )"""
         self._create_raw(DDL)
 
-    def convert_result_to_homework(self, result) -> Homework:
+    @staticmethod
+    def convert_result_to_homework(result) -> Homework:
         return Homework(homework_id=result[0], name=result[1], class_id=result[2], user_id=result[3], due_date=result[4], completed=result[5] != None, description=result[6])
 
-    def get_homework_for_user(self, user_id: int) -> List[Homework]:
-        results = self._get("*", "homework", where="user_id = ?",
-                            order="due_date ASC", args=(user_id,))
-        return [self.convert_result_to_homework(result) for result in results]
+    @staticmethod
+    def convert_result_to_record(result) -> HomeworkRecord:
+        return HomeworkRecord(result[0], result[1], result[2], None, result[3], result[4], result[6], result[5] != None)
+
+    def get_homework_for_user(self, user_id: int, after: Optional[tuple] = None, limit: Optional[int] = None) -> List[HomeworkRecord]:
+        """
+        Gets a user's own homework, along with any homework set for the classes they are in.
+
+        This is ordered by due date, then ID. To get it a page at a time, pass `limit`,
+        and the due date and ID of the last piece you got as `after`.
+        """
+        own_page, class_page, page_args = "", "", ()
+        if after is not None:
+            own_page = " AND (due_date, homework_id) > (?, ?)"
+            class_page = " AND (h.due_date, h.homework_id) > (?, ?)"
+            page_args = tuple(after)
+        query = f"""SELECT homework_id, name, class_id, user_id, due_date, completed, description
+FROM homework WHERE user_id = ?{own_page}
+UNION ALL
+SELECT h.homework_id, h.name, h.class_id, cs.student_id, h.due_date, hc.student_id, h.description
+FROM `class-student` AS cs
+JOIN homework AS h ON h.class_id = cs.class_id AND h.user_id IS NULL
+LEFT JOIN `homework-completions` AS hc ON hc.homework_id = h.homework_id AND hc.student_id = cs.student_id
+WHERE cs.student_id = ?{class_page}
+ORDER BY due_date ASC, homework_id ASC"""
+        args = (user_id, ) + page_args + (user_id, ) + page_args
+        if limit is not None:
+            query += " LIMIT ?"
+            args += (limit, )
+        results = self._get_raw(query, args)
+        return [self.convert_result_to_record(result) for result in results]
 
     def get_homework_for_class(self, class_id: int) -> List[Homework]:
-        results = self._get("*", "homework", where="class_id = ?",
-                            order="due_date ASC", args=(class_id, ))
-        output = []  # I am removing duplicate pieces of homework.
-        # This is because there will be the same piece of homework for each user, and the only difference is the user_id and homework_id.
-        # I only want each one once, and so this removes duplicates after I make all the user_ids the same.
-        for homework in results:
-            homework = self.convert_result_to_homework(homework)
-            homework.user_id = 0
-            found = False
-            for hw in output:
-                if hw.name == homework.name and hw.due_date == homework.due_date and hw.description == homework.description:
-                    found = True
-                    break
-            if not found:
-                output.append(homework)
-        return output
+        results = self._get("homework_id, name, class_id, 0, due_date, NULL, description", "homework",
+                            where="class_id = ? AND user_id IS NULL", order="due_date ASC", args=(class_id, ))
+        return [self.convert_result_to_homework(result) for result in results]
 
     def get_homework(self, homework_id: int) -> Homework:
-        result = self._get("*", "homework", where="homework_id = ?",
-                           order="due_date ASC", args=(homework_id, ))
+        result = self._query("get", (homework_id, ))
         if not result:
             return None
         result = result[0]
         return self.convert_result_to_homework(result)
 
-    def create_homework(self, user_id: int, name: str, due_date: int, description: str) -> None:
-        self._insert("homework", "name, user_id, due_date, completed, description",
-                     (name, user_id, due_date, None, description))
+    def get_class_homework_for_student(self, homework_id: int, student_id: int) -> Homework:
+        """
+        Gets a piece of class homework as a student sees it, including whether they have completed it.
+
+        Returns None if the student isn't in the class it was set for.
+        """
+        result = self._get("h.homework_id, h.name, h.class_id, cs.student_id, h.due_date, hc.student_id, h.description",
+                           "homework AS h JOIN `class-student` AS cs ON cs.class_id = h.class_id AND cs.student_id = ?"
+                           " LEFT JOIN `homework-completions` AS hc ON hc.homework_id = h.homework_id AND hc.student_id = cs.student_id",
+                           where="h.homework_id = ? AND h.user_id IS NULL", args=(student_id, homework_id))
+        if not result:
+            return None
+        return self.convert_result_to_homework(result[0])
+
+    def create_homework(self, user_id: int, name: str, due_date: int, description: str) -> int:
+        return self._insert("homework", "name, user_id, due_date, completed, description",
+                            (name, user_id, due_date, None, description))
 
-    def create_homework_for_class(self, user_id: int, class_id: int, name: str, due_date: int, description: str) -> None:
-        self._insert("homework", "name, class_id, user_id, due_date, completed, description",
-                     (name, class_id, user_id, due_date, None, description))
+    def create_homework_for_class(self, class_id: int, name: str, due_date: int, description: str) -> int:
+        return self._insert("homework", "name, class_id, user_id, due_date, completed, description",
+                            (name, class_id, None, due_date, None, description))
 
     def update_homework(self, homework: Homework) -> None:
         self._update("homework", "name = ?, class_id = ?, user_id = ?, due_date = ?, completed = ?", "homework_id = ?", (homework.name, homework.class_id, homework.user_id, homework.due_date,
                                                                                                                          None if homework.completed == False else 1, homework.homework_id))
 
+    def set_class_homework_completed(self, homework_id: int, student_id: int, completed: bool) -> None:
+        if completed:
+            self._insert("`homework-completions`", "homework_id, student_id",
+                         (homework_id, student_id))
+        else:
+            self._delete("`homework-completions`",
+                         "homework_id = ? AND student_id = ?", (homework_id, student_id))
+
     def delete_homework(self, homework_id: int) -> None:
+        self._delete("`homework-completions`",
+                     "homework_id = ?", (homework_id, ))
         self._delete("homework", "homework_id = ?", (homework_id, ))
 
+    def delete_homework_for_class(self, class_id: int) -> None:
+        self._delete("`homework-completions`",
+                     "homework_id IN (SELECT homework_id FROM homework WHERE class_id = ? AND user_id IS NULL)", (class_id, ))
+        self._delete("homework", "class_id = ? AND user_id IS NULL",
+                     (class_id, ))
+
+    def delete_completions_for_student(self, student_id: int) -> None:
+        self._delete("`homework-completions`",
+                     "student_id = ?", (student_id, ))
+
 
 class EventDB(DB):
-    def __init__(self, path):
-        super().__init__(path)
+    STATEMENTS = {
+        "get": "SELECT * FROM events WHERE event_id = ?",
+    }
+
+    def __init__(self, path, pool: Optional[ConnectionPool] = None):
+        super().__init__(path, pool)
         DDL = """CREATE TABLE IF NOT EXISTS "events" (
 	"event_id"	INTEGER NOT NULL,
 	"user_id"	INTEGER NOT NULL,
@@ -457,27 +1169,48 @@ class EventDB(DB):
     def convert_result_to_event(self, result) -> Event:
         return Event(event_id=result[0], user_id=result[1], name=result[2], time=result[3], description=result[4], private=result[5] == 1)
 
-    def get_events(self) -> List[Event]:
+    def convert_result_to_record(self, result) -> EventRecord:
+        return EventRecord(result[0], result[1], result[2], result[3], result[4], result[5] == 1)
+
+    def get_events(self, after: Optional[int] = None, limit: Optional[int] = None) -> List[EventRecord]:
+        """
+        Gets every public event, in order of ID.
+
+        To get them a page at a time, pass `limit`, and the ID of the last event you got as `after`.
+        """
+        # This has to be written out, rather than passed as an argument, for SQLite to use the events_public index.
+        where, args = "private = 0", ()
+        if after is not None:
+            where, args = where + " AND event_id > ?", args + (after, )
         public_results = self._get(
-            "*", "events", where="private = ?", args=(0, ))
-        return [self.convert_result_to_event(result) for result in public_results]
+            "*", "events", where=where, order="event_id ASC", args=args, limit=limit)
+        return [self.convert_result_to_record(result) for result in public_results]
+
+    def iter_events(self) -> Iterator[EventRecord]:
+        """
+        Goes through every public event without loading them all into memory at once.
+        """
+        for result in self._iter("*", "events", "event_id", where="private = 0"):
+            yield self.convert_result_to_record(result)
 
     def get_event(self, event_id: int, user_id: int) -> Event:
-        result = self._get(
-            "*", "events", where="event_id = ?", args=(event_id, ))
+        result = self._query("get", (event_id, ))
         if result and (result[0][5] is None or result[0][5] == 0 or result[0][1] == user_id):
             return self.convert_result_to_event(result[0])
         else:
             return None
 
-    def get_events_by_user(self, user_id: int) -> List[Event]:
+    def get_events_by_user(self, user_id: int, after: Optional[int] = None, limit: Optional[int] = None) -> List[EventRecord]:
+        where, args = "user_id = ?", (user_id, )
+        if after is not None:
+            where, args = where + " AND event_id > ?", args + (after, )
         results = self._get(
-            "*", "events", where="user_id = ?", args=(user_id, ))
-        return [self.convert_result_to_event(result) for result in results]
+            "*", "events", where=where, order="event_id ASC", args=args, limit=limit)
+        return [self.convert_result_to_record(result) for result in results]
 
-    def create_event(self, user_id: int, name: str, time: int, description: str, private: bool) -> None:
-        self._insert("events", "user_id, name, time, description, private",
-                     (user_id, name, time, description, 1 if private else 0))
+    def create_event(self, user_id: int, name: str, time: int, description: str, private: bool) -> int:
+        return self._insert("events", "user_id, name, time, description, private",
+                            (user_id, name, time, description, 1 if private else 0))
 
     def delete_event(self, event_id: int, user_id: int) -> bool:
         exists = self.get_event(event_id, user_id)
@@ -488,8 +1221,8 @@ class EventDB(DB):
 
 
 class UserEventDB(DB):
-    def __init__(self, path):
-        super().__init__(path)
+    def __init__(self, path, pool: Optional[ConnectionPool] = None):
+        super().__init__(path, pool)
         DDL = """CREATE TABLE IF NOT EXISTS "user-events" (
 	"user_id"	INTEGER NOT NULL,
 	"event_id"	INTEGER NOT NULL,
@@ -523,8 +1256,13 @@ class UserEventDB(DB):
 
 
 class MarkDB(DB):
-    def __init__(self, path):
-        super().__init__(path)
+    STATEMENTS = {
+        "get": "SELECT * FROM marks WHERE mark_id = ?",
+        "update": "UPDATE marks SET user_id = ?, test_name = ?, mark = ?, grade = ? WHERE mark_id = ?",
+    }
+
+    def __init__(self, path, pool: Optional[ConnectionPool] = None):
+        super().__init__(path, pool)
         DDL = """CREATE TABLE IF NOT EXISTS "marks" (
 	"mark_id"	INTEGER NOT NULL,
 	"user_id"	INTEGER NOT NULL,
@@ -540,20 +1278,26 @@ class MarkDB(DB):
         return Mark(mark_id=result[0], user_id=result[1], test_name=result[2], mark=result[3], grade=result[4])
 
     def get_mark(self, mark_id: int) -> Mark:
-        result = self._get("*", "marks", where="mark_id = ?", args=(mark_id, ))
+        result = self._query("get", (mark_id, ))
         if not result:
             return None
         result = result[0]
         return self.convert_result_to_mark(result)
 
-    def get_marks_for_user(self, user_id: int) -> List[Mark]:
+    def convert_result_to_record(self, result) -> MarkRecord:
+        return MarkRecord(*result)
+
+    def get_marks_for_user(self, user_id: int, after: Optional[int] = None, limit: Optional[int] = None) -> List[MarkRecord]:
+        where, args = "user_id = ?", (user_id, )
+        if after is not None:
+            where, args = where + " AND mark_id > ?", args + (after, )
         results = self._get(
-            "*", "marks", where="user_id = ?", args=(user_id, ))
-        return [self.convert_result_to_mark(result) for result in results]
+            "*", "marks", where=where, order="mark_id ASC", args=args, limit=limit)
+        return [self.convert_result_to_record(result) for result in results]
 
-    def add_mark(self, user_id: int, test_name: str, mark: int, grade: str) -> None:
-        self._insert("marks", "user_id, test_name, mark, grade",
-                     (user_id, test_name, mark, grade))
+    def add_mark(self, user_id: int, test_name: str, mark: int, grade: str) -> int:
+        return self._insert("marks", "user_id, test_name, mark, grade",
+                            (user_id, test_name, mark, grade))
 
     def delete_mark(self, mark_id: int) -> bool:
         exists = self.get_mark(mark_id)
@@ -563,17 +1307,13 @@ class MarkDB(DB):
         return True
 
     def update_mark(self, mark: Mark) -> None:
-        self._update(
-            "marks",
-            "user_id = ?, test_name = ?, mark = ?, grade = ?",
-            "mark_id = ?",
-            (mark.user_id, mark.test_name, mark.mark, mark.grade, mark.mark_id)
-        )
+        self._execute("update", (mark.user_id, mark.test_name,
+                      mark.mark, mark.grade, mark.mark_id))
 
 
 class RegistrationCodeDB(DB):
-    def __init__(self, path):
-        super().__init__(path)
+    def __init__(self, path, pool: Optional[ConnectionPool] = None):
+        super().__init__(path, pool)
         DDL = """CREATE TABLE IF NOT EXISTS "registration_codes" (
 	"code"	TEXT NOT NULL,
 	"permissions"	INTEGER NOT NULL,
@@ -588,3 +1328,254 @@ class RegistrationCodeDB(DB):
             return None
         result = result[0]
         return Permissions(result[1])
+
+
+class VersionDB(DB):
+    """
+    This tells whether one of a user's collections has changed, without reading any of it.
+
+    Each user has a counter for their timetable, homework, marks, subjects and events,
+    which is increased by triggers (added in migrations.py) whenever something in it is written to.
+    Collections which everyone shares, like the public events, are counted under user 0.
+    """
+
+    EVERYONE = 0
+
+    STATEMENTS = {
+        "get": "SELECT version FROM versions WHERE user_id = ? AND collection = ?",
+    }
+
+    def get_version(self, user_id: int, collection: str) -> int:
+        result = self._query("get", (user_id, collection))
+        return result[0][0] if result else 0
+
+
+class DashboardDB(DB):
+    """
+    This keeps a ready made copy of each user's home screen, so that it can be sent with a single read.
+
+    A snapshot holds the user's periods for today, the homework they have left to do, their latest marks,
+    and upcoming events, already encoded as JSON.
+    The table and the triggers which keep it up to date are created by a migration:
+    whenever something on a user's home screen is written to, their snapshot is deleted,
+    and it is built again the next time they ask for it.
+    Snapshots are also built again at the start of each day, as what counts as today and upcoming moves on.
+    """
+
+    DAY = 86400
+    HOMEWORK_LIMIT = 10
+    MARKS_LIMIT = 5
+    EVENTS_LIMIT = 10
+
+    STATEMENTS = {
+        "get": "SELECT day, data FROM dashboards WHERE user_id = ?",
+        "save": "INSERT OR REPLACE INTO dashboards(user_id, day, data) VALUES (?, ?, ?)",
+        "periods": "SELECT us.period, "
+        + ", ".join(f"s.{col}" for col in SubjectsDB.COLUMNS.split(", "))
+        + " FROM `users-subjects` AS us JOIN subjects AS s ON s.subject_id = us.subject_id"
+        " WHERE us.user_id = ? AND us.day = ?",
+        "homework": """SELECT homework_id, name, class_id, user_id, due_date, completed, description
+FROM homework WHERE user_id = ? AND due_date >= ? AND completed IS NULL
+UNION ALL
+SELECT h.homework_id, h.name, h.class_id, cs.student_id, h.due_date, NULL, h.description
+FROM `class-student` AS cs
+JOIN homework AS h ON h.class_id = cs.class_id AND h.user_id IS NULL
+WHERE cs.student_id = ? AND h.due_date >= ? AND NOT EXISTS (
+    SELECT 1 FROM `homework-completions` AS hc WHERE hc.homework_id = h.homework_id AND hc.student_id = cs.student_id)
+ORDER BY due_date ASC, homework_id ASC LIMIT ?""",
+        "marks": "SELECT * FROM marks WHERE user_id = ? ORDER BY mark_id DESC LIMIT ?",
+        # Public events and the user's own are read separately, so each half can use its own index.
+        "events": "SELECT * FROM events WHERE private = 0 AND time >= ?2 "
+        "UNION ALL SELECT * FROM events WHERE user_id = ?1 AND private IS NOT 0 AND time >= ?2 "
+        "ORDER BY time ASC, event_id ASC LIMIT ?3",
+    }
+
+    def _run(self, db: sqlite3.Connection, name: str, args: tuple) -> List:
+        return self.pool.run(db, f"{type(self).__name__}.{name}", self.STATEMENTS[name], args)
+
+    def build_dashboard(self, db: sqlite3.Connection, user_id: int, day: int) -> dict:
+        """
+        Reads everything on a user's home screen for `day`, which is counted in days since 1970.
+        """
+        # Due dates and event times are stored as the client sends them, in milliseconds.
+        start = day * self.DAY * 1000
+        # The 1st of January 1970 was a thursday, and day 0 of the timetable is monday.
+        weekday = (day + 3) % 7
+        periods = []
+        if weekday < 5:
+            periods = [None] * 9
+            for result in self._run(db, "periods", (user_id, weekday)):
+                if 0 <= result[0] < len(periods):
+                    periods[result[0]] = SubjectsDB.convert_result_to_record(result[1:])
+        homework = self._run(db, "homework", (user_id, start, user_id, start, self.HOMEWORK_LIMIT))
+        marks = self._run(db, "marks", (user_id, self.MARKS_LIMIT))
+        events = self._run(db, "events", (user_id, start, self.EVENTS_LIMIT))
+        return {
+            "day": weekday,
+            "periods": periods,
+            "homework": [HomeworkDB.convert_result_to_record(result) for result in homework],
+            "marks": [MarkRecord(*result) for result in marks],
+            "events": [EventRecord(result[0], result[1], result[2], result[3], result[4], result[5] == 1)
+                       for result in events],
+        }
+
+    def get_dashboard(self, user_id: int, now: float) -> str:
+        """
+        Gets a user's home screen as JSON, building it first if there isn't an up to date snapshot.
+        """
+        day = int(now // self.DAY)
+        result = self._query("get", (user_id, ))
+        if result and result[0][0] == day:
+            return result[0][1]
+        with self.pool.connection() as db:
+            # The snapshot is read and saved in one transaction. If anything is written in between,
+            # SQLite refuses to save it, rather than letting an out of date snapshot be kept.
+            began = not db.in_transaction
+            if began:
+                db.execute("BEGIN")
+            try:
+                data = json.dumps(self.build_dashboard(db, user_id, day), default=dataclasses.asdict,
+                                  ensure_ascii=False, separators=(",", ":"))
+                try:
+                    self._run(db, "save", (user_id, day, data))
+                except sqlite3.OperationalError:
+                    if not began:
+                        raise
+                    # What was read is still a consistent view of the user's data, so it can be sent,
+                    # but the next request will have to build it again.
+                    db.rollback()
+                    return data
+                if began:
+                    db.commit()
+            except BaseException:
+                if began:
+                    db.rollback()
+                raise
+        return data
+
+
+class ChangeDB(DB):
+    """
+    This tells clients which keep their own copy of a user's data what has changed since they last asked.
+
+    Every write to a user's homework, marks, timetable or events is logged in the `changes` table
+    by triggers (added in migrations.py). Changes to public events are logged under user 0.
+    A client's cursor is the ID of the last change it has seen.
+
+    Rather than replaying each change, the current state of everything which changed is sent,
+    so an item changed many times is only sent once, and anything the user can no longer see is sent as deleted.
+    """
+
+    STATEMENTS = {
+        "latest": "SELECT seq FROM sqlite_sequence WHERE name = 'changes'",
+        "oldest": "SELECT MIN(change_id) FROM changes",
+        "changes": "SELECT change_id, collection, item_id FROM changes WHERE user_id IN (?, 0) AND change_id > ? "
+        "ORDER BY change_id ASC LIMIT ?",
+        # Passing NULL instead of a JSON list of IDs gets every item.
+        "homework": """SELECT homework_id, name, class_id, user_id, due_date, completed, description
+FROM homework WHERE user_id = ?1 AND (?2 IS NULL OR homework_id IN (SELECT value FROM json_each(?2)))
+UNION ALL
+SELECT h.homework_id, h.name, h.class_id, cs.student_id, h.due_date, hc.student_id, h.description
+FROM `class-student` AS cs
+JOIN homework AS h ON h.class_id = cs.class_id AND h.user_id IS NULL
+LEFT JOIN `homework-completions` AS hc ON hc.homework_id = h.homework_id AND hc.student_id = cs.student_id
+WHERE cs.student_id = ?1 AND (?2 IS NULL OR h.homework_id IN (SELECT value FROM json_each(?2)))
+ORDER BY due_date ASC, homework_id ASC""",
+        "marks": "SELECT * FROM marks WHERE user_id = ?1 AND (?2 IS NULL OR mark_id IN (SELECT value FROM json_each(?2))) "
+        "ORDER BY mark_id ASC",
+        # Events are shared, so there are far more of them than a user's own homework or marks.
+        # When only some have changed, they are looked up by ID instead of reading every event the user can see.
+        "events": "SELECT * FROM events WHERE private = 0 "
+        "UNION ALL SELECT * FROM events WHERE user_id = ? AND private IS NOT 0 ORDER BY event_id ASC",
+        "changed_events": "SELECT * FROM events WHERE event_id IN (SELECT value FROM json_each(?2)) "
+        "AND (private = 0 OR user_id = ?1) ORDER BY event_id ASC",
+        "timetable": UserSubjectDB.STATEMENTS["timetable_subjects"],
+        "prune": "DELETE FROM changes WHERE change_id < COALESCE((SELECT MIN(change_id) FROM changes WHERE changed_at >= ?), "
+        "(SELECT MAX(change_id) + 1 FROM changes), 0)",
+    }
+
+    def _run(self, db: sqlite3.Connection, name: str, args: tuple) -> List:
+        return self.pool.run(db, f"{type(self).__name__}.{name}", self.STATEMENTS[name], args)
+
+    def _read_items(self, db: sqlite3.Connection, user_id: int, collection: str, item_ids: Optional[set]) -> dict:
+        ids = None if item_ids is None else json.dumps(sorted(item_ids))
+        if collection != "events":
+            results = self._run(db, collection, (user_id, ids))
+        elif ids is None:
+            results = self._run(db, "events", (user_id, ))
+        else:
+            results = self._run(db, "changed_events", (user_id, ids))
+        if collection == "homework":
+            items = [HomeworkDB.convert_result_to_record(result) for result in results]
+            found = {item.homework_id for item in items}
+        elif collection == "marks":
+            items = [MarkRecord(*result) for result in results]
+            found = {item.mark_id for item in items}
+        else:
+            items = [EventRecord(result[0], result[1], result[2], result[3], result[4], result[5] == 1)
+                     for result in results]
+            found = {item.event_id for item in items}
+        deleted = [] if item_ids is None else sorted(item_ids - found)
+        return {"changed": items, "deleted": deleted}
+
+    def _read_timetable(self, db: sqlite3.Connection, user_id: int) -> list:
+        timetable = Timetable()
+        for result in self._run(db, "timetable", (user_id, )):
+            timetable.set_period(result[0], result[1], SubjectsDB.convert_result_to_record(result[2:]))
+        return timetable.get_client_format()
+
+    def get_changes(self, user_id: int, since: Optional[int] = None, limit: int = 500) -> dict:
+        """
+        Gets everything which has changed for a user since the change with the ID `since`.
+
+        For homework, marks and events, this gives what each changed item is now, and the IDs of any which were deleted.
+        If the timetable changed, all of it is sent, otherwise it is None.
+
+        If `since` is None, or so old that the changes after it have been pruned, `reset` is true,
+        and everything the user has is sent instead, which the client should replace its copy with.
+
+        At most `limit` changes are looked at each time. If there were more, `has_more` is true,
+        and this should be called again with the new cursor.
+        """
+        with self.pool.connection() as db:
+            # Everything is read in one transaction, so that the data sent is all from the same moment.
+            began = not db.in_transaction
+            if began:
+                db.execute("BEGIN")
+            try:
+                result = self._run(db, "latest", ())
+                latest = result[0][0] if result else 0
+                reset = since is None or since > latest
+                if not reset:
+                    oldest = self._run(db, "oldest", ())[0][0]
+                    # If nothing is left in the log, every change up to the latest one has been pruned.
+                    reset = since < (oldest if oldest is not None else latest + 1) - 1
+                cursor, has_more = latest, False
+                changed = {"homework": None, "marks": None, "events": None, "timetable": None}
+                if not reset:
+                    changes = self._run(db, "changes", (user_id, since, limit))
+                    changed = {"homework": set(), "marks": set(), "events": set(), "timetable": set()}
+                    for _, collection, item_id in changes:
+                        changed[collection].add(item_id)
+                    if len(changes) == limit:
+                        cursor, has_more = changes[-1][0], True
+                data = {"reset": reset, "cursor": str(cursor), "has_more": has_more}
+                for collection in ("homework", "marks", "events"):
+                    if reset or changed[collection]:
+                        data[collection] = self._read_items(db, user_id, collection, changed[collection])
+                    else:
+                        data[collection] = {"changed": [], "deleted": []}
+                data["timetable"] = self._read_timetable(db, user_id) if reset or changed["timetable"] else None
+            finally:
+                if began:
+                    db.rollback()
+        return data
+
+    def prune_changes(self, older_than: int) -> int:
+        """
+        Deletes changes made before the time `older_than`, so that the log doesn't grow forever.
+
+        Clients which haven't synced since then will be sent everything again.
+        Returns how many changes were deleted.
+        """
+        return self._execute("prune", (older_than, )).rowcount
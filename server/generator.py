@@ -0,0 +1,234 @@
+"""
+Fills a database with made up data shaped like a real school, for benchmarking and capacity planning.
+
+    python generator.py databases/bench.db --teachers 1000 --students 100000
+
+The same seed always gives the same data. Dates are relative to `--now` (the start of today by default),
+so pass it as well to get exactly the same database on a different day.
+
+Every user has the password "password", and the session token "bench-<uid>",
+so that they can be used without logging in first.
+"""
+import argparse
+import random
+import sys
+import time
+from typing import Optional
+
+from classes import Permissions
+from database import (ClassDB, ClassStudentDB, EventDB, HomeworkDB, MarkDB, RegistrationCodeDB, SubjectsDB,
+                      UserEventDB, UserSubjectDB, UsersDB, close_pools, get_pool)
+from hashing import Scrypt
+from migrations import migrate
+
+PASSWORD = "password"
+SALT = "benchmarksalt000"
+
+SUBJECT_NAMES = ["Maths", "English", "Science", "History", "Geography", "Art", "Music", "French", "Computing"]
+GRADES = "ABCDEF"
+DAY = 86400
+# Due dates and event times are stored in milliseconds, like the client sends them.
+MS = 1000
+
+
+def session_for(uid: int) -> str:
+    return f"bench-{uid}"
+
+
+class Scale:
+    """
+    How much of everything to generate.
+    """
+
+    def __init__(self, teachers: int = 100, students: int = 5000, subjects_per_teacher: int = 5,
+                 classes_per_teacher: int = 3, students_per_class: int = 30, homework_per_class: int = 10,
+                 homework_per_student: int = 5, marks_per_student: int = 10, events_per_teacher: int = 5,
+                 events_per_student: int = 2, completion_rate: float = 0.5):
+        self.teachers = teachers
+        self.students = students
+        self.subjects_per_teacher = subjects_per_teacher
+        self.classes_per_teacher = classes_per_teacher
+        self.students_per_class = students_per_class
+        self.homework_per_class = homework_per_class
+        self.homework_per_student = homework_per_student
+        self.marks_per_student = marks_per_student
+        self.events_per_teacher = events_per_teacher
+        self.events_per_student = events_per_student
+        # The chance that a student has completed each piece of homework set for their class.
+        self.completion_rate = completion_rate
+
+
+def generate(path: str, scale: Scale, seed: int = 0, now: Optional[int] = None) -> dict:
+    """
+    Creates the tables in `path` if needed, and fills them with data.
+
+    The rows are generated as they are inserted, so memory use stays low however big the scale is.
+
+    Returns how many rows were added to each table.
+    """
+    rng = random.Random(seed)
+    if now is None:
+        now = int(time.time()) // DAY * DAY
+    pool = get_pool(path)
+    users = UsersDB(path, pool)
+    subjects = SubjectsDB(path, pool)
+    timetables = UserSubjectDB(path, pool)
+    classes = ClassDB(path, pool)
+    class_students = ClassStudentDB(path, pool)
+    homework = HomeworkDB(path, pool)
+    marks = MarkDB(path, pool)
+    events = EventDB(path, pool)
+    UserEventDB(path, pool)
+    RegistrationCodeDB(path, pool)
+    # The dashboards, versions and change log are kept up to date by triggers (migrations 5 to 7),
+    # which would otherwise run for every generated row. They start out empty, so they are added after the data.
+    migrate(pool, target=4)
+
+    # Hashing a password takes a while on purpose, so every user shares the same one.
+    password = Scrypt().hash(PASSWORD, SALT)
+    teacher_ids = range(1, scale.teachers + 1)
+    student_ids = range(scale.teachers + 1, scale.teachers + scale.students + 1)
+    counts = {}
+
+    def user_rows():
+        for uid in teacher_ids:
+            yield uid, f"teacher{uid}", password, SALT, now - rng.randint(0, 365) * DAY, int(Permissions.Teacher), session_for(uid)
+        for uid in student_ids:
+            yield uid, f"student{uid}", password, SALT, now - rng.randint(0, 365) * DAY, int(Permissions.Student), session_for(uid)
+    counts["users"] = users._insert_many(
+        "users", "uid, username, password, salt, created_at, permissions, session", user_rows())
+
+    # Each teacher teaches a few subjects, and the classes they run are for those subjects.
+    teacher_subjects = {
+        teacher_id: [(teacher_id - 1) * scale.subjects_per_teacher + i + 1 for i in range(scale.subjects_per_teacher)]
+        for teacher_id in teacher_ids
+    }
+
+    def subject_rows():
+        for teacher_id, subject_ids in teacher_subjects.items():
+            for subject_id in subject_ids:
+                yield (subject_id, teacher_id, rng.choice(SUBJECT_NAMES), f"Teacher {teacher_id}",
+                       f"R{rng.randint(1, 300)}", f"#{rng.randrange(0x1000000):06X}")
+    counts["subjects"] = subjects._insert_many(
+        "subjects", SubjectsDB.COLUMNS, subject_rows())
+
+    class_teachers = {}
+    for teacher_id in teacher_ids:
+        for _ in range(scale.classes_per_teacher):
+            class_teachers[len(class_teachers) + 1] = teacher_id
+    counts["classes"] = classes._insert_many("classes", "class_id, teacher_id, class_name",
+                                             ((class_id, teacher_id, f"Class {class_id}")
+                                              for class_id, teacher_id in class_teachers.items()))
+
+    # Students are dealt into classes in a shuffled order, so each class gets a full set of students
+    # and each student ends up in roughly the same number of classes.
+    members = {class_id: [] for class_id in class_teachers}
+    student_classes = {student_id: [] for student_id in student_ids}
+    order = list(student_ids)
+    position = len(order)
+    for class_id in class_teachers:
+        chosen = set()
+        while len(chosen) < min(scale.students_per_class, len(order)):
+            if position == len(order):
+                rng.shuffle(order)
+                position = 0
+            chosen.add(order[position])
+            position += 1
+        members[class_id] = sorted(chosen)
+        for student_id in chosen:
+            student_classes[student_id].append(class_id)
+    counts["class-student"] = class_students._insert_many("`class-student`", "student_id, class_id",
+                                                          ((student_id, class_id)
+                                                           for class_id, students in members.items()
+                                                           for student_id in students))
+
+    # A full week is filled in for everyone.
+    # Students are taught by the teachers of their classes, and teachers teach their own subjects.
+    def timetable_rows():
+        for teacher_id in teacher_ids:
+            for day in range(5):
+                for period in range(9):
+                    yield teacher_id, rng.choice(teacher_subjects[teacher_id]), day, period
+        all_subjects = [subject_id for subject_ids in teacher_subjects.values() for subject_id in subject_ids]
+        for student_id in student_ids:
+            taught = [subject_id for class_id in student_classes[student_id]
+                      for subject_id in teacher_subjects[class_teachers[class_id]]] or all_subjects
+            for day in range(5):
+                for period in range(9):
+                    yield student_id, rng.choice(taught), day, period
+    counts["users-subjects"] = timetables._insert_many(
+        "`users-subjects`", "user_id, subject_id, day, period", timetable_rows())
+
+    homework_columns = "homework_id, name, class_id, user_id, due_date, completed, description"
+    class_homework = []
+    for class_id in class_teachers:
+        for i in range(scale.homework_per_class):
+            class_homework.append((len(class_homework) + 1, f"Assignment {i + 1}", class_id, None,
+                                   (now + rng.randint(-14, 28) * DAY) * MS, None, "Set for the whole class."))
+    next_id = len(class_homework) + 1
+
+    def personal_homework_rows():
+        homework_id = next_id
+        for student_id in student_ids:
+            for i in range(scale.homework_per_student):
+                due_date = (now + rng.randint(-14, 28) * DAY) * MS
+                # Homework which was due in the past has usually been done.
+                completed = 1 if due_date < now * MS and rng.random() < 0.8 else None
+                yield homework_id, f"Revision {i + 1}", None, student_id, due_date, completed, ""
+                homework_id += 1
+    counts["homework"] = homework._insert_many("homework", homework_columns, class_homework)
+    counts["homework"] += homework._insert_many("homework", homework_columns, personal_homework_rows())
+
+    def completion_rows():
+        for homework_id, _, class_id, _, _, _, _ in class_homework:
+            for student_id in members[class_id]:
+                if rng.random() < scale.completion_rate:
+                    yield homework_id, student_id
+    counts["homework-completions"] = homework._insert_many(
+        "`homework-completions`", "homework_id, student_id", completion_rows())
+
+    def mark_rows():
+        for student_id in student_ids:
+            for i in range(scale.marks_per_student):
+                mark = rng.randint(0, 100)
+                yield student_id, f"Test {i + 1}", mark, GRADES[min(5, (100 - mark) // 15)]
+    counts["marks"] = marks._insert_many("marks", "user_id, test_name, mark, grade", mark_rows())
+
+    def event_rows():
+        for teacher_id in teacher_ids:
+            for i in range(scale.events_per_teacher):
+                yield teacher_id, f"School event {i + 1}", (now + rng.randint(-7, 60) * DAY) * MS, "Open to everyone.", 0
+        for student_id in student_ids:
+            for i in range(scale.events_per_student):
+                yield student_id, f"Reminder {i + 1}", (now + rng.randint(-7, 60) * DAY) * MS, "", 1
+    counts["events"] = events._insert_many(
+        "events", "user_id, name, time, description, private", event_rows())
+    migrate(pool)
+    return counts
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Fills a database with made up school data.")
+    parser.add_argument("path", help="The database file to fill.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--now", type=int, default=None,
+                        help="The time the dates are relative to, as a unix timestamp.")
+    defaults = Scale()
+    for name, value in vars(defaults).items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=type(value), default=value)
+    args = parser.parse_args(argv)
+    scale = Scale(**{name: getattr(args, name) for name in vars(defaults)})
+
+    start = time.perf_counter()
+    counts = generate(args.path, scale, args.seed, args.now)
+    close_pools()
+    elapsed = time.perf_counter() - start
+    for table, count in counts.items():
+        print(f"{table:>22}: {count}")
+    print(f"{sum(counts.values())} rows in {elapsed:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,174 @@
+import asyncio
+import hmac
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from hashlib import scrypt, sha256, sha384, sha512
+from typing import List, Optional, Tuple
+
+
+class HashingBusy(Exception):
+    """
+    Raised when too many passwords are already waiting to be hashed.
+    """
+
+
+class PasswordAlgorithm:
+    """
+    This is the base class for a way of turning a password into something safe to store.
+
+    Children of this class must implement `hash`, and `identifies` if they mark their stored hashes.
+    """
+
+    name = ""
+
+    def hash(self, password: str, salt: str) -> str:
+        raise NotImplementedError
+
+    def identifies(self, stored: str) -> bool:
+        """
+        Returns whether a stored hash was created by this algorithm.
+        """
+        return stored.startswith(f"{self.name}$")
+
+
+class LegacySHA(PasswordAlgorithm):
+    """
+    The original hashing scheme, which runs the password through sha256, sha384 and sha512 100 times.
+
+    These hashes are stored without a prefix, so this identifies anything that no other algorithm claims.
+    """
+
+    name = "legacy"
+
+    def hash(self, password: str, salt: str) -> str:
+        for _ in range(100):
+            # This process is called salting.
+            # It means that if a malicious individual gets access to the database,
+            # They have no way of retrieving the passwords stored since they go through this process of hashing.
+            # We store the salt in plaintext as to make sure that we can do this same process to allow the user to login.
+            for method in [sha256, sha384, sha512]:
+                password = method(f"{salt}{password}".encode()).hexdigest()
+        return password
+
+    def identifies(self, stored: str) -> bool:
+        return "$" not in stored
+
+
+class Scrypt(PasswordAlgorithm):
+    """
+    A memory-hard algorithm, which makes guessing passwords with specialised hardware much more expensive.
+
+    Hashes are stored as `scrypt$n$r$p$hash` so that the cost can be raised later without breaking old hashes.
+    """
+
+    name = "scrypt"
+
+    def __init__(self, n: int = 2 ** 14, r: int = 8, p: int = 1):
+        self.n = n
+        self.r = r
+        self.p = p
+
+    def hash(self, password: str, salt: str) -> str:
+        return self._hash(password, salt, self.n, self.r, self.p)
+
+    def _hash(self, password: str, salt: str, n: int, r: int, p: int) -> str:
+        digest = scrypt(password.encode(), salt=salt.encode(), n=n, r=r, p=p,
+                        maxmem=256 * n * r + 1024 * 1024, dklen=64)
+        return f"{self.name}${n}${r}${p}${digest.hex()}"
+
+    def hash_like(self, password: str, salt: str, stored: str) -> str:
+        """
+        Hashes a password with the same parameters as a stored hash.
+        """
+        _, n, r, p, _ = stored.split("$")
+        return self._hash(password, salt, int(n), int(r), int(p))
+
+    def is_current(self, stored: str) -> bool:
+        return stored.startswith(f"{self.name}${self.n}${self.r}${self.p}$")
+
+
+def _hash_with(algorithm: PasswordAlgorithm, password: str, salt: str, stored: Optional[str] = None) -> str:
+    # This lives at the top level of the module so that it can be sent to a process pool.
+    if stored is not None and isinstance(algorithm, Scrypt):
+        return algorithm.hash_like(password, salt, stored)
+    return algorithm.hash(password, salt)
+
+
+class PasswordHasher:
+    """
+    This hashes and checks passwords on a separate pool of workers, so that logging in doesn't block the server.
+
+    Only a limited number of passwords can be waiting at once.
+    Once that is reached, HashingBusy is raised so the client can be told to try again later,
+    instead of letting requests pile up.
+
+    New passwords are hashed with `algorithm`. Passwords stored with any of the `legacy` algorithms are still accepted,
+    and `verify` reports that they should be rehashed, so accounts migrate as people log in.
+    """
+
+    def __init__(self, algorithm: PasswordAlgorithm, legacy: Optional[List[PasswordAlgorithm]] = None,
+                 workers: int = 4, max_waiting: int = 64, use_processes: bool = False):
+        self.algorithm = algorithm
+        self.legacy = legacy if legacy is not None else []
+        self.workers = workers
+        self.use_processes = use_processes
+        # Each slot is one password either being hashed or waiting to be.
+        self._slots = threading.BoundedSemaphore(workers + max_waiting)
+        self._executor = None
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            if self.use_processes:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                # hashlib lets go of the GIL while running scrypt, so threads are enough for it.
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="hash")
+        return self._executor
+
+    def _algorithm_for(self, stored: str) -> Optional[PasswordAlgorithm]:
+        for algorithm in [self.algorithm, *self.legacy]:
+            if algorithm.identifies(stored):
+                return algorithm
+        return None
+
+    async def _run(self, algorithm: PasswordAlgorithm, password: str, salt: str, stored: Optional[str] = None) -> str:
+        if not self._slots.acquire(blocking=False):
+            raise HashingBusy()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, _hash_with, algorithm, password, salt, stored)
+        finally:
+            self._slots.release()
+
+    async def hash(self, password: str, salt: str) -> str:
+        """
+        Hashes a password with the current algorithm, ready to be stored.
+        """
+        return await self._run(self.algorithm, password, salt)
+
+    async def verify(self, password: str, salt: str, stored: str) -> Tuple[bool, bool]:
+        """
+        Checks a password against a stored hash.
+
+        Returns whether the password is correct, and whether the stored hash should be replaced with a new one.
+        """
+        algorithm = self._algorithm_for(stored)
+        if algorithm is None:
+            return False, False
+        try:
+            attempt = await self._run(algorithm, password, salt, stored)
+        except ValueError:
+            # The stored hash is malformed, such as one that was cut short, so no password can match it.
+            return False, False
+        if not hmac.compare_digest(attempt, stored):
+            return False, False
+        if algorithm is not self.algorithm:
+            return True, True
+        return True, isinstance(algorithm, Scrypt) and not algorithm.is_current(stored)
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
@@ -1,31 +1,83 @@
+import asyncio
+import dataclasses
+import json
 import random
+import secrets
+import sqlite3
 import uvicorn
 import os
+from contextlib import asynccontextmanager
 from time import time
-from fastapi import FastAPI, Form, HTTPException, Depends, status
+from fastapi import FastAPI, Form, Header, HTTPException, Depends, Query, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.staticfiles import StaticFiles
 from fastapi.routing import Mount
-from fastapi.responses import RedirectResponse
-from hashlib import sha512, sha256, sha384
+from fastapi.responses import JSONResponse, PlainTextResponse, RedirectResponse, Response, StreamingResponse
 
 from database import *
 from classes import *
+from cache import CacheBackend, LRUCache, RedisCache
+from hashing import HashingBusy, LegacySHA, PasswordHasher, Scrypt
+from metrics import InstrumentMiddleware, Metrics
+from migrations import migrate
+
+try:
+    import orjson
+except ImportError:
+    # orjson is optional (see requirements-optional.txt). Without it, responses are encoded with the standard library,
+    # which gives the same JSON but is slower.
+    orjson = None
 
 db_path = "./databases"
 
 os.makedirs(db_path, exist_ok=True)
 
-Users_DB = UsersDB(f"{db_path}/main.db")
-Subjects_DB = SubjectsDB(f"{db_path}/main.db")
-User_Subjects_DB = UserSubjectDB(f"{db_path}/main.db")
-Classes_DB = ClassDB(f"{db_path}/main.db")
-User_Class_DB = ClassStudentDB(f"{db_path}/main.db")
-Homework_DB = HomeworkDB(f"{db_path}/main.db")
-Marks_DB = MarkDB(f"{db_path}/main.db")
-Events_DB = EventDB(f"{db_path}/main.db")
-User_Events_DB = UserEventDB(f"{db_path}/main.db")
-Registration_Code_DB = RegistrationCodeDB(f"{db_path}/main.db")
+# All of the databases share one file, so they should share one set of connections too.
+db_pool = get_pool(f"{db_path}/main.db", size=8)
+
+# Each worker is a separate process, so by default each one has its own caches,
+# and can't tell when another worker changes something they hold.
+# Set REDIS_URL to share the caches between workers, so that changes are seen by all of them straight away.
+# This needs the redis package from requirements-optional.txt, and the server won't start if it is missing.
+redis_url = os.environ.get("REDIS_URL")
+
+# The monitoring routes show the SQL the server runs and how busy it is, so they are only served when this is set,
+# and then only to requests sending it as a bearer token.
+monitoring_token = os.environ.get("MONITORING_TOKEN")
+
+
+def make_cache(namespace: str, max_size: int, ttl: float) -> CacheBackend:
+    if redis_url:
+        return RedisCache(namespace, url=redis_url, ttl=ttl, local_size=max_size)
+    return LRUCache(max_size=max_size, ttl=ttl)
+
+
+# Looking up the current user happens on every request, so recently used sessions are cached.
+# Without Redis they expire quickly, since the other workers can't tell this one when a session is logged out.
+session_cache = make_cache("sessions", max_size=4096, ttl=30.0)
+# Subjects and classes are looked up by ID over and over, but rarely change.
+subject_cache = make_cache("subjects", max_size=4096, ttl=30.0)
+class_cache = make_cache("classes", max_size=1024, ttl=30.0)
+
+Users_DB = AsyncDB(UsersDB(f"{db_path}/main.db", db_pool, session_cache))
+Subjects_DB = AsyncDB(SubjectsDB(f"{db_path}/main.db", db_pool, subject_cache))
+User_Subjects_DB = AsyncDB(UserSubjectDB(f"{db_path}/main.db", db_pool))
+Classes_DB = AsyncDB(ClassDB(f"{db_path}/main.db", db_pool, class_cache))
+User_Class_DB = AsyncDB(ClassStudentDB(f"{db_path}/main.db", db_pool))
+Homework_DB = AsyncDB(HomeworkDB(f"{db_path}/main.db", db_pool))
+Marks_DB = AsyncDB(MarkDB(f"{db_path}/main.db", db_pool))
+Events_DB = AsyncDB(EventDB(f"{db_path}/main.db", db_pool))
+User_Events_DB = AsyncDB(UserEventDB(f"{db_path}/main.db", db_pool))
+Registration_Code_DB = AsyncDB(RegistrationCodeDB(f"{db_path}/main.db", db_pool))
+Dashboard_DB = AsyncDB(DashboardDB(f"{db_path}/main.db", db_pool))
+Versions_DB = AsyncDB(VersionDB(f"{db_path}/main.db", db_pool))
+Changes_DB = AsyncDB(ChangeDB(f"{db_path}/main.db", db_pool))
+
+# Now that every table exists, bring any older database up to date.
+migrate(db_pool)
+
+# New passwords use scrypt. Accounts still using the old hashes are moved over when they next log in.
+password_hasher = PasswordHasher(Scrypt(), legacy=[LegacySHA()], workers=4, max_waiting=64)
 
 tags_metadata = [
     {
@@ -40,6 +92,10 @@ tags_metadata = [
         "name": "Subjects",
         "description": "Operations to manage subjects."
     },
+    {
+        "name": "Dashboard",
+        "description": "Everything shown on the app's home screen, in one request."
+    },
     {
         "name": "Timetable",
         "description": "Operations to manage a user's own timetable."
@@ -55,17 +111,82 @@ tags_metadata = [
     {
         "name": "Marks",
         "description": "Operations to manage a user's marks."
+    },
+    {
+        "name": "Sync",
+        "description": "Operations for clients which keep their own copy of a user's data."
+    },
+    {
+        "name": "Monitoring",
+        "description": "Information about how the server is performing."
     }
 ]
 
+
+async def checkpoint_periodically(interval: float = 60.0):
+    """
+    Keeps the write-ahead log from growing forever while the server is busy.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await loop.run_in_executor(db_pool.executor, db_pool.checkpoint)
+        except sqlite3.Error:
+            # If it fails this time, it will be tried again next time.
+            pass
+
+
+async def prune_changes_periodically(interval: float = 3600.0, keep: int = 30 * 86400):
+    """
+    Deletes old changes from the sync log. Clients which haven't synced for longer than `keep` seconds are sent everything again.
+    """
+    while True:
+        try:
+            await Changes_DB.prune_changes(int(time()) - keep)
+        except sqlite3.Error:
+            pass
+        await asyncio.sleep(interval)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    checkpointer = asyncio.create_task(checkpoint_periodically())
+    pruner = asyncio.create_task(prune_changes_periodically())
+    yield
+    checkpointer.cancel()
+    pruner.cancel()
+    for cache in (session_cache, subject_cache, class_cache):
+        cache.close()
+    # Make sure every database connection is closed cleanly when the server stops.
+    close_pools()
+    password_hasher.close()
+
 app = FastAPI(title="PlanAway API",
               description="PlanAway's API for interacting with the back-end.",
               version="1.0.0",
               tags_metadata=tags_metadata,
+              lifespan=lifespan,
               routes=[
                   Mount("/web", app=StaticFiles(directory="web"), name="Web")]
               )
 
+
+metrics = Metrics()
+
+
+app.add_middleware(InstrumentMiddleware, metrics=metrics)
+
+
+@app.exception_handler(HashingBusy)
+async def hashing_busy(request, exc: HashingBusy):
+    """
+    Tells the client to try again shortly if too many people are logging in at once.
+    """
+    return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                        content={"detail": "Server is busy, please try again."},
+                        headers={"Retry-After": "1"})
+
 oauth2_scheme = OAuth2PasswordBearer(
     tokenUrl="/api/v1/auth/login"
 )
@@ -84,13 +205,162 @@ async def online_check():
     return {"status": "success"}
 
 
+async def require_monitoring(authorization: Optional[str] = Header(None)):
+    """
+    Checks a request to a monitoring route has the token in MONITORING_TOKEN.
+
+    Raises a 404 if monitoring is turned off, or a 401 if the token is missing or wrong.
+    """
+    if not monitoring_token:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    if authorization is None or not secrets.compare_digest(authorization.encode(), f"Bearer {monitoring_token}".encode()):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid token",
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+
+
+@app.get("/api/v1/stats/cache", tags=["Monitoring"], dependencies=[Depends(require_monitoring)])
+async def cache_stats():
+    """
+    Returns how often each cache has been used. Every hit is a database query which didn't need to happen.
+    """
+    return {"status": "success", "data": {
+        "sessions": session_cache.stats(),
+        "subjects": subject_cache.stats(),
+        "classes": class_cache.stats(),
+    }}
+
+
+@app.get("/metrics", tags=["Monitoring"], response_class=PlainTextResponse, dependencies=[Depends(require_monitoring)])
+async def prometheus_metrics():
+    """
+    Returns request and database metrics in the Prometheus text format.
+    """
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/api/v1/stats/statements", tags=["Monitoring"], dependencies=[Depends(require_monitoring)])
+async def statement_stats():
+    """
+    Returns how often each named database statement has been run, and how long it took.
+
+    Cold runs include the time SQLite took to parse the statement, warm runs reused an already parsed one.
+    """
+    return {"status": "success", "data": db_pool.statements.snapshot()}
+
+
+def parse_cursor(cursor: Optional[str], parts: int = 1) -> Optional[tuple]:
+    """
+    Reads a cursor given by a client, which is the values of the last item on their previous page separated by dots.
+
+    Raises a 400 if it isn't valid.
+    """
+    if cursor is None:
+        return None
+    try:
+        values = tuple(int(value) for value in cursor.split("."))
+    except ValueError:
+        values = ()
+    if len(values) != parts:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+
+def page_of(results: list, limit: Optional[int], key) -> dict:
+    """
+    Builds the response for a list of results which may be paginated.
+
+    One more result than the limit should have been fetched, so that we know whether there is another page.
+    If there is, `next_cursor` is set to what the client should send to get it.
+    """
+    next_cursor = None
+    if limit is not None and len(results) > limit:
+        results = results[:limit]
+        next_cursor = ".".join(str(value) for value in key(results[-1]))
+    return {"status": "success", "data": results, "next_cursor": next_cursor}
+
+
+def encode_json(content) -> bytes:
+    """
+    Encodes a response which may contain records from the database.
+    """
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, default=dataclasses.asdict, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class RecordResponse(JSONResponse):
+    """
+    A response for lists of records, which encodes them directly instead of going through FastAPI's jsonable_encoder.
+
+    Routes which only read data should return this, as encoding the records is most of the work they do.
+    """
+
+    def render(self, content) -> bytes:
+        return encode_json(content)
+
+
+def stream_ndjson(items) -> StreamingResponse:
+    """
+    Sends a response with one JSON object per line, as each item is read from the database.
+
+    This means the whole result never has to be held in memory, and the client starts receiving data straight away.
+    """
+    def lines():
+        for item in items:
+            yield encode_json(item) + b"\n"
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+async def collection_etag(user_id: int, collection: str, limit: Optional[int] = None, after: Optional[tuple] = None) -> str:
+    """
+    Gets the ETag for a collection as it is now, which changes whenever anything in it does.
+
+    For a paginated route, pass the `limit` and the parsed cursor as `after`,
+    as each page has a different body, and so needs a different tag.
+
+    This should be looked up before the collection itself is read.
+    If it changes in between, the client is just sent it again next time.
+    """
+    version = await Versions_DB.get_version(user_id, collection)
+    # The user is part of the tag, as the same URL gives each user a different response.
+    etag = f"{collection}-{user_id}-{version}"
+    if limit is not None:
+        etag += f";limit={limit}"
+    if after is not None:
+        etag += ";after=" + ".".join(map(str, after))
+    return f'"{etag}"'
+
+
+def etag_matches(etag: str, if_none_match: Optional[str]) -> bool:
+    """
+    Checks whether the client already has the version of a response with this ETag.
+    """
+    if if_none_match is None:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+def etag_headers(etag: str) -> dict:
+    # Responses are only for the user who asked, and should be checked with us before being reused.
+    return {"ETag": etag, "Cache-Control": "private, no-cache"}
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=etag_headers(etag))
+
+
 async def get_current_user(token: str = Depends(oauth2_scheme)):
     """
     Gets the user that the web request is logged in as.
 
     Raises a 401 if invalid, or returns the User.
     """
-    user = Users_DB.get_user_from_session(token)
+    user = await Users_DB.get_user_from_session(token)
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -111,7 +381,7 @@ async def register(username: str = Form(...), password: str = Form(...), registr
 
     Also ensures a duplicate username is not chosen.
     """
-    user = Users_DB.get_user_from_username(username)
+    user = await Users_DB.get_user_from_username(username)
     if user is not None:
         # If the username is taken, a user will be returned.
         # Therefore we cannot let them have that username.
@@ -119,32 +389,27 @@ async def register(username: str = Form(...), password: str = Form(...), registr
 
     token = "".join(random.choices(
         "abcdefghijklmnopqrstuvwxyz0123456789", k=32))
-    uid = Users_DB.get_next_uid()
 
     salt = "".join(random.choices(
         "abcdefghijklmnopqrstuvwxyz0123456789", k=16))
-    for _ in range(100):
-        # This process is called salting.
-        # It means that if a malicious individual gets access to the database,
-        # They have no way of retrieving the passwords stored since they go through this process of scrambling.
-        # We store the salt in plaintext as to make sure that we can do this same process to allow the user to login.
-        for method in [sha256, sha384, sha512]:
-            password = method(f"{salt}{password}".encode()).hexdigest()
-
-    permissions = Registration_Code_DB.get_permissions(registration_code)
+    # The password is hashed with the salt, so that if a malicious individual gets access to the database,
+    # They have no way of retrieving the passwords stored.
+    password = await password_hasher.hash(password, salt)
+
+    permissions = await Registration_Code_DB.get_permissions(registration_code)
     if registration_code is None or permissions is None:
         permissions = Permissions.Student
 
+    # The user's uid is picked by the database when they are added.
     user = User(
-        uid=uid,
         username=username,
         password=password,
         salt=salt,
         created_at=time(),
         permissions=permissions,
-        session=OAuthToken(access_token=token, uid=uid)
+        session=OAuthToken(access_token=token)
     )
-    Users_DB.add_user(user)
+    await Users_DB.add_user(user)
 
     # Gives the user their token.
     # This means they are now logged in as this user.
@@ -156,27 +421,26 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends()):
     """
     Logs a user in with their username and password.
     """
-    user = Users_DB.get_user_from_username(form_data.username)
+    user = await Users_DB.get_user_from_username(form_data.username)
     if not user:
         raise HTTPException(
             status_code=400, detail="Incorrect username or password")
-    password = form_data.password
-    for _ in range(100):
-        # This process is called salting.
-        # It means that if a malicious individual gets access to the database,
-        # They have no way of retrieving the passwords stored since they go through this process of hashing.
-        # We store the salt in plaintext as to make sure that we can do this same process to allow the user to login.
-        for method in [sha256, sha384, sha512]:
-            password = method(f"{user.salt}{password}".encode()).hexdigest()
-    if user.password != password:
+    valid, needs_rehash = await password_hasher.verify(form_data.password, user.salt, user.password)
+    if not valid:
         raise HTTPException(
             status_code=400, detail="Incorrect username or password")
+    if needs_rehash:
+        # This account is using an older hashing algorithm, so upgrade it now that we know the password.
+        user.password = await password_hasher.hash(form_data.password, user.salt)
 
     token = "".join(random.choices(
         "abcdefghijklmnopqrstuvwxyz0123456789", k=32))
+    old_token = user.session.access_token if user.session is not None else None
     user.session = OAuthToken(access_token=token, uid=user.uid)
 
-    Users_DB.update_user(user)
+    await Users_DB.update_user(user)
+    # Logging in replaces the old token, so it mustn't keep working from the cache.
+    await Users_DB.forget_session(old_token)
 
     return {"access_token": token, "token_type": "Bearer"}
 
@@ -186,8 +450,9 @@ async def logout(current_user: User = Depends(get_current_user)):
     """
     Invalidates the logged in user's token, effectively logging them out.
     """
-    current_user.session = None
-    Users_DB.update_user(current_user)
+    # The current user has no password or salt (see get_user_from_session), so only their session is changed.
+    await Users_DB.set_session(current_user.uid, None)
+    await Users_DB.forget_session(current_user.session.access_token)
     return {"status": "success"}
 
 # ------------------
@@ -196,18 +461,18 @@ async def logout(current_user: User = Depends(get_current_user)):
 
 
 @app.get("/api/v1/users/search/{name}", tags=["Users"])
-async def get_users(name: str, current_user: User = Depends(get_current_user)):
+async def get_users(name: str, limit: int = Query(20, ge=1, le=100), offset: int = Query(0, ge=0), current_user: User = Depends(get_current_user)):
     """
-    Returns users with usernames similar to the search.
+    Returns users with usernames containing the search, with ones starting with it first.
+
+    Use `limit` and `offset` to fetch more results.
 
     Account **MUST** be a teacher account.
     """
     if (current_user.permissions < Permissions.Teacher):
         return {"status": "error", "message": "Account must be a teacher account"}
-    users = Users_DB.get_users()
-    users.remove(current_user)
-    final_users = [user for user in users if user.username.count(name) != 0]
-    return {"status": "success", "data": [user.remove("session", "password", "salt") for user in final_users]}
+    users = await Users_DB.search_users(name, exclude_uid=current_user.uid, limit=limit, offset=offset)
+    return {"status": "success", "data": users}
 
 
 @app.get("/api/v1/users/@me", tags=["Users"])
@@ -229,12 +494,22 @@ async def get_user(user_id: int, user: User = Depends(get_current_user)):
 
     Raises 404 if the user specified is not found.
     """
-    user = Users_DB.get_user_from_uid(user_id)
+    user = await Users_DB.get_user_from_uid(user_id)
     if user:
         return {"status": "success", "data": user.remove("session", "password", "salt")}
     raise HTTPException(status_code=404, detail="User not found")
 
 
+async def purge_user(user: User, delete_account: bool = False) -> None:
+    """
+    Deletes everything belonging to a user, and removes the classes they owned from the cache.
+    """
+    owned_classes = await Classes_DB.get_classes(user.uid)
+    await Users_DB.purge_user(user, delete_account)
+    for owned_class in owned_classes:
+        await Classes_DB.forget_class(owned_class.class_id)
+
+
 @app.post("/api/v1/users/reset", tags=["Users"])
 async def reset_me(current_user: User = Depends(get_current_user)):
     """
@@ -242,39 +517,7 @@ async def reset_me(current_user: User = Depends(get_current_user)):
 
     This **CANNOT** be undone!
     """
-    timetable = User_Subjects_DB.get_timetable(current_user.uid)
-    for period in range(9):
-        if timetable.monday[period] is not None:
-            User_Subjects_DB.remove_connection(current_user.uid, 0, period)
-        if timetable.tuesday[period] is not None:
-            User_Subjects_DB.remove_connection(current_user.uid, 1, period)
-        if timetable.wednesday[period] is not None:
-            User_Subjects_DB.remove_connection(current_user.uid, 2, period)
-        if timetable.thursday[period] is not None:
-            User_Subjects_DB.remove_connection(current_user.uid, 3, period)
-        if timetable.friday[period] is not None:
-            User_Subjects_DB.remove_connection(current_user.uid, 4, period)
-    events = User_Events_DB.get_events_for_user(current_user.uid)
-    for event in events:
-        User_Events_DB.delete_connection(current_user.uid, event)
-    marks = Marks_DB.get_marks_for_user(current_user.uid)
-    for mark in marks:
-        Marks_DB.delete_mark(mark.mark_id)
-    homework = Homework_DB.get_homework_for_user(current_user.uid)
-    for hw in homework:
-        Homework_DB.delete_homework(hw.homework_id)
-    created_events = Events_DB.get_events_by_user(current_user.uid)
-    for event in created_events:
-        connected = User_Events_DB.get_users_for_event(event.event_id)
-        for user in connected:
-            User_Events_DB.delete_connection(user.uid, event.event_id)
-        Events_DB.delete_event(event.event_id, current_user.uid)
-    classes_owned = Classes_DB.get_classes(current_user.uid)
-    for cl in classes_owned:
-        students = User_Class_DB.get_students_in_class(cl.class_id)
-        for student in students:
-            User_Class_DB.delete_connection(cl.class_id, student.uid)
-        Classes_DB.delete_class(cl.class_id)
+    await purge_user(current_user)
     return {"status": "success"}
 
 
@@ -285,40 +528,8 @@ async def delete_me(current_user: User = Depends(get_current_user)):
 
     This **CANNOT** be undone!
     """
-    timetable = User_Subjects_DB.get_timetable(current_user.uid)
-    for period in range(9):
-        if timetable.monday[period] is not None:
-            User_Subjects_DB.remove_connection(current_user.uid, 0, period)
-        if timetable.tuesday[period] is not None:
-            User_Subjects_DB.remove_connection(current_user.uid, 1, period)
-        if timetable.wednesday[period] is not None:
-            User_Subjects_DB.remove_connection(current_user.uid, 2, period)
-        if timetable.thursday[period] is not None:
-            User_Subjects_DB.remove_connection(current_user.uid, 3, period)
-        if timetable.friday[period] is not None:
-            User_Subjects_DB.remove_connection(current_user.uid, 4, period)
-    events = User_Events_DB.get_events_for_user(current_user.uid)
-    for event in events:
-        User_Events_DB.delete_connection(current_user.uid, event)
-    marks = Marks_DB.get_marks_for_user(current_user.uid)
-    for mark in marks:
-        Marks_DB.delete_mark(mark.mark_id)
-    homework = Homework_DB.get_homework_for_user(current_user.uid)
-    for hw in homework:
-        Homework_DB.delete_homework(hw.homework_id)
-    created_events = Events_DB.get_events_by_user(current_user.uid)
-    for event in created_events:
-        connected = User_Events_DB.get_users_for_event(event.event_id)
-        for user in connected:
-            User_Events_DB.delete_connection(user.uid, event.event_id)
-        Events_DB.delete_event(event.event_id, current_user.uid)
-    classes_owned = Classes_DB.get_classes(current_user.uid)
-    for cl in classes_owned:
-        students = User_Class_DB.get_students_in_class(cl.class_id)
-        for student in students:
-            User_Class_DB.delete_connection(cl.class_id, student)
-        Classes_DB.delete_class(cl.class_id)
-    Users_DB.delete_user(current_user)
+    await purge_user(current_user, delete_account=True)
+    await Users_DB.forget_session(current_user.session.access_token)
     return {"status": "success"}
 
 # ------------------
@@ -327,25 +538,50 @@ async def delete_me(current_user: User = Depends(get_current_user)):
 
 
 @app.get("/api/v1/subjects", tags=["Subjects"])
-async def get_subjects(user: User = Depends(get_current_user)):
+async def get_subjects(limit: int = Query(None, ge=1, le=500), cursor: str = None, if_none_match: Optional[str] = Header(None), user: User = Depends(get_current_user)):
     """
     Gets all subjects avaliable in the database.
 
+    Pass `limit` to get them a page at a time, and then `cursor` set to the `next_cursor` of the previous page.
+
     Account **must** be a teacher account.
+
+    Send the ETag of an earlier response as `If-None-Match` to get a 304 instead if nothing has changed.
     """
     if (user.permissions < Permissions.Teacher):
         return {"status": "error", "message": "Account must be a teacher account."}
-    sjs = Subjects_DB.get_subjects()
-    return {"status": "success", "data": sjs}
+    after = parse_cursor(cursor)
+    etag = await collection_etag(VersionDB.EVERYONE, "subjects", limit, after)
+    if etag_matches(etag, if_none_match):
+        return not_modified(etag)
+    sjs = await Subjects_DB.get_subjects(after[0] if after else None, limit + 1 if limit else None)
+    return RecordResponse(page_of(sjs, limit, lambda sj: (sj.subject_id, )), headers=etag_headers(etag))
+
+
+@app.get("/api/v1/subjects/export", tags=["Subjects"])
+async def export_subjects(user: User = Depends(get_current_user)):
+    """
+    Streams every subject in the database as newline-delimited JSON.
+
+    Account **must** be a teacher account.
+    """
+    if (user.permissions < Permissions.Teacher):
+        return {"status": "error", "message": "Account must be a teacher account."}
+    return stream_ndjson(await Subjects_DB.iter_subjects())
 
 
 @app.get("/api/v1/subjects/@me", tags=["Subjects"])
-async def get_user_subjects(user: User = Depends(get_current_user)):
+async def get_user_subjects(if_none_match: Optional[str] = Header(None), user: User = Depends(get_current_user)):
     """
     Gets all subjects created by the current user.
+
+    Send the ETag of an earlier response as `If-None-Match` to get a 304 instead if nothing has changed.
     """
-    sjs = Subjects_DB.get_subjects_by_user(user.uid)
-    return {"status": "success", "data": sjs}
+    etag = await collection_etag(user.uid, "subjects")
+    if etag_matches(etag, if_none_match):
+        return not_modified(etag)
+    sjs = await Subjects_DB.get_subjects_by_user(user.uid)
+    return RecordResponse({"status": "success", "data": sjs}, headers=etag_headers(etag))
 
 
 @app.post("/api/v1/subjects", tags=["Subjects"])
@@ -373,21 +609,20 @@ async def create_subject(name: str = Form(...), teacher: str = Form("None"), roo
         total_chars += colour.count(char)
     if total_chars != 6:
         return {"status": "error", "message": "Invalid colour"}
-    exists = Subjects_DB.get_subjects_by_name(name, user.uid)
-    if not exists:
-        for subject in exists:
-            if subject.teacher == teacher and subject.room == room and subject.colour == colour:
-                # If we find that this specific subject already exists,
-                # We lie and say that we created it, but return the old id instead of a new one.
-                return {"status": "success", "id": subject.id}
-    Subjects_DB.add_subject(Subject(
+    exists = await Subjects_DB.get_subjects_by_name(name, user.uid)
+    for subject in exists:
+        if subject.teacher == teacher and subject.room == room and subject.colour == colour.upper():
+            # If we find that this specific subject already exists,
+            # We lie and say that we created it, but return the old id instead of a new one.
+            return {"status": "success", "id": subject.subject_id}
+    subject_id = await Subjects_DB.add_subject(Subject(
         user_id=user.uid,
         name=name,
         teacher=teacher,
         room=room,
         colour=colour
     ))
-    return {"status": "success", "id": Subjects_DB.get_next_id() - 1}
+    return {"status": "success", "id": subject_id}
 
 
 @app.get("/api/v1/subjects/name/{subject_name}", tags=["Subjects"])
@@ -396,7 +631,7 @@ async def get_subject_by_name(subject_name: str, user: User = Depends(get_curren
     Gets all subjects which match a certain name.
     """
     subject_name = subject_name.title()
-    sjs = Subjects_DB.get_subjects_by_name(subject_name, user.uid)
+    sjs = await Subjects_DB.get_subjects_by_name(subject_name, user.uid)
     return {"status": "success", "data": sjs}
 
 
@@ -405,7 +640,7 @@ async def get_subject_by_id(subject_id: int, user: User = Depends(get_current_us
     """
     Gets the subject with a specific ID.
     """
-    sjs = Subjects_DB.get_subject_by_id(subject_id)
+    sjs = await Subjects_DB.get_subject_by_id(subject_id)
     return {"status": "success", "data": sjs}
 
 
@@ -416,7 +651,7 @@ async def update_subject(subject_id: int, colour: str = Form(...), user: User =
 
     This subject **MUST** belong to the current user.
     """
-    sj = Subjects_DB.get_subject_by_id(subject_id)
+    sj = await Subjects_DB.get_subject_by_id(subject_id)
     if sj is None:
         return {"status": "error", "message": "Subject doesn't exist."}
     if sj.user_id != user.uid:
@@ -429,29 +664,66 @@ async def update_subject(subject_id: int, colour: str = Form(...), user: User =
     if total_chars != 6:
         return {"status": "error", "message": "Invalid colour"}
     sj.colour = colour
-    Subjects_DB.update_subject(sj)
+    await Subjects_DB.update_subject(sj)
     return {"status": "success"}
 
 
+# ------------------
+# DASHBOARD ENDPOINTS
+# ------------------
+
+@app.get("/api/v1/dashboard", tags=["Dashboard"])
+async def get_dashboard(user: User = Depends(get_current_user)):
+    """
+    Gets everything on the current user's home screen: their periods today, the homework they have left to do
+    in order of when it is due, their latest marks, and upcoming events.
+
+    `day` is today's day of the week, where 0 is monday. `periods` is empty at the weekend.
+    """
+    dashboard = await Dashboard_DB.get_dashboard(user.uid, time())
+    # The snapshot is stored already encoded, so it is sent as it is.
+    return Response(b'{"status":"success","data":' + dashboard.encode("utf-8") + b"}", media_type="application/json")
+
+
+# ------------------
+# SYNC ENDPOINTS
+# ------------------
+
+@app.get("/api/v1/sync", tags=["Sync"])
+async def sync(since: str = None, limit: int = Query(500, ge=1, le=5000), user: User = Depends(get_current_user)):
+    """
+    Gets what has changed in the current user's homework, marks, timetable and events since `since`.
+
+    Leave out `since` the first time, to get everything along with a `cursor`.
+    After that, pass the `cursor` from the previous response to get only what has changed since then.
+    Each of homework, marks and events has the items which were added or changed, and the IDs of those which were deleted.
+    `timetable` is the whole timetable if it changed, otherwise null.
+
+    If `reset` is true, the client should throw away its copy and use this instead.
+    If `has_more` is true, there were more than `limit` changes, so call this again with the new cursor.
+    """
+    after = parse_cursor(since)
+    changes = await Changes_DB.get_changes(user.uid, after[0] if after else None, limit)
+    return RecordResponse({"status": "success", "data": changes})
+
+
 # ------------------
 # TIMETABLE ENDPOINTS
 # ------------------
 
 @app.get("/api/v1/timetable", tags=["Timetable"])
-async def get_timetable(user: User = Depends(get_current_user)):
+async def get_timetable(response: Response, if_none_match: Optional[str] = Header(None), user: User = Depends(get_current_user)):
     """
     Gets the current user's timetable.
-    """
-    result = User_Subjects_DB.get_timetable(user.uid)
-    timetable = result.get_client_format()
 
-    # Here, instead of directly using the variable, I am getting indexes as this will allow me to modify the
-    # Timetable in-place instead of having to create a copy and waste memory.
-    for day in range(len(timetable)):
-        for period in range(len(timetable[day])):
-            timetable[day][period] = Subjects_DB.get_subject_by_id(
-                timetable[day][period])
-    return {"status": "success", "data": timetable}
+    Send the ETag of an earlier response as `If-None-Match` to get a 304 instead if nothing has changed.
+    """
+    etag = await collection_etag(user.uid, "timetable")
+    if etag_matches(etag, if_none_match):
+        return not_modified(etag)
+    timetable = await User_Subjects_DB.get_timetable_subjects(user.uid)
+    response.headers.update(etag_headers(etag))
+    return {"status": "success", "data": timetable.get_client_format()}
 
 
 @app.post("/api/v1/timetable", tags=["Timetable"])
@@ -459,7 +731,7 @@ async def add_timetable_subject(subject_id: int = Form(...), day: int = Form(...
     """
     Adds a subject to the current user's timetable.
     """
-    subject = Subjects_DB.get_subject_by_id(subject_id)
+    subject = await Subjects_DB.get_subject_by_id(subject_id)
     if subject is None:
         return {"status": "error", "message": "Subject does not exist."}
     if subject.user_id != user.uid:
@@ -468,7 +740,7 @@ async def add_timetable_subject(subject_id: int = Form(...), day: int = Form(...
         return {"status": "error", "message": "Invalid day."}
     if period < 0:
         return {"status": "error", "message": "Invalid period."}
-    result = User_Subjects_DB.create_connection(
+    result = await User_Subjects_DB.create_connection(
         user.uid, subject_id, day, period)
     if result:
         return {"status": "success"}
@@ -480,7 +752,7 @@ async def remove_timetable_subject(day: int = Form(...), period: int = Form(...)
     """
     Removes a subject from the current user's timetable.
     """
-    result = User_Subjects_DB.remove_connection(user.uid, day, period)
+    result = await User_Subjects_DB.remove_connection(user.uid, day, period)
     if result:
         return {"status": "success"}
     return {"status": "error", "message": "No connection exists."}
@@ -491,21 +763,31 @@ async def remove_timetable_subject(day: int = Form(...), period: int = Form(...)
 
 
 @app.get("/api/v1/homework", tags=["Homework"])
-async def get_homework(user: User = Depends(get_current_user)):
+async def get_homework(limit: int = Query(None, ge=1, le=500), cursor: str = None, if_none_match: Optional[str] = Header(None), user: User = Depends(get_current_user)):
     """
-    Gets all of the current user's homework.
+    Gets all of the current user's homework, ordered by when it is due.
+
+    Pass `limit` to get it a page at a time, and then `cursor` set to the `next_cursor` of the previous page.
+
+    Send the ETag of an earlier response as `If-None-Match` to get a 304 instead if nothing has changed.
     """
-    result = Homework_DB.get_homework_for_user(user.uid)
-    return {"status": "success", "data": result}
+    after = parse_cursor(cursor, parts=2)
+    etag = await collection_etag(user.uid, "homework", limit, after)
+    if etag_matches(etag, if_none_match):
+        return not_modified(etag)
+    result = await Homework_DB.get_homework_for_user(user.uid, after, limit + 1 if limit else None)
+    return RecordResponse(page_of(result, limit, lambda hw: (hw.due_date, hw.homework_id)), headers=etag_headers(etag))
 
 
 @app.post("/api/v1/homework", tags=["Homework"])
 async def create_homework(name: str = Form(...), due_date: int = Form(...), description: str = Form(""), user: User = Depends(get_current_user)):
     """
     Creates a piece of homework for the current user.
+
+    Returns the ID of the created homework.
     """
-    Homework_DB.create_homework(user.uid, name, due_date, description)
-    return {"status": "success"}
+    homework_id = await Homework_DB.create_homework(user.uid, name, due_date, description)
+    return {"status": "success", "id": homework_id}
 
 
 @app.patch("/api/v1/homework", tags=["Homework"])
@@ -515,13 +797,20 @@ async def complete_homework(id: int = Form(...), user: User = Depends(get_curren
 
     Homework **must** belong to the current user.
     """
-    homework = Homework_DB.get_homework(id)
+    homework = await Homework_DB.get_homework(id)
     if homework is None:
         return {"status": "error", "message": "Homework doesn't exist."}
+    if homework.user_id is None and homework.class_id is not None:
+        # This was set for a class, so only this student's completion should change.
+        homework = await Homework_DB.get_class_homework_for_student(id, user.uid)
+        if homework is None:
+            return {"status": "error", "message": "Not your homework."}
+        await Homework_DB.set_class_homework_completed(id, user.uid, not homework.completed)
+        return {"status": "success"}
     if homework.user_id != user.uid:
         return {"status": "error", "message": "Not your homework."}
     homework.completed = not homework.completed
-    Homework_DB.update_homework(homework)
+    await Homework_DB.update_homework(homework)
     return {"status": "success"}
 
 
@@ -530,14 +819,18 @@ async def delete_homework(id: int = Form(...), user: User = Depends(get_current_
     """
     Deletes a piece of homework.
 
-    Homework **must** belong to the current user.
+    Homework **must** belong to the current user, or have been set for a class they own.
     """
-    homework = Homework_DB.get_homework(id)
+    homework = await Homework_DB.get_homework(id)
     if homework is None:
         return {"status": "error", "message": "Homework doesn't exist."}
-    if homework.user_id != user.uid:
+    if homework.user_id is None and homework.class_id is not None:
+        thisClass = await Classes_DB.get_class(homework.class_id)
+        if thisClass is None or thisClass.teacher_id != user.uid:
+            return {"status": "error", "message": "Not your homework."}
+    elif homework.user_id != user.uid:
         return {"status": "error", "message": "Not your homework."}
-    Homework_DB.delete_homework(id)
+    await Homework_DB.delete_homework(id)
     return {"status": "success"}
 
 # ------------------
@@ -546,21 +839,31 @@ async def delete_homework(id: int = Form(...), user: User = Depends(get_current_
 
 
 @app.get("/api/v1/marks", tags=["Marks"])
-async def get_marks(user: User = Depends(get_current_user)):
+async def get_marks(limit: int = Query(None, ge=1, le=500), cursor: str = None, if_none_match: Optional[str] = Header(None), user: User = Depends(get_current_user)):
     """
     Gets all marks for the current user.
+
+    Pass `limit` to get them a page at a time, and then `cursor` set to the `next_cursor` of the previous page.
+
+    Send the ETag of an earlier response as `If-None-Match` to get a 304 instead if nothing has changed.
     """
-    result = Marks_DB.get_marks_for_user(user.uid)
-    return {"status": "success", "data": result}
+    after = parse_cursor(cursor)
+    etag = await collection_etag(user.uid, "marks", limit, after)
+    if etag_matches(etag, if_none_match):
+        return not_modified(etag)
+    result = await Marks_DB.get_marks_for_user(user.uid, after[0] if after else None, limit + 1 if limit else None)
+    return RecordResponse(page_of(result, limit, lambda mark: (mark.mark_id, )), headers=etag_headers(etag))
 
 
 @app.post("/api/v1/marks", tags=["Marks"])
 async def add_mark(name: str = Form(...), mark: int = Form(...), grade: str = Form(...), user: User = Depends(get_current_user)):
     """
     Adds a mark to the database for the current user.
+
+    Returns the ID of the created mark.
     """
-    Marks_DB.add_mark(user.uid, name, mark, grade)
-    return {"status": "success"}
+    mark_id = await Marks_DB.add_mark(user.uid, name, mark, grade)
+    return {"status": "success", "id": mark_id}
 
 
 @app.put("/api/v1/marks", tags=["Marks"])
@@ -570,7 +873,7 @@ async def update_mark(mark_id: int = Form(...), name: str = Form(...), mark: int
 
     Mark **must** belong to the current user.
     """
-    realMark = Marks_DB.get_mark(mark_id)
+    realMark = await Marks_DB.get_mark(mark_id)
     if realMark is None:
         return {"status": "error", "message": "Mark doesn't exist."}
     if realMark.user_id != user.uid:
@@ -578,7 +881,7 @@ async def update_mark(mark_id: int = Form(...), name: str = Form(...), mark: int
     realMark.test_name = name
     realMark.mark = mark
     realMark.grade = grade
-    Marks_DB.update_mark(realMark)
+    await Marks_DB.update_mark(realMark)
     return {"status": "success"}
 
 
@@ -589,12 +892,12 @@ async def delete_mark(mark_id: int = Form(...), user: User = Depends(get_current
 
     Mark **must** belong to the current user.
     """
-    mark = Marks_DB.get_mark(mark_id)
+    mark = await Marks_DB.get_mark(mark_id)
     if mark is None:
         return {"status": "error", "message": "Mark doesn't exist."}
     if mark.user_id != user.uid:
         return {"status": "error", "message": "Not your mark."}
-    Marks_DB.delete_mark(mark_id)
+    await Marks_DB.delete_mark(mark_id)
     return {"status": "success"}
 
 # ------------------
@@ -603,27 +906,62 @@ async def delete_mark(mark_id: int = Form(...), user: User = Depends(get_current
 
 
 @app.get("/api/v1/events", tags=["Events"])
-async def get_events(user: User = Depends(get_current_user)):
+async def get_events(limit: int = Query(None, ge=1, le=500), cursor: str = None, if_none_match: Optional[str] = Header(None), user: User = Depends(get_current_user)):
     """
     Gets all events.
+
+    Pass `limit` to get them a page at a time, and then `cursor` set to the `next_cursor` of the previous page.
+
+    Send the ETag of an earlier response as `If-None-Match` to get a 304 instead if nothing has changed.
+    """
+    after = parse_cursor(cursor)
+    etag = await collection_etag(VersionDB.EVERYONE, "events", limit, after)
+    if etag_matches(etag, if_none_match):
+        return not_modified(etag)
+    events = await Events_DB.get_events(after[0] if after else None, limit + 1 if limit else None)
+    return RecordResponse(page_of(events, limit, lambda event: (event.event_id, )), headers=etag_headers(etag))
+
+
+@app.get("/api/v1/events/export", tags=["Events"])
+async def export_events(user: User = Depends(get_current_user)):
+    """
+    Streams every public event as newline-delimited JSON.
     """
-    return {"status": "success", "data": Events_DB.get_events()}
+    return stream_ndjson(await Events_DB.iter_events())
 
 
 @app.get("/api/v1/events/user/@me", tags=["Events"])
-async def get_events_by_user(user: User = Depends(get_current_user)):
+async def get_events_by_user(limit: int = Query(None, ge=1, le=500), cursor: str = None, if_none_match: Optional[str] = Header(None), user: User = Depends(get_current_user)):
     """
     Gets all events created by the current user..
+
+    Pass `limit` to get them a page at a time, and then `cursor` set to the `next_cursor` of the previous page.
+
+    Send the ETag of an earlier response as `If-None-Match` to get a 304 instead if nothing has changed.
     """
-    return {"status": "success", "data": Events_DB.get_events_by_user(user.uid)}
+    after = parse_cursor(cursor)
+    etag = await collection_etag(user.uid, "events", limit, after)
+    if etag_matches(etag, if_none_match):
+        return not_modified(etag)
+    events = await Events_DB.get_events_by_user(user.uid, after[0] if after else None, limit + 1 if limit else None)
+    return RecordResponse(page_of(events, limit, lambda event: (event.event_id, )), headers=etag_headers(etag))
 
 
 @app.get("/api/v1/events/user/{user_id}", tags=["Events"])
-async def get_events_by_user(user_id: int, user: User = Depends(get_current_user)):
+async def get_events_by_user(user_id: int, limit: int = Query(None, ge=1, le=500), cursor: str = None, if_none_match: Optional[str] = Header(None), user: User = Depends(get_current_user)):
     """
     Gets all events created by a user.
+
+    Pass `limit` to get them a page at a time, and then `cursor` set to the `next_cursor` of the previous page.
+
+    Send the ETag of an earlier response as `If-None-Match` to get a 304 instead if nothing has changed.
     """
-    return {"status": "success", "data": Events_DB.get_events_by_user(user_id)}
+    after = parse_cursor(cursor)
+    etag = await collection_etag(user_id, "events", limit, after)
+    if etag_matches(etag, if_none_match):
+        return not_modified(etag)
+    events = await Events_DB.get_events_by_user(user_id, after[0] if after else None, limit + 1 if limit else None)
+    return RecordResponse(page_of(events, limit, lambda event: (event.event_id, )), headers=etag_headers(etag))
 
 
 @app.post("/api/v1/events", tags=["Events"])
@@ -632,12 +970,14 @@ async def create_event(name: str = Form(...), time: int = Form(...), description
     Creates an event.
 
     This event can be marked as private or public. Public events require a teacher account.
+
+    Returns the ID of the created event.
     """
     if user.permissions < Permissions.Teacher and not private:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                             detail="Not authorized to create public events.")
-    Events_DB.create_event(user.uid, name, time, description, private)
-    return {"status": "success"}
+    event_id = await Events_DB.create_event(user.uid, name, time, description, private)
+    return {"status": "success", "id": event_id}
 
 
 @app.get("/api/v1/events/{event_id}", tags=["Events"])
@@ -645,7 +985,7 @@ async def get_event(event_id: int, user: User = Depends(get_current_user)):
     """
     Fetches the event with the specified ID.
     """
-    event = Events_DB.get_event(event_id, user.uid)
+    event = await Events_DB.get_event(event_id, user.uid)
     if not event:
         return {"status": "error", "message": "Event doesn't exist."}
     return {"status": "success", "data": event}
@@ -658,12 +998,12 @@ async def delete_event(event_id: int, user: User = Depends(get_current_user)):
 
     This event must be owned by the current user.
     """
-    event = Events_DB.get_event(event_id, user.uid)
+    event = await Events_DB.get_event(event_id, user.uid)
     if not event:
         return {"status": "error", "message": "Event doesn't exist."}
     if event.user_id != user.uid:
         return {"status": "error", "message": "Not your event."}
-    if Events_DB.delete_event(event_id, user.uid):
+    if await Events_DB.delete_event(event_id, user.uid):
         return {"status": "success"}
     return {"status": "error", "message": "Event doesn't exist or it's not your event."}
 
@@ -677,26 +1017,8 @@ async def get_classes(user: User = Depends(get_current_user)):
     """
     Gets all classes owned by the current user.
     """
-    classes = Classes_DB.get_classes(user.uid)
-    for idx, thisClass in enumerate(classes):
-        students = User_Class_DB.get_students_in_class(thisClass.class_id)
-        classes[idx].students = []
-        for student in students:
-            classes[idx].students.append(Users_DB.get_user_from_uid(
-                student).remove("password", "salt", "session"))
-        classes[idx].homework = Homework_DB.get_homework_for_class(
-            thisClass.class_id)
-        for homework in classes[idx].homework:
-            homework.completed_by = 0
-            for student in classes[idx].students:
-                student = student.uid
-                allHomework = Homework_DB.get_homework_for_user(student)
-                selected = [hw for hw in allHomework if hw.description ==
-                            homework.description and hw.name == homework.name and hw.due_date == homework.due_date]
-                if len(selected) < 1 or not selected[0].completed:
-                    homework.completed_by += 0
-                else:
-                    homework.completed_by += 1
+    classes = await Classes_DB.get_classes(user.uid)
+    classes = await Classes_DB.get_class_overviews(classes)
     return {"status": "success", "data": classes}
 
 
@@ -707,25 +1029,10 @@ async def get_class(class_id: int, user: User = Depends(get_current_user)):
 
     Returns an error if it doesn't exist.
     """
-    thisClass = Classes_DB.get_class(class_id)
+    thisClass = await Classes_DB.get_class(class_id)
     if thisClass is None:
         return {"status": "error", "message": "Class doesn't exist."}
-    students = User_Class_DB.get_students_in_class(thisClass.class_id)
-    thisClass.students = [Users_DB.get_user_from_uid(student).remove(
-        "password", "salt", "session") for student in students]
-    homeworkSet = Homework_DB.get_homework_for_class(thisClass.class_id)
-    for homework in homeworkSet:
-        homework.completed_by = 0
-        for student in thisClass.students:
-            student = student.uid
-            allHomework = Homework_DB.get_homework_for_user(student)
-            selected = [hw for hw in allHomework if hw.description ==
-                        homework.description and hw.name == homework.name and hw.due_date == homework.due_date]
-            if len(selected) < 1 or not selected[0].completed:
-                homework.completed_by += 0
-            else:
-                homework.completed_by += 1
-    thisClass.homework = homeworkSet
+    thisClass = (await Classes_DB.get_class_overviews([thisClass]))[0]
     return {"status": "success", "data": thisClass}
 
 
@@ -735,11 +1042,13 @@ async def create_class(name: str = Form(...), user: User = Depends(get_current_u
     Creates a class with the parameters defined in the POST Form.
 
     **MUST** be a teacher account to create the class.
+
+    Returns the ID of the created class.
     """
     if user.permissions < Permissions.Teacher:
         return {"status": "error", "message": "Only teachers can create classes."}
-    Classes_DB.create_class(user.uid, name)
-    return {"status": "success"}
+    class_id = await Classes_DB.create_class(user.uid, name)
+    return {"status": "success", "id": class_id}
 
 
 @app.patch("/api/v1/classes/{class_id}", tags=["Classes"])
@@ -749,15 +1058,15 @@ async def add_student_to_class(class_id: int, student_id: int = Form(...), user:
 
     Class **MUST** be owned by current user.
     """
-    thisClass = Classes_DB.get_class(class_id)
+    thisClass = await Classes_DB.get_class(class_id)
     if thisClass is None:
         return {"status": "error", "message": "Class doesn't exist."}
     if thisClass.teacher_id != user.uid:
         return {"status": "error", "message": "You can only add to your own class."}
-    student = Users_DB.get_user_from_uid(student_id)
+    student = await Users_DB.get_user_from_uid(student_id)
     if student is None:
         return {"status": "error", "message": "Student doesn't exist."}
-    User_Class_DB.create_connection(thisClass.class_id, student_id)
+    await User_Class_DB.create_connection(thisClass.class_id, student_id)
     return {"status": "success"}
 
 
@@ -768,12 +1077,12 @@ async def get_class_homework(class_id: int, user: User = Depends(get_current_use
 
     Class **MUST** belong to the current user.
     """
-    thisClass = Classes_DB.get_class(class_id)
+    thisClass = await Classes_DB.get_class(class_id)
     if thisClass is None:
         return {"status": "error", "message": "Class doesn't exist."}
     if thisClass.teacher_id != user.uid:
         return {"status": "error", "message": "You may only get homework for your own class."}
-    homeworkSet = Homework_DB.get_homework_for_class(class_id)
+    homeworkSet = await Homework_DB.get_homework_for_class(class_id)
     return {"status": "success", "data": homeworkSet}
 
 
@@ -783,17 +1092,17 @@ async def set_class_homework(class_id: int, homework_name: str = Form(...), due_
     Creates a piece of homework for an entire class.
 
     Class **MUST** belong to the current user.
+
+    Returns the ID of the created homework.
     """
-    thisClass = Classes_DB.get_class(class_id)
+    thisClass = await Classes_DB.get_class(class_id)
     if thisClass is None:
         return {"status": "error", "message": "Class doesn't exist."}
     if thisClass.teacher_id != user.uid:
         return {"status": "error", "message": "You may only set homework for your own class."}
-    studentsInClass = User_Class_DB.get_students_in_class(class_id)
-    for student in studentsInClass:
-        Homework_DB.create_homework_for_class(
-            student, class_id, homework_name, due_date, description)
-    return {"status": "success"}
+    homework_id = await Homework_DB.create_homework_for_class(
+        class_id, homework_name, due_date, description)
+    return {"status": "success", "id": homework_id}
 
 
 @app.get("/api/v1/classes/{class_id}/homework/{homework_id}", tags=["Classes"])
@@ -803,25 +1112,15 @@ async def get_completed_homework(class_id: int, homework_id: int, user: User = D
 
     Class **MUST** belong to the current user.
     """
-    thisClass = Classes_DB.get_class(class_id)
+    thisClass = await Classes_DB.get_class(class_id)
     if thisClass is None:
         return {"status": "error", "message": "Class doesn't exist."}
     if thisClass.teacher_id != user.uid:
         return {"status": "error", "message": "You may only get stats for homework for your own class."}
-    studentsInClass = User_Class_DB.get_students_in_class(class_id)
-    homework = Homework_DB.get_homework(homework_id)
-    if homework is None:
+    homework = await Homework_DB.get_homework(homework_id)
+    if homework is None or homework.class_id != class_id:
         return {"status": "error", "message": "Homework doesn't exist."}
-    students = {"completed": [], "incomplete": []}
-    for student in studentsInClass:
-        user = Users_DB.get_user_from_uid(student)
-        allHomework = Homework_DB.get_homework_for_user(student)
-        selected = [hw for hw in allHomework if hw.description ==
-                    homework.description and hw.name == homework.name and hw.due_date == homework.due_date]
-        if len(selected) < 1 or not selected[0].completed:
-            students["incomplete"].append(user.username)
-        else:
-            students["completed"].append(user.username)
+    students = await Classes_DB.get_homework_completion(class_id, homework)
     return {"status": "success", "data": students}
 
 if __name__ == "__main__":
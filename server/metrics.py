@@ -0,0 +1,192 @@
+import contextvars
+import threading
+from time import perf_counter
+from typing import Optional
+
+
+class RequestStats:
+    """
+    What the database did while handling a single request.
+    """
+
+    __slots__ = ("queries", "db_time", "connections_opened",
+                 "slowest_time", "slowest_statement")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.connections_opened = 0
+        self.slowest_time = 0.0
+        self.slowest_statement = None
+
+
+# The stats for the request currently being handled, if there is one.
+# AsyncDB copies the context into its threads, so queries run there are counted against the right request.
+current_request: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar(
+    "current_request", default=None)
+
+
+def record_query(statement: str, seconds: float) -> None:
+    stats = current_request.get()
+    if stats is None:
+        return
+    stats.queries += 1
+    stats.db_time += seconds
+    if seconds > stats.slowest_time:
+        stats.slowest_time = seconds
+        stats.slowest_statement = statement
+
+
+def record_connection() -> None:
+    stats = current_request.get()
+    if stats is not None:
+        stats.connections_opened += 1
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", " ").replace('"', '\\"')
+
+
+class Metrics:
+    """
+    Totals for every route, which are served in the Prometheus text format.
+
+    Routes are labelled by their path template (such as `/api/v1/classes/{class_id}`),
+    so the number of series stays fixed however many different IDs are requested.
+    """
+
+    # The buckets for the number of queries a request made. A route whose requests
+    # move into the higher buckets as the data grows is probably making a query per row.
+    QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+
+    def __init__(self, prefix: str = "planaway"):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._requests = {}
+        self._routes = {}
+        self._connections_opened = 0
+
+    def observe(self, method: str, route: str, status: int, seconds: float, stats: RequestStats) -> None:
+        with self._lock:
+            key = (method, route, status)
+            self._requests[key] = self._requests.get(key, 0) + 1
+            totals = self._routes.get((method, route))
+            if totals is None:
+                totals = self._routes[(method, route)] = {
+                    "count": 0, "seconds": 0.0, "queries": 0, "db_seconds": 0.0,
+                    "buckets": [0] * len(self.QUERY_BUCKETS),
+                    "slowest_time": 0.0, "slowest_statement": None,
+                }
+            totals["count"] += 1
+            totals["seconds"] += seconds
+            totals["queries"] += stats.queries
+            totals["db_seconds"] += stats.db_time
+            for i, bucket in enumerate(self.QUERY_BUCKETS):
+                if stats.queries <= bucket:
+                    totals["buckets"][i] += 1
+            if stats.slowest_time > totals["slowest_time"]:
+                totals["slowest_time"] = stats.slowest_time
+                totals["slowest_statement"] = stats.slowest_statement
+            self._connections_opened += stats.connections_opened
+
+    def render(self) -> str:
+        p = self.prefix
+        lines = [
+            f"# HELP {p}_requests_total Requests handled, by route and status.",
+            f"# TYPE {p}_requests_total counter",
+        ]
+        with self._lock:
+            for (method, route, status), count in sorted(self._requests.items()):
+                lines.append(
+                    f'{p}_requests_total{{method="{method}",route="{_escape(route)}",status="{status}"}} {count}')
+            routes = sorted(self._routes.items())
+            lines += [
+                f"# HELP {p}_request_seconds Time taken to handle requests.",
+                f"# TYPE {p}_request_seconds summary",
+            ]
+            for (method, route), totals in routes:
+                labels = f'method="{method}",route="{_escape(route)}"'
+                lines.append(
+                    f"{p}_request_seconds_sum{{{labels}}} {totals['seconds']:.6f}")
+                lines.append(
+                    f"{p}_request_seconds_count{{{labels}}} {totals['count']}")
+            lines += [
+                f"# HELP {p}_db_queries_per_request SQL statements run to handle each request.",
+                f"# TYPE {p}_db_queries_per_request histogram",
+            ]
+            for (method, route), totals in routes:
+                labels = f'method="{method}",route="{_escape(route)}"'
+                for bucket, count in zip(self.QUERY_BUCKETS, totals["buckets"]):
+                    lines.append(
+                        f'{p}_db_queries_per_request_bucket{{{labels},le="{bucket}"}} {count}')
+                lines.append(
+                    f'{p}_db_queries_per_request_bucket{{{labels},le="+Inf"}} {totals["count"]}')
+                lines.append(
+                    f"{p}_db_queries_per_request_sum{{{labels}}} {totals['queries']}")
+                lines.append(
+                    f"{p}_db_queries_per_request_count{{{labels}}} {totals['count']}")
+            lines += [
+                f"# HELP {p}_db_seconds_total Time spent running SQL statements.",
+                f"# TYPE {p}_db_seconds_total counter",
+            ]
+            for (method, route), totals in routes:
+                lines.append(
+                    f'{p}_db_seconds_total{{method="{method}",route="{_escape(route)}"}} {totals["db_seconds"]:.6f}')
+            lines += [
+                f"# HELP {p}_db_slowest_statement_seconds The slowest SQL statement each route has run.",
+                f"# TYPE {p}_db_slowest_statement_seconds gauge",
+            ]
+            for (method, route), totals in routes:
+                if totals["slowest_statement"] is None:
+                    continue
+                lines.append(
+                    f'{p}_db_slowest_statement_seconds{{method="{method}",route="{_escape(route)}",'
+                    f'statement="{_escape(totals["slowest_statement"])}"}} {totals["slowest_time"]:.6f}')
+            lines += [
+                f"# HELP {p}_db_connections_opened_total Database connections opened while handling requests.",
+                f"# TYPE {p}_db_connections_opened_total counter",
+                f"{p}_db_connections_opened_total {self._connections_opened}",
+            ]
+        return "\n".join(lines) + "\n"
+
+
+class InstrumentMiddleware:
+    """
+    Records how much database work each request does.
+
+    The totals are sent back in the Server-Timing header, so they show up in the browser's developer tools,
+    and are added to `metrics`.
+
+    This is plain ASGI middleware rather than an `@app.middleware` function, as those add a noticeable
+    amount of overhead to every request.
+    """
+
+    def __init__(self, app, metrics: Metrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        stats = RequestStats()
+        token = current_request.set(stats)
+        start = perf_counter()
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                elapsed = perf_counter() - start
+                # Requests which didn't match a route are grouped together, so random URLs can't create new series.
+                route = scope.get("route")
+                self.metrics.observe(scope["method"], getattr(route, "path", "unmatched"),
+                                     message["status"], elapsed, stats)
+                timing = (f'db;dur={stats.db_time * 1000:.2f};desc="{stats.queries} queries", '
+                          f'db-slowest;dur={stats.slowest_time * 1000:.2f}, '
+                          f'total;dur={elapsed * 1000:.2f}')
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"server-timing", timing.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            current_request.reset(token)
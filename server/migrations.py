@@ -0,0 +1,297 @@
+import sqlite3
+from time import time
+from typing import Callable, List, Optional, Tuple, Union
+
+from database import ConnectionPool
+
+# Each DB class creates its own tables if they don't exist yet.
+# Any change to a table which already exists has to be made here instead,
+# so that databases created by older versions of the server are brought up to date.
+#
+# Migrations are run in order, and each one is only ever run once per database.
+# A migration is either a list of SQL statements, or a function which is given the connection.
+# Never edit a migration once it has been released; add a new one instead.
+
+
+def _columns(db: sqlite3.Connection, table: str) -> List[str]:
+    return [row[1] for row in db.execute(f'PRAGMA table_info("{table}")')]
+
+
+def fix_legacy_columns(db: sqlite3.Connection) -> None:
+    # Older versions of the table definitions had a typo in the homework table,
+    # and were missing columns from the subjects table.
+    if "decription" in _columns(db, "homework"):
+        db.execute(
+            'ALTER TABLE "homework" RENAME COLUMN "decription" TO "description"')
+    subject_columns = _columns(db, "subjects")
+    if "user_id" not in subject_columns:
+        db.execute(
+            'ALTER TABLE "subjects" ADD COLUMN "user_id" INTEGER NOT NULL DEFAULT 0')
+    if "colour" not in subject_columns:
+        db.execute(
+            'ALTER TABLE "subjects" ADD COLUMN "colour" TEXT NOT NULL DEFAULT \'#000000\'')
+
+
+def split_class_homework(db: sqlite3.Connection) -> None:
+    # Homework set for a class used to be copied once for every student in it.
+    # Keep the first copy of each as the class's homework, and move whether each student completed it
+    # into the homework-completions table.
+    db.execute("""CREATE TABLE IF NOT EXISTS "homework-completions" (
+	"homework_id"	INTEGER NOT NULL,
+	"student_id"	INTEGER NOT NULL,
+	PRIMARY KEY("homework_id","student_id"),
+	FOREIGN KEY("homework_id") REFERENCES "homework"("homework_id"),
+	FOREIGN KEY("student_id") REFERENCES "users"("uid")
+)""")
+    db.execute("""CREATE TEMP TABLE "class_homework_copies" AS
+SELECT h.homework_id, h.user_id, h.completed, first.homework_id AS kept_id
+FROM homework AS h JOIN (
+    SELECT MIN(homework_id) AS homework_id, class_id, name, due_date, description
+    FROM homework WHERE class_id IS NOT NULL AND user_id IS NOT NULL
+    GROUP BY class_id, name, due_date, description
+) AS first ON first.class_id = h.class_id AND first.name = h.name
+    AND first.due_date = h.due_date AND first.description IS h.description
+WHERE h.user_id IS NOT NULL""")
+    db.execute("""INSERT OR IGNORE INTO "homework-completions"("homework_id", "student_id")
+SELECT kept_id, user_id FROM "class_homework_copies" WHERE completed IS NOT NULL""")
+    db.execute("""DELETE FROM homework WHERE homework_id IN (
+    SELECT homework_id FROM "class_homework_copies" WHERE homework_id != kept_id)""")
+    db.execute("""UPDATE homework SET user_id = NULL, completed = NULL WHERE homework_id IN (
+    SELECT kept_id FROM "class_homework_copies")""")
+    db.execute('DROP TABLE "class_homework_copies"')
+    db.execute(
+        'CREATE INDEX IF NOT EXISTS "homework_completions_student" ON "homework-completions"("student_id")')
+
+
+def add_user_search(db: sqlite3.Connection) -> None:
+    # A trigram index lets usernames be searched for any part of the name without reading every user.
+    # It is kept up to date by triggers, so nothing which changes the users table can forget to update it.
+    try:
+        db.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS "users_search"
+USING fts5("username", content="users", content_rowid="uid", tokenize="trigram")""")
+    except sqlite3.OperationalError:
+        # This version of SQLite wasn't built with FTS5, so searches will have to read the whole table.
+        return
+    db.execute("""CREATE TRIGGER IF NOT EXISTS "users_search_insert" AFTER INSERT ON "users" BEGIN
+    INSERT INTO "users_search"("rowid", "username") VALUES (new."uid", new."username");
+END""")
+    db.execute("""CREATE TRIGGER IF NOT EXISTS "users_search_delete" AFTER DELETE ON "users" BEGIN
+    INSERT INTO "users_search"("users_search", "rowid", "username") VALUES ('delete', old."uid", old."username");
+END""")
+    db.execute("""CREATE TRIGGER IF NOT EXISTS "users_search_update" AFTER UPDATE OF "uid", "username" ON "users" BEGIN
+    INSERT INTO "users_search"("users_search", "rowid", "username") VALUES ('delete', old."uid", old."username");
+    INSERT INTO "users_search"("rowid", "username") VALUES (new."uid", new."username");
+END""")
+    db.execute("""INSERT INTO "users_search"("users_search") VALUES ('rebuild')""")
+
+
+# For each table shown on the home screen, which users' dashboards a changed row belongs on.
+# `{row}` is replaced by "new" or "old", depending on which version of the row the trigger is looking at.
+DASHBOARD_SOURCES = [
+    ("users-subjects", ("INSERT", "UPDATE", "DELETE"), 'SELECT {row}."user_id"'),
+    # Changing a subject's name or colour changes it on the timetable of everyone who has it.
+    ("subjects", ("UPDATE", "DELETE"), 'SELECT "user_id" FROM "users-subjects" WHERE "subject_id" = {row}."subject_id"'),
+    ("homework", ("INSERT", "UPDATE", "DELETE"),
+     'SELECT {row}."user_id" UNION ALL SELECT "student_id" FROM "class-student" WHERE "class_id" = {row}."class_id"'),
+    ("homework-completions", ("INSERT", "DELETE"), 'SELECT {row}."student_id"'),
+    ("class-student", ("INSERT", "DELETE"), 'SELECT {row}."student_id"'),
+    ("marks", ("INSERT", "UPDATE", "DELETE"), 'SELECT {row}."user_id"'),
+    ("events", ("INSERT", "UPDATE", "DELETE"), 'SELECT {row}."user_id"'),
+    ("users", ("DELETE", ), 'SELECT {row}."uid"'),
+]
+
+
+def add_dashboards(db: sqlite3.Connection) -> None:
+    # Each user's home screen is kept ready made in the dashboards table (see DashboardDB).
+    # The triggers delete a user's snapshot whenever something on it changes, in the same transaction as the change,
+    # so an out of date one can never be read. It is built again the next time it is asked for.
+    db.execute("""CREATE TABLE IF NOT EXISTS "dashboards" (
+	"user_id"	INTEGER NOT NULL,
+	"day"	INTEGER NOT NULL,
+	"data"	TEXT NOT NULL,
+	PRIMARY KEY("user_id")
+)""")
+    # Finding who has a subject on their timetable would otherwise read every timetable.
+    db.execute(
+        'CREATE INDEX IF NOT EXISTS "users_subjects_subject" ON "users-subjects"("subject_id")')
+    rows = {"INSERT": ("new", ), "UPDATE": ("old", "new"), "DELETE": ("old", )}
+    for table, events, users in DASHBOARD_SOURCES:
+        for event in events:
+            stale = " UNION ALL ".join(users.format(row=row) for row in rows[event])
+            db.execute(f"""CREATE TRIGGER IF NOT EXISTS "dashboards_{table.replace('-', '_')}_{event.lower()}" AFTER {event} ON "{table}" BEGIN
+    DELETE FROM "dashboards" WHERE "user_id" IN ({stale});
+END""")
+    # Public events are on everyone's home screen, but are rarely added.
+    for event, condition in (("INSERT", 'new."private" = 0'), ("UPDATE", 'old."private" = 0 OR new."private" = 0'),
+                             ("DELETE", 'old."private" = 0')):
+        db.execute(f"""CREATE TRIGGER IF NOT EXISTS "dashboards_public_events_{event.lower()}" AFTER {event} ON "events"
+WHEN {condition} BEGIN
+    DELETE FROM "dashboards";
+END""")
+
+
+# For each collection which clients can ask whether they have the latest version of,
+# the writes which change it, and which users' copies of it they change.
+# User 0 is used for collections everyone shares, such as the list of every subject.
+VERSION_SOURCES = [
+    ("timetable", "users-subjects", ("INSERT", "UPDATE", "DELETE"), 'SELECT {row}."user_id" AS "user_id"'),
+    ("timetable", "subjects", ("UPDATE", "DELETE"),
+     'SELECT "user_id" FROM "users-subjects" WHERE "subject_id" = {row}."subject_id"'),
+    ("homework", "homework", ("INSERT", "UPDATE", "DELETE"),
+     'SELECT {row}."user_id" AS "user_id" UNION SELECT "student_id" FROM "class-student" WHERE "class_id" = {row}."class_id"'),
+    ("homework", "homework-completions", ("INSERT", "DELETE"), 'SELECT {row}."student_id" AS "user_id"'),
+    ("homework", "class-student", ("INSERT", "DELETE"), 'SELECT {row}."student_id" AS "user_id"'),
+    ("marks", "marks", ("INSERT", "UPDATE", "DELETE"), 'SELECT {row}."user_id" AS "user_id"'),
+    ("subjects", "subjects", ("INSERT", "UPDATE", "DELETE"), 'SELECT {row}."user_id" AS "user_id" UNION SELECT 0'),
+    ("events", "events", ("INSERT", "UPDATE", "DELETE"),
+     'SELECT {row}."user_id" AS "user_id" UNION SELECT 0 WHERE {row}."private" = 0'),
+]
+
+
+def add_versions(db: sqlite3.Connection) -> None:
+    # Every user has a counter for each collection, which goes up whenever it changes (see VersionDB).
+    # Like the dashboards, they are kept up to date by triggers, in the same transaction as the change.
+    db.execute("""CREATE TABLE IF NOT EXISTS "versions" (
+	"user_id"	INTEGER NOT NULL,
+	"collection"	TEXT NOT NULL,
+	"version"	INTEGER NOT NULL,
+	PRIMARY KEY("user_id","collection")
+) WITHOUT ROWID""")
+    rows = {"INSERT": ("new", ), "UPDATE": ("old", "new"), "DELETE": ("old", )}
+    for collection, table, events, users in VERSION_SOURCES:
+        for event in events:
+            changed = " UNION ".join(users.format(row=row) for row in rows[event])
+            db.execute(f"""CREATE TRIGGER IF NOT EXISTS "versions_{collection}_{table.replace('-', '_')}_{event.lower()}" AFTER {event} ON "{table}" BEGIN
+    INSERT INTO "versions"("user_id", "collection", "version")
+    SELECT "user_id", '{collection}', 1 FROM ({changed}) WHERE "user_id" IS NOT NULL
+    ON CONFLICT("user_id", "collection") DO UPDATE SET "version" = "version" + 1;
+END""")
+
+
+# For each collection which clients can sync, the writes which change it,
+# and which users it changes which item for (see ChangeDB). The whole timetable is sent at once, so its item is always 0.
+CHANGE_SOURCES = [
+    ("homework", "homework", ("INSERT", "UPDATE", "DELETE"),
+     'SELECT {row}."user_id" AS "user_id", {row}."homework_id" AS "item_id" '
+     'UNION SELECT "student_id", {row}."homework_id" FROM "class-student" WHERE "class_id" = {row}."class_id"'),
+    ("homework", "homework-completions", ("INSERT", "DELETE"),
+     'SELECT {row}."student_id" AS "user_id", {row}."homework_id" AS "item_id"'),
+    # Joining or leaving a class changes whether its homework is theirs.
+    ("homework", "class-student", ("INSERT", "DELETE"),
+     'SELECT {row}."student_id" AS "user_id", "homework_id" AS "item_id" FROM "homework" '
+     'WHERE "class_id" = {row}."class_id" AND "user_id" IS NULL'),
+    ("marks", "marks", ("INSERT", "UPDATE", "DELETE"), 'SELECT {row}."user_id" AS "user_id", {row}."mark_id" AS "item_id"'),
+    ("timetable", "users-subjects", ("INSERT", "UPDATE", "DELETE"), 'SELECT {row}."user_id" AS "user_id", 0 AS "item_id"'),
+    ("timetable", "subjects", ("UPDATE", "DELETE"),
+     'SELECT DISTINCT "user_id" AS "user_id", 0 AS "item_id" FROM "users-subjects" WHERE "subject_id" = {row}."subject_id"'),
+    ("events", "events", ("INSERT", "UPDATE", "DELETE"),
+     'SELECT {row}."user_id" AS "user_id", {row}."event_id" AS "item_id" '
+     'UNION SELECT 0, {row}."event_id" WHERE {row}."private" = 0'),
+]
+
+
+def add_changes(db: sqlite3.Connection) -> None:
+    # A log of what changed for each user, so clients which keep their own copy can ask for only what is new.
+    # Like the dashboards and versions, it is written by triggers in the same transaction as the change.
+    # Changes to public events are logged once, under user 0, instead of once for every user.
+    db.execute("""CREATE TABLE IF NOT EXISTS "changes" (
+	"change_id"	INTEGER NOT NULL,
+	"user_id"	INTEGER NOT NULL,
+	"collection"	TEXT NOT NULL,
+	"item_id"	INTEGER NOT NULL,
+	"changed_at"	INTEGER NOT NULL,
+	PRIMARY KEY("change_id" AUTOINCREMENT)
+)""")
+    db.execute(
+        'CREATE INDEX IF NOT EXISTS "changes_user" ON "changes"("user_id", "change_id")')
+    rows = {"INSERT": ("new", ), "UPDATE": ("old", "new"), "DELETE": ("old", )}
+    for collection, table, events, items in CHANGE_SOURCES:
+        for event in events:
+            changed = " UNION ".join(items.format(row=row) for row in rows[event])
+            db.execute(f"""CREATE TRIGGER IF NOT EXISTS "changes_{collection}_{table.replace('-', '_')}_{event.lower()}" AFTER {event} ON "{table}" BEGIN
+    INSERT INTO "changes"("user_id", "collection", "item_id", "changed_at")
+    SELECT "user_id", '{collection}', "item_id", CAST(strftime('%s', 'now') AS INTEGER) FROM ({changed}) WHERE "user_id" IS NOT NULL;
+END""")
+
+
+MIGRATIONS: List[Tuple[int, str, Union[List[str], Callable[[sqlite3.Connection], None]]]] = [
+    (1, "Fix columns from old table definitions", fix_legacy_columns),
+    (2, "Add indexes for foreign keys and lookups", [
+        'CREATE INDEX IF NOT EXISTS "users_session" ON "users"("session")',
+        'CREATE INDEX IF NOT EXISTS "subjects_user" ON "subjects"("user_id", "name")',
+        'CREATE INDEX IF NOT EXISTS "classes_teacher" ON "classes"("teacher_id")',
+        'CREATE INDEX IF NOT EXISTS "class_student_class" ON "class-student"("class_id")',
+        'CREATE INDEX IF NOT EXISTS "homework_user" ON "homework"("user_id", "due_date")',
+        'CREATE INDEX IF NOT EXISTS "homework_class" ON "homework"("class_id", "due_date")',
+        'CREATE INDEX IF NOT EXISTS "events_user" ON "events"("user_id")',
+        'CREATE INDEX IF NOT EXISTS "events_private" ON "events"("private")',
+        'CREATE INDEX IF NOT EXISTS "user_events_event" ON "user-events"("event_id")',
+        'CREATE INDEX IF NOT EXISTS "marks_user" ON "marks"("user_id")',
+    ]),
+    (3, "Store homework set for a class once", split_class_homework),
+    (4, "Add search index for usernames", add_user_search),
+    (5, "Add dashboard snapshots", add_dashboards),
+    (6, "Add collection versions", add_versions),
+    (7, "Add change log for syncing", add_changes),
+    # Class homework has no user_id. With both kinds in the same indexes, SQLite would look class homework up
+    # by user_id IS NULL, reading the homework of every class in the school.
+    (8, "Split the homework indexes into personal and class homework", [
+        'DROP INDEX IF EXISTS "homework_user"',
+        'CREATE INDEX "homework_user" ON "homework"("user_id", "due_date") WHERE "user_id" IS NOT NULL',
+        'DROP INDEX IF EXISTS "homework_class"',
+        'CREATE INDEX "homework_class" ON "homework"("class_id", "due_date") WHERE "user_id" IS NULL',
+    ]),
+    # An index on private alone has two values, so once ANALYZE has run, SQLite guesses half the events are public,
+    # and reads the whole table instead. A partial index knows how many there really are.
+    (9, "Index public events on their own", [
+        'DROP INDEX IF EXISTS "events_private"',
+        'CREATE INDEX "events_public" ON "events"("event_id") WHERE "private" = 0',
+    ]),
+]
+
+
+def get_version(db: sqlite3.Connection) -> int:
+    result = db.execute('SELECT MAX("version") FROM "schema_version"').fetchone()
+    return result[0] or 0
+
+
+def migrate(pool: ConnectionPool, target: Optional[int] = None) -> int:
+    """
+    Brings the database up to date by running every migration it hasn't had yet,
+    or only those up to and including version `target` if it is given.
+
+    This takes a write lock for the whole process, so if several workers start at once,
+    only one of them will run the migrations and the others will wait for it to finish.
+
+    Returns the schema version the database is now at.
+    """
+    with pool.connection() as db:
+        db.execute("""CREATE TABLE IF NOT EXISTS "schema_version" (
+	"version"	INTEGER NOT NULL,
+	"name"	TEXT NOT NULL,
+	"applied_at"	INTEGER NOT NULL,
+	PRIMARY KEY("version")
+)""")
+        db.commit()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            # The version is checked after taking the lock, as another worker may have just migrated.
+            version = get_version(db)
+            for migration_version, name, migration in MIGRATIONS:
+                if migration_version <= version:
+                    continue
+                if target is not None and migration_version > target:
+                    break
+                if callable(migration):
+                    migration(db)
+                else:
+                    for statement in migration:
+                        db.execute(statement)
+                db.execute('INSERT INTO "schema_version"("version", "name", "applied_at") VALUES (?, ?, ?)',
+                           (migration_version, name, int(time())))
+                version = migration_version
+            db.commit()
+        except BaseException:
+            db.rollback()
+            raise
+        return version
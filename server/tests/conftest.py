@@ -0,0 +1,40 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database  # noqa: E402
+from migrations import migrate  # noqa: E402
+
+
+class Databases:
+    """
+    Every DB class, sharing one freshly created and migrated database.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.pool = database.ConnectionPool(path)
+        self.users = database.UsersDB(path, self.pool)
+        self.subjects = database.SubjectsDB(path, self.pool)
+        self.timetables = database.UserSubjectDB(path, self.pool)
+        self.classes = database.ClassDB(path, self.pool)
+        self.class_students = database.ClassStudentDB(path, self.pool)
+        self.homework = database.HomeworkDB(path, self.pool)
+        self.marks = database.MarkDB(path, self.pool)
+        self.events = database.EventDB(path, self.pool)
+        self.user_events = database.UserEventDB(path, self.pool)
+        self.registration_codes = database.RegistrationCodeDB(path, self.pool)
+        migrate(self.pool)
+        self.versions = database.VersionDB(path, self.pool)
+        self.dashboards = database.DashboardDB(path, self.pool)
+        self.changes = database.ChangeDB(path, self.pool)
+
+
+@pytest.fixture
+def dbs(tmp_path):
+    dbs = Databases(str(tmp_path / "test.db"))
+    yield dbs
+    dbs.pool.close()
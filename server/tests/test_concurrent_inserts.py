@@ -0,0 +1,41 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from classes import Permissions, Subject, User
+
+THREADS = 16
+ROWS_PER_THREAD = 25
+
+
+def test_concurrent_inserts_return_their_own_ids(dbs):
+    uid = dbs.users.add_user(User(username="teacher", password="x", salt="s", created_at=0,
+                                  permissions=Permissions.Teacher))
+    # Each kind of row, with how to add one named `name`, and how to read the name back by ID.
+    kinds = {
+        "subject": (lambda name: dbs.subjects.add_subject(Subject(user_id=uid, name=name, teacher="", room="")),
+                    "SELECT lower(name) FROM subjects WHERE subject_id = ?"),
+        "class": (lambda name: dbs.classes.create_class(uid, name),
+                  "SELECT class_name FROM classes WHERE class_id = ?"),
+        "homework": (lambda name: dbs.homework.create_homework(uid, name, 0, ""),
+                     "SELECT name FROM homework WHERE homework_id = ?"),
+        "event": (lambda name: dbs.events.create_event(uid, name, 0, "", True),
+                  "SELECT name FROM events WHERE event_id = ?"),
+        "mark": (lambda name: dbs.marks.add_mark(uid, name, 50, "C"),
+                 "SELECT test_name FROM marks WHERE mark_id = ?"),
+    }
+
+    def add_rows(thread: int) -> list:
+        added = []
+        for i in range(ROWS_PER_THREAD):
+            for kind, (add, _) in kinds.items():
+                name = f"{kind} {thread} {i}"
+                added.append((kind, name, add(name)))
+        return added
+
+    with ThreadPoolExecutor(THREADS) as executor:
+        added = [row for rows in executor.map(add_rows, range(THREADS)) for row in rows]
+
+    for kind in kinds:
+        ids = [row_id for row_kind, _, row_id in added if row_kind == kind]
+        assert len(set(ids)) == len(ids) == THREADS * ROWS_PER_THREAD
+    for kind, name, row_id in added:
+        assert dbs.users._get_raw(kinds[kind][1], (row_id, )) == [(name, )]
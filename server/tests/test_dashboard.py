@@ -0,0 +1,24 @@
+import json
+
+from classes import Permissions, User
+
+DAY = 86400
+# A tuesday, at 9am.
+NOW = 1792540800 + 9 * 3600
+# Due dates and event times are in milliseconds, like the client sends them.
+TODAY = NOW // DAY * DAY * 1000
+
+
+def test_past_items_are_excluded(dbs):
+    student = dbs.users.add_user(User(username="student", password="x", salt="s", created_at=0,
+                                      permissions=Permissions.Student))
+    dbs.homework.create_homework(student, "overdue", TODAY - 30 * DAY * 1000, "")
+    dbs.homework.create_homework(student, "yesterday", TODAY - 1, "")
+    dbs.homework.create_homework(student, "tomorrow", TODAY + DAY * 1000, "")
+    dbs.homework.create_homework(student, "today", TODAY + 3600 * 1000, "")
+    dbs.events.create_event(student, "last month", TODAY - 30 * DAY * 1000, "", True)
+    dbs.events.create_event(student, "next week", TODAY + 7 * DAY * 1000, "", True)
+
+    dashboard = json.loads(dbs.dashboards.get_dashboard(student, NOW))
+    assert [homework["name"] for homework in dashboard["homework"]] == ["today", "tomorrow"]
+    assert [event["name"] for event in dashboard["events"]] == ["next week"]
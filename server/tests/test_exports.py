@@ -0,0 +1,25 @@
+def add_subjects(dbs, count: int) -> None:
+    dbs.subjects._insert_many("subjects", "user_id, name, teacher, room, colour",
+                              ((1, f"Subject {i}", "", "", "#000000") for i in range(count)))
+
+
+def test_iter_reads_every_row_once(dbs):
+    add_subjects(dbs, 30)
+    # 30 rows is an exact number of pages, so the last page is empty.
+    rows = list(dbs.subjects._iter(dbs.subjects.COLUMNS, "subjects", "subject_id", batch_size=10))
+    assert [row[0] for row in rows] == list(range(1, 31))
+    rows = list(dbs.subjects._iter(dbs.subjects.COLUMNS, "subjects", "subject_id", where="name LIKE ?",
+                                   args=("Subject 1%", ), batch_size=4))
+    assert [row[2] for row in rows] == ["Subject 1"] + [f"Subject {i}" for i in range(10, 20)]
+
+
+def test_half_read_exports_do_not_hold_connections(dbs):
+    add_subjects(dbs, 600)
+    # Every connection would be taken if the exports kept theirs until they were finished.
+    dbs.pool.timeout = 1
+    exports = [dbs.subjects.iter_subjects() for _ in range(dbs.pool.size * 2)]
+    for export in exports:
+        next(export)
+    assert len(dbs.subjects._get("subject_id", "subjects")) == 600
+    for export in exports:
+        assert len(list(export)) == 599
@@ -0,0 +1,33 @@
+"""
+Tests checking passwords against stored hashes, including ones which are damaged.
+"""
+import asyncio
+
+import pytest
+
+from hashing import LegacySHA, PasswordHasher, Scrypt
+
+
+@pytest.fixture
+def hasher():
+    # A low cost keeps the tests fast, and the format is the same.
+    hasher = PasswordHasher(Scrypt(n=2 ** 4), legacy=[LegacySHA()], workers=1)
+    yield hasher
+    hasher.close()
+
+
+def test_correct_password(hasher):
+    stored = asyncio.run(hasher.hash("password", "salt"))
+    assert asyncio.run(hasher.verify("password", "salt", stored)) == (True, False)
+    assert asyncio.run(hasher.verify("wrong", "salt", stored)) == (False, False)
+
+
+@pytest.mark.parametrize("stored", [
+    "scrypt$16$8$1",
+    "scrypt$16$8$1$",
+    "scrypt$sixteen$8$1$abcd",
+    "scrypt$16$8$1$ab$cd",
+    "scrypt$3$8$1$abcd",
+])
+def test_malformed_hash_fails_to_verify(hasher, stored):
+    assert asyncio.run(hasher.verify("password", "salt", stored)) == (False, False)
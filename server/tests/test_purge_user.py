@@ -0,0 +1,98 @@
+import pytest
+
+from classes import Permissions, User
+TEACHER_ROWS = 1500
+STUDENT_ROWS = 100
+# The IDs of the student's own homework and events, which are added after the teacher's.
+STUDENT_IDS = range(TEACHER_ROWS + 1, TEACHER_ROWS + STUDENT_ROWS + 1)
+
+# What belongs to a user in each table, as a query for their rows.
+OWNED = {
+    "`users-subjects`": "SELECT * FROM `users-subjects` WHERE user_id = ?",
+    "marks": "SELECT * FROM marks WHERE user_id = ?",
+    "homework": "SELECT * FROM homework WHERE user_id = ? "
+                "OR class_id IN (SELECT class_id FROM classes WHERE teacher_id = ?1)",
+    "`homework-completions`": "SELECT * FROM `homework-completions` WHERE student_id = ?",
+    "events": "SELECT * FROM events WHERE user_id = ?",
+    "`user-events`": "SELECT * FROM `user-events` WHERE user_id = ?",
+    "classes": "SELECT * FROM classes WHERE teacher_id = ?",
+    "`class-student`": "SELECT * FROM `class-student` WHERE student_id = ?",
+    "users": "SELECT * FROM users WHERE uid = ?",
+}
+
+
+def add_user(dbs, username: str, permissions: int) -> User:
+    user = User(username=username, password="x", salt="s", created_at=0, permissions=permissions)
+    user.uid = dbs.users.add_user(user)
+    return user
+
+
+def fill(dbs, uid: int, count: int) -> None:
+    """
+    Gives a user `count` of each kind of row which belongs to them.
+    """
+    dbs.users._insert_many("`users-subjects`", "user_id, subject_id, day, period",
+                           ((uid, 1, 0, period) for period in range(count)))
+    dbs.users._insert_many("marks", "user_id, test_name, mark, grade", ((uid, f"Test {i}", 50, "C") for i in range(count)))
+    first = dbs.users._get_raw("SELECT COALESCE(MAX(homework_id), 0) + 1 FROM homework")[0][0]
+    dbs.users._insert_many("homework", "homework_id, name, user_id, due_date",
+                           ((first + i, f"Homework {i}", uid, 0) for i in range(count)))
+    dbs.users._insert_many("`homework-completions`", "homework_id, student_id",
+                           ((first + i, uid) for i in range(count)))
+    first = dbs.users._get_raw("SELECT COALESCE(MAX(event_id), 0) + 1 FROM events")[0][0]
+    dbs.users._insert_many("events", "event_id, user_id, name, time, private",
+                           ((first + i, uid, f"Event {i}", 0, 1) for i in range(count)))
+    dbs.users._insert_many("`user-events`", "user_id, event_id", ((uid, first + i) for i in range(count)))
+
+
+def snapshot(dbs, uid: int) -> dict:
+    return {table: sorted(dbs.users._get_raw(query, (uid, ))) for table, query in OWNED.items()}
+
+
+@pytest.fixture
+def users(dbs):
+    teacher = add_user(dbs, "teacher", Permissions.Teacher)
+    student = add_user(dbs, "student", Permissions.Student)
+    fill(dbs, teacher.uid, TEACHER_ROWS)
+    fill(dbs, student.uid, STUDENT_ROWS)
+    # The teacher's classes, with the student in them and homework set for them.
+    for i in range(10):
+        class_id = dbs.classes._insert("classes", "teacher_id, class_name", (teacher.uid, f"Class {i}"))
+        dbs.class_students._insert("`class-student`", "student_id, class_id", (student.uid, class_id))
+        for j in range(100):
+            homework_id = dbs.homework.create_homework_for_class(class_id, f"Class homework {j}", 0, "")
+            dbs.homework._insert("`homework-completions`", "homework_id, student_id", (homework_id, student.uid))
+    # The student going to the teacher's events, and the other way round.
+    dbs.users._insert_many("`user-events`", "user_id, event_id",
+                           ((student.uid, event_id) for event_id in range(1, 101)))
+    dbs.users._insert_many("`user-events`", "user_id, event_id",
+                           ((teacher.uid, event_id) for event_id in STUDENT_IDS))
+    return teacher, student
+
+
+def test_purge_user_deletes_everything(dbs, users):
+    teacher, student = users
+    assert sum(map(len, snapshot(dbs, teacher.uid).values())) > 10000
+    expected = snapshot(dbs, student.uid)
+    # Only what linked the student to the teacher's classes and events should go.
+    expected["`class-student`"] = []
+    expected["`homework-completions`"] = [(homework_id, student.uid) for homework_id in STUDENT_IDS]
+    expected["`user-events`"] = [(student.uid, event_id) for event_id in STUDENT_IDS]
+
+    dbs.users.purge_user(teacher, delete_account=True)
+
+    assert all(rows == [] for rows in snapshot(dbs, teacher.uid).values())
+    assert snapshot(dbs, student.uid) == expected
+
+
+def test_purge_user_rolls_back_on_failure(dbs, users, monkeypatch):
+    teacher, student = users
+    before = snapshot(dbs, teacher.uid), snapshot(dbs, student.uid)
+
+    def fail(user):
+        raise RuntimeError("Failed to delete the user.")
+    monkeypatch.setattr(dbs.users, "delete_user", fail)
+    with pytest.raises(RuntimeError):
+        dbs.users.purge_user(teacher, delete_account=True)
+
+    assert (snapshot(dbs, teacher.uid), snapshot(dbs, student.uid)) == before
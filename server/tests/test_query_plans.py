@@ -0,0 +1,172 @@
+"""
+Checks that the queries the server runs most often are answered from the indexes meant for them,
+rather than by reading a whole table or a large part of one.
+
+The plans are checked on a database full of generated data, both before and after ANALYZE,
+since SQLite can choose differently once it knows how the data is spread out.
+"""
+import re
+
+import pytest
+
+import database
+from conftest import Databases
+from generator import Scale, generate
+
+# Things which show up as a SCAN in a plan, but don't read a table which grows with the data.
+ALLOWED_SCANS = (
+    "json_each",
+    "sqlite_sequence",
+    "sqlite_master",
+    "VIRTUAL TABLE INDEX 0:M",
+    # This only holds public events, all of which are wanted whenever it is read.
+    "USING INDEX events_public",
+)
+
+# The indexes each named statement should use. PRIMARY KEY means a lookup by rowid or primary key.
+STATEMENT_INDEXES = {
+    "UsersDB.by_username": {"sqlite_autoindex_users_1"},
+    "UsersDB.by_uid": {"PRIMARY KEY"},
+    "UsersDB.by_session": {"users_session"},
+    "SubjectsDB.by_id": {"PRIMARY KEY"},
+    "SubjectsDB.by_user": {"subjects_user"},
+    "SubjectsDB.by_name": {"subjects_user"},
+    "SubjectsDB.update": {"PRIMARY KEY"},
+    "UserSubjectDB.by_period": {"sqlite_autoindex_users-subjects_1"},
+    "UserSubjectDB.timetable": {"sqlite_autoindex_users-subjects_1"},
+    "UserSubjectDB.timetable_subjects": {"sqlite_autoindex_users-subjects_1", "PRIMARY KEY"},
+    "ClassDB.get": {"PRIMARY KEY"},
+    "ClassDB.by_teacher": {"classes_teacher"},
+    "HomeworkDB.get": {"PRIMARY KEY"},
+    "EventDB.get": {"PRIMARY KEY"},
+    "MarkDB.get": {"PRIMARY KEY"},
+    "MarkDB.update": {"PRIMARY KEY"},
+    "VersionDB.get": {"PRIMARY KEY"},
+    "DashboardDB.get": {"PRIMARY KEY"},
+    "DashboardDB.save": set(),
+    "DashboardDB.periods": {"sqlite_autoindex_users-subjects_1", "PRIMARY KEY"},
+    "DashboardDB.homework": {"homework_user", "sqlite_autoindex_class-student_1", "homework_class",
+                             "sqlite_autoindex_homework-completions_1"},
+    "DashboardDB.marks": {"marks_user"},
+    "DashboardDB.events": {"events_public", "events_user"},
+    "ChangeDB.latest": set(),
+    "ChangeDB.oldest": set(),
+    "ChangeDB.changes": {"changes_user"},
+    "ChangeDB.homework": {"homework_user", "sqlite_autoindex_class-student_1", "homework_class",
+                          "sqlite_autoindex_homework-completions_1"},
+    "ChangeDB.marks": {"marks_user"},
+    "ChangeDB.events": {"events_public", "events_user"},
+    "ChangeDB.changed_events": {"PRIMARY KEY"},
+    "ChangeDB.timetable": {"sqlite_autoindex_users-subjects_1", "PRIMARY KEY"},
+    "ChangeDB.prune": {"PRIMARY KEY"},
+}
+
+STATEMENTS = [
+    (cls, name)
+    for cls in vars(database).values()
+    if isinstance(cls, type) and issubclass(cls, database.DB) and cls is not database.DB
+    for name in cls.STATEMENTS
+]
+
+# Hot queries which are built when they are run, as what they run and the indexes that should use.
+HOT_QUERIES = {
+    "get_homework_for_user": (
+        lambda dbs, ids: dbs.homework.get_homework_for_user(ids["student"]),
+        {"homework_user", "sqlite_autoindex_class-student_1", "homework_class", "sqlite_autoindex_homework-completions_1"}),
+    "get_homework_for_user page": (
+        lambda dbs, ids: dbs.homework.get_homework_for_user(ids["student"], after=(0, 0), limit=20),
+        {"homework_user", "sqlite_autoindex_class-student_1", "homework_class", "sqlite_autoindex_homework-completions_1"}),
+    "get_homework_for_class": (
+        lambda dbs, ids: dbs.homework.get_homework_for_class(ids["class"]),
+        {"homework_class"}),
+    "get_class_overviews": (
+        lambda dbs, ids: dbs.classes.get_class_overviews(dbs.classes.get_classes(ids["teacher"])),
+        {"classes_teacher", "class_student_class", "PRIMARY KEY", "homework_class",
+         "sqlite_autoindex_homework-completions_1", "sqlite_autoindex_class-student_1"}),
+    "get_students_in_class": (
+        lambda dbs, ids: dbs.class_students.get_students_in_class(ids["class"]),
+        {"class_student_class"}),
+    "get_events": (
+        lambda dbs, ids: dbs.events.get_events(),
+        {"events_public"}),
+    "get_events page": (
+        lambda dbs, ids: dbs.events.get_events(after=1, limit=50),
+        {"events_public"}),
+    "get_events_by_user": (
+        lambda dbs, ids: dbs.events.get_events_by_user(ids["student"], after=1, limit=50),
+        {"events_user"}),
+    "get_marks_for_user": (
+        lambda dbs, ids: dbs.marks.get_marks_for_user(ids["student"]),
+        {"marks_user"}),
+    "get_marks_for_user page": (
+        lambda dbs, ids: dbs.marks.get_marks_for_user(ids["student"], after=1, limit=50),
+        {"marks_user"}),
+    "search_users": (
+        lambda dbs, ids: dbs.users.search_users("student1", exclude_uid=ids["teacher"]),
+        {"PRIMARY KEY"}),
+}
+
+
+@pytest.fixture(scope="module", params=["unanalyzed", "analyzed"])
+def school(request, tmp_path_factory):
+    path = str(tmp_path_factory.mktemp(request.param) / "school.db")
+    generate(path, Scale(teachers=100, students=3000))
+    database.close_pools()
+    dbs = Databases(path)
+    if request.param == "analyzed":
+        with dbs.pool.connection() as db:
+            db.execute("ANALYZE")
+    with dbs.pool.connection() as db:
+        teacher, class_id, student = db.execute("""SELECT c.teacher_id, c.class_id, cs.student_id
+FROM classes AS c JOIN `class-student` AS cs ON cs.class_id = c.class_id LIMIT 1""").fetchone()
+    yield dbs, {"teacher": teacher, "class": class_id, "student": student}
+    dbs.pool.close()
+
+
+def placeholders(statement: str) -> int:
+    numbered = [int(number) for number in re.findall(r"\?(\d+)", statement)]
+    return max(numbered) if numbered else statement.count("?")
+
+
+def explain(dbs, statement: str, args: tuple) -> list:
+    with dbs.pool.connection() as db:
+        return [row[3] for row in db.execute("EXPLAIN QUERY PLAN " + statement, args)]
+
+
+def indexes_used(plan: list) -> set:
+    return {match.group(1) or "PRIMARY KEY"
+            for line in plan
+            for match in re.finditer(r"USING (?:COVERING )?INDEX (\S+)|USING (?:INTEGER )?PRIMARY KEY", line)}
+
+
+def full_scans(plan: list) -> list:
+    return [line for line in plan if line.startswith("SCAN") and not any(allowed in line for allowed in ALLOWED_SCANS)]
+
+
+@pytest.mark.parametrize("cls, name", STATEMENTS, ids=[f"{cls.__name__}.{name}" for cls, name in STATEMENTS])
+def test_statement_uses_its_index(school, cls, name):
+    dbs, _ = school
+    key = f"{cls.__name__}.{name}"
+    assert key in STATEMENT_INDEXES, f"Add the indexes {key} should use to STATEMENT_INDEXES."
+    statement = cls.STATEMENTS[name]
+    plan = explain(dbs, statement, (None, ) * placeholders(statement))
+    assert not full_scans(plan), f"{key} reads a whole table: {plan}"
+    assert indexes_used(plan) == STATEMENT_INDEXES[key], f"{key} has an unexpected plan: {plan}"
+
+
+@pytest.mark.parametrize("name", HOT_QUERIES)
+def test_hot_query_uses_its_index(school, monkeypatch, name):
+    dbs, ids = school
+    call, expected = HOT_QUERIES[name]
+    statements = []
+    run = dbs.pool.run
+
+    def record(db, statement_name, statement, args=(), *rest, **kwargs):
+        statements.append((statement, args))
+        return run(db, statement_name, statement, args, *rest, **kwargs)
+    monkeypatch.setattr(dbs.pool, "run", record)
+    call(dbs, ids)
+    assert statements
+    plan = [line for statement, args in statements for line in explain(dbs, statement, args)]
+    assert not full_scans(plan), f"{name} reads a whole table: {plan}"
+    assert indexes_used(plan) == expected, f"{name} has an unexpected plan: {plan}"
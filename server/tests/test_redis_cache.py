@@ -0,0 +1,206 @@
+"""
+Tests RedisCache against an in-process stand-in for Redis, which only has the parts of redis-py it uses.
+"""
+import fnmatch
+import queue
+import threading
+import time
+
+import pytest
+
+from cache import RedisCache
+
+
+class FakeRedis:
+    """
+    The data and subscriptions shared by every client, as a Redis server would hold them.
+    """
+
+    def __init__(self):
+        self.data = {}
+        self.subscribers = {}
+        self.lock = threading.Lock()
+        # Called with the key whenever a value is set, so a test can make something happen at that moment.
+        self.on_set = None
+
+    def client(self) -> "FakeClient":
+        return FakeClient(self)
+
+    def drop_subscribers(self) -> None:
+        """
+        Cuts every subscriber off, as if the connection to Redis had been lost.
+        """
+        with self.lock:
+            subscribers, self.subscribers = self.subscribers, {}
+        for pubsubs in subscribers.values():
+            for pubsub in pubsubs:
+                pubsub.messages.put(ConnectionError("Connection closed by server."))
+
+
+class FakePubSub:
+    def __init__(self, client: "FakeClient"):
+        self.client = client
+        self.server = client.server
+        self.messages = queue.Queue()
+
+    def subscribe(self, channel: str) -> None:
+        if not self.client.can_subscribe:
+            raise ConnectionError("Connection refused.")
+        with self.server.lock:
+            self.server.subscribers.setdefault(channel, []).append(self)
+
+    def listen(self):
+        while True:
+            message = self.messages.get()
+            if message is None:
+                return
+            if isinstance(message, Exception):
+                raise message
+            yield message
+
+    def close(self) -> None:
+        self.messages.put(None)
+
+
+class FakeClient:
+    def __init__(self, server: FakeRedis):
+        self.server = server
+        self.can_subscribe = True
+
+    def get(self, key):
+        with self.server.lock:
+            return self.server.data.get(key)
+
+    def set(self, key, value, px=None) -> None:
+        with self.server.lock:
+            self.server.data[key] = value.encode()
+        if self.server.on_set is not None:
+            self.server.on_set(key)
+
+    def delete(self, *keys) -> None:
+        with self.server.lock:
+            for key in keys:
+                self.server.data.pop(key, None)
+
+    def incr(self, key) -> int:
+        with self.server.lock:
+            value = int(self.server.data.get(key, 0)) + 1
+            self.server.data[key] = str(value).encode()
+            return value
+
+    def scan_iter(self, match):
+        with self.server.lock:
+            return [key for key in self.server.data if fnmatch.fnmatch(key, match)]
+
+    def publish(self, channel: str, message: str) -> None:
+        with self.server.lock:
+            pubsubs = list(self.server.subscribers.get(channel, []))
+        for pubsub in pubsubs:
+            pubsub.messages.put({"type": "message", "data": message.encode()})
+
+    def pubsub(self, ignore_subscribe_messages: bool = True) -> FakePubSub:
+        return FakePubSub(self)
+
+
+def wait_for(condition, timeout: float = 2.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return condition()
+
+
+@pytest.fixture
+def server():
+    return FakeRedis()
+
+
+@pytest.fixture
+def workers(server, monkeypatch):
+    monkeypatch.setattr(RedisCache, "RECONNECT_DELAY", 0.01)
+    caches = [RedisCache("sessions", client=server.client()) for _ in range(2)]
+    yield caches
+    for cache in caches:
+        cache.close()
+
+
+def test_delete_removes_other_workers_copies(workers):
+    first, second = workers
+    first.set("token", (1, "student"))
+    assert second.get("token") == (1, "student")
+    assert second.local.get("token") == (1, "student")
+    first.delete("token")
+    assert wait_for(lambda: second.local.get("token") is None)
+    assert second.get("token") is None
+
+
+def test_clear_removes_other_workers_copies(workers):
+    first, second = workers
+    first.set("a", 1)
+    first.set("b", 2)
+    assert (second.get("a"), second.get("b")) == (1, 2)
+    first.clear()
+    assert wait_for(lambda: second.local.get("a") is None and second.local.get("b") is None)
+    assert (second.get("a"), second.get("b")) == (None, None)
+
+
+def test_set_after_a_delete_is_dropped(workers):
+    first, second = workers
+    generation = second.generation()
+    first.delete("token")
+    second.set("token", (1, "student"), generation)
+    assert first.get("token") is None
+    assert second.get("token") is None
+
+
+def test_set_racing_a_delete_is_dropped(server, workers):
+    first, second = workers
+    generation = second.generation()
+    # Another worker deletes the key just after this one stored it, but before it checked the generation again.
+    server.on_set = lambda key: first.delete("token")
+    second.set("token", (1, "student"), generation)
+    server.on_set = None
+    assert first.get("token") is None
+    assert second.get("token") is None
+    assert second.local.get("token") is None
+
+
+def subscribers(server: FakeRedis) -> int:
+    with server.lock:
+        return len(server.subscribers.get("sessions:invalidate", []))
+
+
+def test_listener_survives_a_dropped_connection(server, workers, caplog):
+    first, second = workers
+    first.set("token", (1, "student"))
+    assert second.get("token") == (1, "student")
+    second.client.can_subscribe = False
+    server.drop_subscribers()
+    assert wait_for(lambda: subscribers(server) == 1)
+    # This delete is published while the second worker can't listen, so it never hears about it.
+    first.delete("token")
+    assert second.local.get("token") == (1, "student")
+    second.client.can_subscribe = True
+    # Once it has reconnected, it can't trust anything it held locally.
+    assert wait_for(lambda: subscribers(server) == 2)
+    assert wait_for(lambda: second.local.get("token") is None)
+    assert "Lost the connection to Redis" in caplog.text
+    # Deletes are heard again after reconnecting.
+    first.set("other", 1)
+    assert second.get("other") == 1
+    first.delete("other")
+    assert wait_for(lambda: second.local.get("other") is None)
+
+
+def test_close_stops_the_listener(server):
+    cache = RedisCache("sessions", client=server.client())
+    cache.close()
+    cache._listener.join(timeout=2)
+    assert not cache._listener.is_alive()
+
+
+def test_needs_redis_without_a_client(monkeypatch):
+    monkeypatch.setattr("cache.redis", None)
+    with pytest.raises(RuntimeError, match="redis package"):
+        RedisCache("sessions", url="redis://localhost:6379")
@@ -0,0 +1,43 @@
+from cache import LRUCache
+from classes import OAuthToken, Permissions, User
+from database import UsersDB
+
+
+def test_set_is_skipped_after_a_delete():
+    cache = LRUCache()
+    generation = cache.generation()
+    cache.delete("token")
+    cache.set("token", (1, ), generation)
+    assert cache.get("token") is None
+    cache.set("token", (1, ), cache.generation())
+    assert cache.get("token") == (1, )
+
+
+def test_logout_during_lookup_is_not_cached(dbs):
+    users = UsersDB(dbs.path, dbs.pool, LRUCache())
+    user = User(username="student", password="x", salt="s", created_at=0, permissions=Permissions.Student,
+                session=OAuthToken(access_token="token"))
+    users.add_user(user)
+    query = users._query
+
+    def logout_while_querying(name, args=()):
+        result = query(name, args)
+        # Another request logs out after this one has read the row, but before it is cached.
+        users.set_session(user.uid, None)
+        users.forget_session("token")
+        return result
+    users._query = logout_while_querying
+    assert users.get_user_from_session("token").uid == user.uid
+
+    users._query = query
+    assert users.get_user_from_session("token") is None
+
+
+def test_session_cache_has_no_password(dbs):
+    cache = LRUCache()
+    users = UsersDB(dbs.path, dbs.pool, cache)
+    users.add_user(User(username="student", password="hash", salt="salt", created_at=0,
+                        permissions=Permissions.Student, session=OAuthToken(access_token="token")))
+    user = users.get_user_from_session("token")
+    assert (user.username, user.password, user.salt) == ("student", "", "")
+    assert "hash" not in cache.get("token") and "salt" not in cache.get("token")